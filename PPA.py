@@ -8,297 +8,265 @@ Created on Sun Oct 12 22:40:05 2014
 import sys
 import time
 
+# when we started, and the (name, start, end) seconds of each startup
+# phase since then
+START_TIME = time.time()
+STARTUP = []
 
-class RequestError(Exception):
+
+def startup_phase(name, began=None):
     '''
-    An exception that happens when talking to the plate solver
+    note that a phase of the startup is over; it began when the one
+    before it ended, unless we are told otherwise
     '''
-    pass
+    now = time.time() - START_TIME
+    if began is None:
+        began = STARTUP[-1][2] if STARTUP else 0.0
+    STARTUP.append((name, began, now))
 
 
-def json2python(json):
+def startup_report():
     '''
-    translates JSON to python
+    how long the startup phases took, as text
     '''
-    import ujson
-    try:
-        return ujson.loads(json)
-    except:
-        pass
-    return None
+    lines = []
+    for name, began, ended in STARTUP:
+        lines.append('%-20s %6.0f ms  (done at %6.0f ms)'
+                     % (name, (ended - began)*1000, ended*1000))
+    return '\n'.join(lines)
+
+from ppa_nova import NovaClient, RequestError, get_client
+from ppa_nova import Cancelled, SolveFailed, PollTimeout, TransportError
+from ppa_nova import solve_many
+from ppa_local import LocalSolveError, solve_local, solve_local_many
+from ppa_local import probe
+from ppa_cache import SolutionCache, hash_of
+from ppa_journal import JobJournal
+from ppa_engine import POLE_LIMIT
+import ppa_metrics
+from ppa_metrics import span
+from contextlib import contextmanager
 
 
-def python2json(pyd):
+def stat_bar(self, txt):
     '''
-    translates python  to JSON
+    Update the Status bar
     '''
-    import ujson
-    return ujson.dumps(pyd)
-
+    self.stat_msg = txt
+    self.wstat.config(text=self.stat_msg)
+    self.wstat.update()
 
-class NovaClient(object):
+def keep_alive(self):
     '''
-    nova.astrometry.net client
+    lets the window handle its events during a wait. If it has gone (it
+    can't be closed while we are busy, but the window manager may kill
+    it) the wait is cancelled
     '''
-    default_url = 'http://nova.astrometry.net/api/'
-
-    def __init__(self, apiurl=default_url):
-        self.session = None
-        self.apiurl = apiurl
-
-    def get_url(self, service):
-        '''
-        constructs URL for a plate-solver service
-        '''
-        return self.apiurl + service
-
-    def send_request(self, service, args={}, file_args=None):
-        '''
-        service: string
-        args: dict
-        '''
-        from email.mime.base import MIMEBase
-        from email.mime.multipart import MIMEMultipart
-        from email.encoders import encode_noop
-        from urllib2 import urlopen
-        from urllib2 import Request
-        from urllib2 import HTTPError
-        from urllib import urlencode
-        from email.mime.application import MIMEApplication
-        if self.session is not None:
-            args.update({'session': self.session})
-        # print 'Python:', (args)
-        json = python2json(args)
-        # print 'Sending json:', json
-        url = self.get_url(service)
-        print 'Sending to URL:', url
-        # If we're sending a file, format a multipart/form-data
-        if file_args is not None:
-            ma1 = MIMEBase('text', 'plain')
-            ma1.add_header('Content-disposition',
-                           'form-data; name="request-json"')
-            ma1.set_payload(json)
-            ma2 = MIMEApplication(file_args[1], 'octet-stream', encode_noop)
-            ma2.add_header('Content-disposition',
-                           'form-data; name="file"; filename="%s"'
-                           % file_args[0])
-            # msg.add_header('Content-Disposition', 'attachment',
-            # filename='bud.gif')
-            # msg.add_header('Content-Disposition', 'attachment',
-            # filename=('iso-8859-1', '', 'FuSballer.ppt'))
-            mpa = MIMEMultipart('form-data', None, [ma1, ma2])
-            # Makie a custom generator to format it the way we need.
-            from cStringIO import StringIO
-            from email.generator import Generator
-
-            class MyGenerator(Generator):
-                '''
-                not sure why we need this, copied from nova's example code
-                '''
-                def __init__(self, fp, root=True):
-                    Generator.__init__(self, fp, mangle_from_=False,
-                                       maxheaderlen=0)
-                    self.root = root
-
-                def _write_headers(self, msg):
-                    # We don't want to write the top-level headers;
-                    # they go into Request(headers) instead.
-                    if self.root:
-                        return
-                    # We need to use \r\n line-terminator, but Generator
-                    # doesn't provide the flexibility to override, so we
-                    # have to copy-n-paste-n-modify.
-                    for hoo, voo in msg.items():
-                        print >> self._fp, ('%s: %s\r\n' % (hoo, voo)),
-                        # A blank line always separates headers from body
-                    print >> self._fp, '\r\n',
-                    # The _write_multipart method calls "clone" for the
-                    # subparts.  We hijack that, setting root=False
-
-                def clone(self, fp):
-                    return MyGenerator(fp, root=False)
-            fpo = StringIO()
-            gen = MyGenerator(fpo)
-            gen.flatten(mpa)
-            data = fpo.getvalue()
-            headers = {'Content-type': mpa.get('Content-type')}
-        else:
-            # Else send x-www-form-encoded
-            data = {'request-json': json}
-            # print 'Sending form data:', data
-            data = urlencode(data)
-            # print 'Sending data:', data
-            headers = {}
-        request = Request(url=url, headers=headers, data=data)
-        try:
-            fle = urlopen(request)
-            txt = fle.read()
-            # DEBUG print 'Got json:', txt
-            result = json2python(txt)
-            # DEBUG print 'Got result:', result
-            stat = result.get('status')
-            # DEBUG print 'Got status:', stat
-            if stat == 'error':
-                errstr = result.get('errormessage', '(none)')
-                raise RequestError('server error message: ' + errstr)
-            return result
-        except HTTPError, err:
-            print 'HTTPError', err
-            txt = err.read()
-            open('err.html', 'wb').write(txt)
-            print 'Wrote error text to err.html'
-
-    def login(self, apikey):
-        '''
-        Logs us into the plate-solver and gets a session key
-        '''
-        import string
-        args = {'apikey': string.strip(apikey)}
-        result = self.send_request('login', args)
-        sess = result.get('session')
-        print 'Got session:', sess
-        if not sess:
-            raise RequestError('no session in result')
-        self.session = sess
-
-    def _get_upload_args(self, **kwargs):
-        '''
-        returns the specified solving options
-        '''
-        args = {}
-        lkdt = [('allow_commercial_use', 'd', str),
-                ('allow_modifications', 'd', str),
-                ('publicly_visible', 'y', str),
-                ('scale_units', None, str),
-                ('scale_type', None, str),
-                ('scale_lower', None, float),
-                ('scale_upper', None, float),
-                ('scale_est', None, float),
-                ('scale_err', None, float),
-                ('center_ra', None, float),
-                ('center_dec', None, float),
-                ('radius', None, float),
-                ('downsample_factor', None, int),
-                ('tweak_order', None, int),
-                ('crpix_center', None, bool), ]
-        for key, default, typ in lkdt:
-            # image_width, image_height
-            if key in kwargs:
-                val = kwargs.pop(key)
-                val = typ(val)
-                args.update({key: val})
-            elif default is not None:
-                args.update({key: default})
-        # print 'Upload args:', args
-        return args
-
-    def upload(self, fne, **kwargs):
-        '''
-        uploads an image file
-        '''
-        args = self._get_upload_args(**kwargs)
-        try:
-            fle = open(fne, 'rb')
-            result = self.send_request('upload', args, (fne, fle.read()))
-            return result
-        except IOError:
-            print 'File %s does not exist' % fne
-            raise
+    try:
+        self.update()
+    except TclError:
+        self.cancel_solve = True
 
-    def myjobs(self):
-        '''
-        queries server for our jobs
-        '''
-        result = self.send_request('myjobs/')
-        return result['jobs']
 
-    def job_status(self, job_id, justdict=False):
-        '''
-        queries server to see if a job is finished
-        '''
-        result = self.send_request('jobs/%s' % job_id)
-        if justdict:
-            return result
-        stat = result.get('status')
-        if stat == 'success':
-            return stat
-        return stat
+@contextmanager
+def busy(self):
+    '''
+    while a solve, or a wait for one, keeps the window alive, the
+    Operations buttons and RA axis from frames are disabled, so that none
+    of them starts another from within it. Quitting waits for its end
+    '''
+    self.busy_depth = self.busy_depth + 1
+    if self.busy_depth == 1:
+        self.busy_states = dict([(widget, str(widget.cget('state')))
+                                 for widget in self.operations()])
+        for widget in self.busy_states:
+            widget.configure(state='disabled')
+        self.filemenu.entryconfig(self.frames_entry, state='disabled')
+    try:
+        yield
+    finally:
+        self.busy_depth = self.busy_depth - 1
+        if self.busy_depth == 0:
+            if self.quitting is not None:
+                # once the callback that made us busy has returned
+                self.after_idle(self.quitting)
+            else:
+                for widget, state in self.busy_states.items():
+                    widget.configure(state=state)
+                self.filemenu.entryconfig(self.frames_entry, state='normal')
+            self.busy_states = {}
 
-    def sub_status(self, sub_id, justdict=False):
-        '''
-        queries server for submission status
-        '''
-        result = self.send_request('submissions/%s' % sub_id)
-        if justdict:
-            return result
-        return result.get('status')
 
-    def jobs_by_tag(self, tag, exact):
+def in_background(self, func):
+    '''
+    calls func away from the window, keeping the window alive until it
+    is done. Returns what func returns
+    '''
+    import threading
+    import time
+    outcome = {}
+
+    def work():
         '''
-        not sure what that does
+        the call, in its own thread
         '''
-        from urllib import quote
-        exact_option = 'exact=yes' if exact else ''
-        result = self.send_request('jobs_by_tag?query=%s&%s'
-                                   % (quote(tag.strip()), exact_option), {}, )
-        return result
-
-
-def stat_bar(self, txt):
+        try:
+            outcome['result'] = func()
+        except Exception, err:
+            outcome['error'] = err
+    with busy(self):
+        thr = threading.Thread(target=work)
+        thr.daemon = True
+        thr.start()
+        while thr.is_alive():
+            keep_alive(self)
+            time.sleep(0.05)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+# how far (degrees) from the Celestial Pole the solvers look, before
+# we know the field of view: as far as an image can be and still be used
+POLE_SEARCH = POLE_LIMIT
+# how far (degrees) beyond the field of view they look
+HINT_MARGIN = 1.0
+
+
+def position_hint(self, hint=None):
     '''
-    Update the Status bar
+    where the solvers should look for an image, (RA, Dec, radius) in
+    degrees: around the previous frame for the improvement image (only
+    the Alt/Az knobs moved since), around the Celestial Pole for the
+    others (turning in RA swings the field around it). None to search
+    the whole sky
     '''
-    self.stat_msg = txt
-    self.wstat.config(text=self.stat_msg)
-    self.wstat.update()
+    import os
+    import numpy
+    from ppa_catalog import footprint, unit_vectors
+    from ppa_engine import celestial_pole
+    from ppa_wcs import read_records
+    if self.restrict_position.get() != 1:
+        return None
+    done = []
+    for wcsfn in (self.vwcs_fn, self.hwcs_fn, self.iwcs_fn):
+        try:
+            done.append((os.path.getmtime(wcsfn), wcsfn))
+        except OSError:
+            pass
+    prev = None
+    if done:
+        try:
+            rec = read_records([max(done)[1]])[0]
+            prev = footprint(rec.wcs(), rec.width, rec.height)
+        except Exception, err:
+            print "Couldn't read the previous plate solution", err
+    if hint == 'i' and prev is not None:
+        return prev[0], prev[1], prev[2] + HINT_MARGIN
+    hemi = self.hemi
+    if hemi is None and prev is not None:
+        hemi = 'N' if prev[1] > 0 else 'S'
+    if hemi is None:
+        hemi = self.last_hemi
+    if hemi is None:
+        return None
+    pole = celestial_pole(hemi)[0]
+    if prev is None:
+        return pole[0], pole[1], POLE_SEARCH
+    vecs = unit_vectors([pole[0], prev[0]], [pole[1], prev[1]])
+    off = numpy.degrees(numpy.arccos(numpy.clip(numpy.dot(vecs[0], vecs[1]),
+                                                -1.0, 1.0)))
+    return pole[0], pole[1], min(180.0, off + prev[2] + HINT_MARGIN)
+
+
+def local_options(self, hint=None):
+    '''
+    The solve-field options from the Settings
+    '''
+    binning = self.binning.get()
+    opts = {'shell': self.local_shell.get(),
+            'configfile': self.local_configfile.get(),
+            'downscale': self.local_downscale.get(),
+            'xtra': self.local_xtra.get(),
+            'xylist': self.send_stars.get() == 1,
+            'binning': binning}
+    if self.havescale and self.restrict_scale.get()==1:
+        # the solver sees binned pixels
+        opts.update(units='app', low=self.scale*binning*0.95,
+                    high=self.scale*binning*1.05)
+    elif self.local_scale_units.get() == 'arcsecperpix':
+        opts.update(units='arcsecperpix',
+                    low=self.local_scale_low.get()*binning,
+                    high=self.local_scale_hi.get()*binning)
+    elif self.local_scale_units.get():
+        opts.update(units=self.local_scale_units.get(),
+                    low=self.local_scale_low.get(),
+                    high=self.local_scale_hi.get())
+    pos = position_hint(self, hint)
+    if pos is not None:
+        opts.update(ra=pos[0], dec=pos[1], radius=pos[2])
+    return opts
+
 
 def limg2wcs(self, filename, wcsfn, hint):
-    import os
+    '''
+    Plate solves one image with the local solver
+    '''
     import time
     t_start = time.time()
-    if (('OSTYPE' in os.environ and os.environ['OSTYPE']=='linux') or
-        (os.uname()[0]=='Linux') or
-        ('OSTYPE' in os.environ and os.environ['OSTYPE']=='darwin') or
-        ('OS'     in os.environ and os.environ['OS']    =='Windows_NT')):
-        # Cygwin local or Linux local
-        if True:
-            # first rough estimate of scale
-            print '___________________________________________________________'
-            cmd = 'solve-field -b ' + self.local_configfile.get()
-            if self.havescale and self.restrict_scale.get()==1:
-                up_lim = self.scale*1.05
-                lo_lim = self.scale*0.95
-                cmd = cmd + (' -u app -L %.2f -H %.2f ' % (lo_lim,  up_lim))
-            else:
-                cmd = cmd + ' -u ' + self.local_scale_units.get()
-                cmd = cmd + (' -L %.2f' % self.local_scale_low.get())
-                cmd = cmd + (' -H %.2f' % self.local_scale_hi.get())
-            if self.local_downscale.get() != 1:    
-                cmd = cmd + (' -z %d' % self.local_downscale.get())
-            cmd = cmd + ' ' + self.local_xtra.get()
-            cmd = cmd + ' -O '
-            cmd = cmd + ' \\"%s\\"'
-            template = ((self.local_shell.get() % cmd))
-            # print template
-            cmd = (template % filename)
-            print cmd
-            os.system(cmd)
-            self.update_scale(hint)
-            print '___________________________________________________________'
+    opts = local_options(self, hint)
+    print '___________________________________________________________'
+    try:
+        in_background(self, lambda: solve_local(filename, wcsfn, **opts))
+    except LocalSolveError, err:
+        print err
+        stat_bar(self, "Couldn't solve the image locally")
+        return
     self.update_solved_labels(hint, 'active')
     stat_bar(self, 'Idle')
     print 'local solve time ' + str(time.time()-t_start)
-    print '___________________________________________________________'            
+    print '___________________________________________________________'
+    return True
 
-    
-def img2wcs(self, ankey, filename, wcsfn, hint):
+
+def limg2wcs_many(self, todo, hints):
     '''
-    Plate solves one image
+    Plate solves several images at the same time with the local solver
     '''
-    import optparse
     import time
-    from urllib2 import urlopen
     t_start = time.time()
+    opts = local_options(self)
+    stat_bar(self, 'Solving %d images locally...' % len(todo))
+    errors = in_background(self, lambda: solve_local_many(todo, **opts))
+    show_solved(self, hints, errors)
+    print 'local solve time ' + str(time.time()-t_start)
+    print '___________________________________________________________'
+    return errors
+
+
+def show_solved(self, hints, errors):
+    '''
+    Update the Solved labels and the Status bar after several solves
+    '''
+    failed = []
+    for hint, err in zip(hints, errors):
+        if err is None:
+            if hint in ('v', 'h', 'i'):
+                self.update_solved_labels(hint, 'active')
+        else:
+            print 'Solving', hint, 'failed:', err
+            failed.append(hint)
+    if failed:
+        stat_bar(self, "Couldn't solve " + ', '.join(failed))
+    else:
+        stat_bar(self, 'Idle')
+
+
+def nova_options(self, ankey, filename, wcsfn, hint=None):
+    '''
+    The options and upload arguments for plate solving one image
+    '''
+    import optparse
     parser = optparse.OptionParser()
     parser.add_option('--server', dest='server',
                       default=NovaClient.default_url,
@@ -383,122 +351,158 @@ def img2wcs(self, ankey, filename, wcsfn, hint):
     # add given arguments
     opt.wcs = wcsfn
     opt.apikey = ankey
+    opt.server = self.nova_server
     opt.upload = filename
     if self.havescale and self.restrict_scale.get() == 1:
         opt.scale_units = 'arcsecperpix'
-        opt.scale_est = ('%.2f' % self.scale)
+        # the solver sees binned pixels
+        opt.scale_est = ('%.2f' % (self.scale*self.binning.get()))
         opt.scale_err = 5
+    pos = position_hint(self, hint)
+    if pos is not None:
+        opt.center_ra, opt.center_dec, opt.radius = pos
+        print 'around RA %.2f Dec %.2f, radius %.2f' % pos
     # DEBUG print opt
     print 'with estimated scale', opt.scale_est
-    args = {}
-    args['apiurl'] = opt.server
-    clnt = NovaClient(**args)
+    kwargs = dict()
+    if opt.scale_lower and opt.scale_upper:
+        kwargs.update(scale_lower=opt.scale_lower,
+                      scale_upper=opt.scale_upper,
+                      scale_type='ul')
+    elif opt.scale_est and opt.scale_err:
+        kwargs.update(scale_est=opt.scale_est,
+                      scale_err=opt.scale_err,
+                      scale_type='ev')
+    elif opt.scale_lower or opt.scale_upper:
+        kwargs.update(scale_type='ul')
+        if opt.scale_lower:
+            kwargs.update(scale_lower=opt.scale_lower)
+        if opt.scale_upper:
+            kwargs.update(scale_upper=opt.scale_upper)
+
+    for key in ['scale_units', 'center_ra', 'center_dec', 'radius',
+                'downsample_factor', 'tweak_order', 'crpix_center', ]:
+        if getattr(opt, key) is not None:
+            kwargs[key] = getattr(opt, key)
+    if opt.parity is not None:
+        kwargs.update(parity=int(opt.parity))
+    return opt, kwargs
+
+
+def img2wcs(self, ankey, filename, wcsfn, hint):
+    '''
+    Plate solves one image
+    '''
+    import time
+    t_start = time.time()
+    opt, kwargs = nova_options(self, ankey, filename, wcsfn, hint)
     try:
-        clnt.login(opt.apikey)
-    except RequestError, URLError:
+        clnt = get_client(opt.apikey, opt.server)
+    except (RequestError, IOError):
         stat_bar(self, ("Couldn't log on to nova.astrometry.net " +
                         '- Check the API key'))
         return
-    if opt.upload or opt.upload_url:
-        if opt.wcs or opt.kmz:
-            opt.wait = True
-        kwargs = dict()
-        if opt.scale_lower and opt.scale_upper:
-            kwargs.update(scale_lower=opt.scale_lower,
-                          scale_upper=opt.scale_upper,
-                          scale_type='ul')
-        elif opt.scale_est and opt.scale_err:
-            kwargs.update(scale_est=opt.scale_est,
-                          scale_err=opt.scale_err,
-                          scale_type='ev')
-        elif opt.scale_lower or opt.scale_upper:
-            kwargs.update(scale_type='ul')
-            if opt.scale_lower:
-                kwargs.update(scale_lower=opt.scale_lower)
-            if opt.scale_upper:
-                kwargs.update(scale_upper=opt.scale_upper)
-
-        for key in ['scale_units', 'center_ra', 'center_dec', 'radius',
-                    'downsample_factor', 'tweak_order', 'crpix_center', ]:
-            if getattr(opt, key) is not None:
-                kwargs[key] = getattr(opt, key)
-        if opt.parity is not None:
-            kwargs.update(parity=int(opt.parity))
-        if opt.upload:
-            upres = clnt.upload(opt.upload, **kwargs)
-        stat = upres['status']
-        if stat != 'success':
-            print 'Upload failed: status', stat
-            print upres
-            sys.exit(-1)
-        opt.sub_id = upres['subid']
-    if opt.wait:
-        if opt.job_id is None:
-            if opt.sub_id is None:
-                print "Can't --wait without a submission id or job id!"
-                sys.exit(-1)
-            while True:
-                stat = clnt.sub_status(opt.sub_id, justdict=True)
-                # print 'Got status:', stat
-                jobs = stat.get('jobs', [])
-                if len(jobs):
-                    for j in jobs:
-                        if j is not None:
-                            break
-                    if j is not None:
-                        print 'Selecting job id', j
-                        opt.job_id = j
-                        break
-                time.sleep(5)
-        success = False
-        while True:
-            stat = clnt.job_status(opt.job_id, justdict=True)
-            # print 'Got job status:', stat
-            # TODO : stat may be None! should recover
-            if stat.get('status', '') in ['success']:
-                success = (stat['status'] == 'success')
-                break
-            time.sleep(5)
-        if success:
-            clnt.job_status(opt.job_id)
-            retrieveurls = []
-            if opt.wcs:
-                # We don't need the API for this, just construct URL
-                url = opt.server.replace('/api/', '/wcs_file/%i' % opt.job_id)
-                retrieveurls.append((url, opt.wcs))
-            for url, fne in retrieveurls:
-                print 'Retrieving file from', url
-                fle = urlopen(url)
-                txt = fle.read()
-                wfl = open(fne, 'wb')
-                wfl.write(txt)
-                wfl.close()
-                print 'Wrote to', fne
-                self.update_solved_labels(hint, 'active')
-                stat_bar(self,'Idle')
-                print 'nova solve time ' + str(time.time()-t_start)
-                print '___________________________________________________________'            
-        opt.job_id = None
-        opt.sub_id = None
-    if opt.sub_id:
-        print clnt.sub_status(opt.sub_id)
-    if opt.job_id:
-        print clnt.job_status(opt.job_id)
-    if opt.jobs_by_tag:
-        tag = opt.jobs_by_tag
-        print clnt.jobs_by_tag(tag, None)
-    if opt.jobs_by_exact_tag:
-        tag = opt.jobs_by_exact_tag
-        print clnt.jobs_by_tag(tag, 'yes')
-    if opt.myjobs:
-        jobs = clnt.myjobs()
-        print jobs
+
+    def progress(sent, total):
+        '''
+        show how much of the image has gone up
+        '''
+        if sent < total:
+            stat_bar(self, 'Uploading image... %d%%' % (100*sent/total))
+        else:
+            stat_bar(self, ('Waiting for nova.astrometry.net... ' +
+                            '(Esc to cancel)'))
+
+    def cancel():
+        '''
+        has the user pressed Esc?
+        '''
+        return self.cancel_solve
+
+    def sleep(secs):
+        '''
+        wait, keeping the window alive so that we can be cancelled
+        '''
+        t_end = time.time() + secs
+        while time.time() < t_end:
+            keep_alive(self)
+            time.sleep(0.05)
+    self.cancel_solve = False
+    try:
+        if self.send_stars.get() == 1:
+            stat_bar(self, 'Finding stars...')
+        with busy(self):
+            clnt.solve(opt.upload, opt.wcs, kwargs, progress,
+                       xylist=(self.send_stars.get() == 1),
+                       binning=self.binning.get(), journal=self.journal,
+                       offload=lambda func: in_background(self, func),
+                       cancel=cancel, sleep=sleep)
+    except Cancelled:
+        stat_bar(self, 'Solve cancelled')
+        return
+    except SolveFailed:
+        stat_bar(self, "nova.astrometry.net couldn't solve the image")
+        return
+    except PollTimeout:
+        stat_bar(self, 'Gave up waiting for nova.astrometry.net')
+        return
+    except TransportError, err:
+        print err
+        stat_bar(self, 'Lost the connection to nova.astrometry.net')
+        return
+    except (RequestError, IOError):
+        stat_bar(self, 'Upload to nova.astrometry.net failed')
+        return
+    self.update_solved_labels(hint, 'active')
+    stat_bar(self,'Idle')
+    print 'nova solve time ' + str(time.time()-t_start)
+    print '___________________________________________________________'
+    return True
+
+
+def img2wcs_many(self, ankey, todo, hints):
+    '''
+    Plate solves several images at the same time
+    '''
+    import time
+    t_start = time.time()
+    opt, kwargs = nova_options(self, ankey, None, None)
+    try:
+        clnt = get_client(opt.apikey, opt.server)
+    except (RequestError, IOError):
+        stat_bar(self, ("Couldn't log on to nova.astrometry.net " +
+                        '- Check the API key'))
+        return
+    self.cancel_solve = False
+    stat_bar(self, ('Solving %d images with nova.astrometry.net... ' %
+                    len(todo)) + '(Esc to cancel)')
+    try:
+        errors = in_background(self, lambda: solve_many(
+            clnt, todo, kwargs, xylist=(self.send_stars.get() == 1),
+            binning=self.binning.get(), journal=self.journal,
+            cancel=lambda: self.cancel_solve))
+    except (RequestError, IOError), err:
+        print err
+        stat_bar(self, 'Solving with nova.astrometry.net failed')
+        return
+    show_solved(self, hints, errors)
+    print 'nova solve time ' + str(time.time()-t_start)
+    print '___________________________________________________________'
+    return errors
 
 from Tkinter import Frame, Tk, Menu, Label, Entry, PhotoImage
-from Tkinter import Scrollbar, Toplevel, Canvas, Radiobutton
+from Tkinter import Toplevel, Radiobutton
 from Tkinter import StringVar, IntVar, DoubleVar
 from Tkinter import Button, LabelFrame, Checkbutton, Scale
-from Tkinter import HORIZONTAL
+from Tkinter import HORIZONTAL, TclError
+from ppa_engine import AlignError, scale_frm_wcs, decdeg2dms
+from ppa_engine import solve_pair, solve_improvement, solve_frames
+startup_phase('imports')
+
+# imported once the window is up, one at a time, see warm_up
+HEAVY_MODULES = ['numpy', 'astropy.io.fits', 'astropy.wcs', 'astropy.time',
+                 'astropy.coordinates', 'PIL.Image', 'PIL.ImageTk',
+                 'ppa_catalog', 'ppa_viewer', 'ppa_wcs']
 
 def help_f():
     '''
@@ -518,132 +522,109 @@ def about_f():
                           'Copyright Â© 2014 Themos Tsikas, ' +
                           'Jack Richmond')
 
-def scale_frm_wcs(fn):
-    from astropy.io import fits
-    hdu = fits.open(fn)
-    head = hdu[0].header
-    return scale_frm_header(head)
 
-def parity_frm_header(head):
+def startup_f():
     '''
-    look in the plate-solution header for the parity information
+    our startup times window
     '''
-    try:
-        # nova's wcs files have the parity in the comments
-        comments = head['COMMENT']
-        size = (len(comments))
-        for i in range(0, size):
-            if comments[i][0:6] == 'parity':
-                tkns = comments[i].split(' ')
-                return int(tkns[1])
-    except KeyError:
-        return 1
+    import tkMessageBox
+    tkMessageBox.showinfo('Startup times', startup_report())
 
-    
-def scale_frm_header(head):
+
+def report_startup(root, phases=('heavy imports', 'solver probe')):
     '''
-    look in the plate-solution header for the scale information
+    prints the startup times and quits, once the heavy imports and the
+    solver probe are over
     '''
-    try:
-        # nova's wcs files have the scale in the comments
-        comments = head['COMMENT']
-        size = (len(comments))
-        for i in range(0, size):
-            if comments[i][0:5] == 'scale':
-                tkns = comments[i].split(' ')
-                return float(tkns[1])
-    except KeyError:
-        try:
-            # AstroArt's wcs files have it CDELT1 (deg/pixel)
-            cdelt1 = abs(head['CDELT1'])
-            return float(cdelt1)*60.0*60.0
-        except KeyError:
-            return 1.0
-
+    done = [name for name, began, ended in STARTUP]
+    if [name for name in phases if name not in done]:
+        root.after(100, report_startup, root, phases)
+        return
+    print startup_report()
+    root.quit()
 
-def dec_frm_header(head):
-    '''
-    look in header for width and height of image
-   '''
-    # nova's and AstroArt's wcs files have CRVAL2
-    dec = head['CRVAL2']
-    return dec
+# the largest crop (pixels) the image window shows without scrolling
+PREVIEW_SIZE = 800
+# how often (ms) we look in a watched folder
+WATCH_PERIOD = 500
 
 
-def wid_hei_frm_header(head):
-    '''
-    look in header for width and height of image
-   '''
-    try:
-        # nova's wcs files have IMAGEW / IMAGEH
-        width = head['IMAGEW']
-        height = head['IMAGEH']
-        return width, height
-    except KeyError:
-        try:
-            # AstroArt's fits files have NAXIS1 / NAXIS2
-            width = head['NAXIS1']
-            height = head['NAXIS2']
-            return width, height
-        except KeyError:
-            return 0, 0
-
-def decdeg2dms(dd):
-    mnt,sec = divmod(dd*3600,60)
-    deg,mnt = divmod(mnt,60)
-    return deg,mnt,sec
-
-def cross(crd, img, colour):
+def crop_box(result):
     '''
-    Annotate with a cross for the RA axis
+    the (left, top, right, bottom) of the image around the pole, the RA
+    axis and the reference stars within 2.5 degrees of the pole
     '''
-    from PIL import ImageDraw
-    draw = ImageDraw.Draw(img)
-    coords = crd[0]
-    ax1 = coords[0]
-    ay1 = coords[1]
-    draw.line((ax1 - 30, ay1 - 30) + (ax1 + 30, ay1 + 30),
-              fill=colour, width=3)
-    draw.line((ax1 + 30, ay1 - 30) + (ax1 - 30, ay1 + 30),
-              fill=colour, width=3)
-
-
-def circle(centre, img, colour, name):
+    axis = result.axis
+    xs = [result.pole[0][0], axis[0]]
+    ys = [result.pole[0][1], axis[1]]
+    near = (2.5*3600/result.scale)**2
+    for label, colour, pix in result.stars:
+        if ((pix[0][0] - xs[0])**2 + (pix[0][1] - ys[0])**2) <= near:
+            xs.append(pix[0][0])
+            ys.append(pix[0][1])
+    margin = int(2500/result.scale)
+    return (max(1, int(min(xs)) - margin), max(1, int(min(ys)) - margin),
+            min(result.width, int(max(xs)) + margin),
+            min(result.height, int(max(ys)) + margin))
+
+
+def load_region(img_fn, box, preview=None):
     '''
-    Annotate with a circle
+    the box (left, top, right, bottom) of an image. A JPEG is decoded by
+    libjpeg at 1/2, 1/4 or 1/8 scale whenever the box, so reduced, still
+    fills a window of preview pixels. Returns the crop and by how much it
+    is reduced and where it starts, in pixels of the image.
+
+    Neither libjpeg nor PIL decode part of an image: the whole frame is
+    decoded (at the reduced scale) and then cropped, so the memory this
+    takes is that of the frame over reduce squared, not that of the box.
+    Other formats are always decoded whole, at full scale
     '''
-    from PIL import ImageFont, ImageDraw
-    font = ImageFont.load('symb24.pil')
-    draw = ImageDraw.Draw(img)
-    cen = centre[0]
-    ax1 = cen[0]
-    ay1 = cen[1]
-    draw.ellipse((ax1 - 20, ay1 - 20, ax1 + 20, ay1 + 20),
-                 fill=None, outline=colour)
-    draw.text((ax1 + 30, ay1), name, fill=colour, font=font)
-
-
-def cpcircle(centre, img, scl):
+    from PIL import Image
+    img = Image.open(img_fn)
+    wid, hei = img.size
+    reduce = 1
+    if preview and img.format == 'JPEG':
+        while (reduce < 8 and
+               max(box[2] - box[0], box[3] - box[1]) >= 2*reduce*preview):
+            reduce = reduce*2
+        if reduce > 1:
+            img.draft(img.mode, (wid//reduce, hei//reduce))
+    # what libjpeg gave us
+    reduce = float(wid)/img.size[0]
+    sbox = tuple([int(round(crd/reduce)) for crd in box])
+    region = img.crop(sbox)
+    region.load()
+    return region, reduce, (sbox[0]*reduce, sbox[1]*reduce)
+
+
+def annotations(result):
     '''
-    Annotate with target circles
+    the overlay of an image: target circles around the Celestial Pole, a
+    cross on the RA axis and circles around the reference stars
     '''
-    from PIL import ImageFont, ImageDraw
-    font = ImageFont.load('helvR24.pil')
-    draw = ImageDraw.Draw(img)
-    cen = centre[0]
-    ax1 = cen[0]
-    ay1 = cen[1]
-    number = [5, 10, 20, 40]
-    for i in number:
-        rad = (i*60)/scl
-        draw.ellipse((ax1 - rad, ay1 - rad, ax1 + rad, ay1 + rad),
-                     fill=None, outline='Green')
-        draw.text((ax1 + (rad*26)/36, ay1 + (rad*26/36)), str(i),
-                  font=font)
-    draw.line((ax1 - 30, ay1) + (ax1 - 4, ay1), fill='Green', width=2)
-    draw.line((ax1 +4, ay1) + (ax1 + 30, ay1), fill='Green', width=2)
-    draw.line((ax1, ay1 - 30) + (ax1, ay1 - 4),fill='Green', width=2)
-    draw.line((ax1, ay1 + 4) + (ax1, ay1 + 30),fill='Green', width=2)
+    from ppa_viewer import Overlay
+    overlay = Overlay()
+    # the target circles, 5, 10, 20 and 40 arcmin
+    ax1, ay1 = result.pole[0][0], result.pole[0][1]
+    for i in [5, 10, 20, 40]:
+        rad = (i*60)/result.scale
+        overlay.circle(ax1, ay1, rad, 'Green', scaled=True)
+        overlay.text(ax1, ay1, ((rad*26)/36, (rad*26)/36), str(i), 'White',
+                     scaled=True)
+    overlay.line(ax1, ay1, (-30, 0, -4, 0), 'Green', 2)
+    overlay.line(ax1, ay1, (4, 0, 30, 0), 'Green', 2)
+    overlay.line(ax1, ay1, (0, -30, 0, -4), 'Green', 2)
+    overlay.line(ax1, ay1, (0, 4, 0, 30), 'Green', 2)
+    # the RA axis
+    ax1, ay1 = result.axis[0], result.axis[1]
+    overlay.line(ax1, ay1, (-30, -30, 30, 30), 'Red', 3)
+    overlay.line(ax1, ay1, (30, -30, -30, 30), 'Red', 3)
+    # the reference stars
+    for label, colour, pix in result.stars:
+        overlay.circle(pix[0][0], pix[0][1], 20, colour)
+        overlay.text(pix[0][0], pix[0][1], (30, 0), label, colour, 'symbol')
+    return overlay
 
 
 class PhotoPolarAlign(Frame):
@@ -658,6 +639,7 @@ class PhotoPolarAlign(Frame):
         if not self.config.has_section('nova'):
             self.config.add_section('nova')
         self.config.set('nova', 'apikey', self.apikey.get())
+        self.config.set('nova', 'server', self.nova_server)
         # the image directory
         if not self.config.has_section('file'):
             self.config.add_section('file')
@@ -672,6 +654,14 @@ class PhotoPolarAlign(Frame):
             self.config.add_section('operations')
         self.config.set('operations','restrict scale',
                         self.restrict_scale.get())
+        self.config.set('operations','hint position',
+                        self.restrict_position.get())
+        self.config.set('operations','hemisphere',
+                        self.hemi or self.last_hemi or '')
+        self.config.set('operations','send stars',
+                        self.send_stars.get())
+        self.config.set('operations','binning',
+                        self.binning.get())
         # the local solve options
         if not self.config.has_section('local'):
             self.config.add_section('local')
@@ -689,6 +679,16 @@ class PhotoPolarAlign(Frame):
                         self.local_scale_hi.get())
         self.config.set('local','xtra',
                         self.local_xtra.get())
+        # the plate solution cache
+        if not self.config.has_section('cache'):
+            self.config.add_section('cache')
+        self.config.set('cache', 'dir', self.cache.cachedir)
+        self.config.set('cache', 'max_mb', self.cache.maxbytes/(1024*1024))
+        # where the timings and counters go
+        if not self.config.has_section('metrics'):
+            self.config.add_section('metrics')
+        self.config.set('metrics', 'jsonl', self.metrics_jsonl)
+        self.config.set('metrics', 'prom', self.metrics_prom)
         #
         with open(self.cfgfn, 'w') as cfgfile:
             self.config.write(cfgfile)
@@ -701,6 +701,8 @@ class PhotoPolarAlign(Frame):
         self.write_config_file()
         self.wvar4.configure(text=('%.3s...........' % self.apikey.get()))
         self.settings_win.destroy()
+        # the shell may have changed
+        self.probe_solver()
                                 
         
     def settings_open(self):
@@ -710,7 +712,7 @@ class PhotoPolarAlign(Frame):
         # create child window
         win = Toplevel()
         self.settings_win = win
-        win.geometry('480x600')
+        win.geometry('480x680')
         win.title('Settings')
         # get the API key information
         frm = LabelFrame(win, borderwidth=2, relief='ridge', text='nova.astrometry.net')
@@ -723,6 +725,24 @@ class PhotoPolarAlign(Frame):
         nxt.grid(row=1, column=0, pady=4, sticky='w')
         nxt = Checkbutton(frm, var=self.restrict_scale)
         nxt.grid(row=1, column=1, pady=4)
+        nxt = Label(frm, text='Send star list only')
+        nxt.grid(row=2, column=0, pady=4, sticky='w')
+        nxt = Checkbutton(frm, var=self.send_stars)
+        nxt.grid(row=2, column=1, pady=4)
+        nxt = Label(frm, text='Search near the Pole')
+        nxt.grid(row=3, column=0, pady=4, sticky='w')
+        nxt = Checkbutton(frm, var=self.restrict_position)
+        nxt.grid(row=3, column=1, pady=4)
+        ifrm = Frame(frm,bd=0)
+        ifrm.grid(row=4, column=0, pady=4, sticky='w', columnspan=3)
+        nxt = Label(ifrm, text='Grey and bin images by')
+        nxt.pack(side='left')
+        nxt = Radiobutton(ifrm, variable=self.binning,value='1',text='1')
+        nxt.pack(side='left')
+        nxt = Radiobutton(ifrm, variable=self.binning,value='2',text='2')
+        nxt.pack(side='left')
+        nxt = Radiobutton(ifrm, variable=self.binning,value='4',text='4')
+        nxt.pack(side='left')
 
         frm = LabelFrame(win, borderwidth=2, relief='ridge', text='Local solver Configuration')
         frm.pack(side='top', ipadx=20, padx=20, fill='x')
@@ -784,37 +804,255 @@ class PhotoPolarAlign(Frame):
         nxt = Button(frm, text='Read from AstroTortilla configuration',
                      command=self.slurpAT)
         nxt.grid(row=7, column=0, pady=4, sticky='we', columnspan=3)
+        nxt = Button(frm, text='Use only the index files of the Pole region',
+                     command=self.pole_index)
+        nxt.grid(row=8, column=0, pady=4, sticky='we', columnspan=3)
         
         Button(win, text='OK', command=self.settings_destroy).pack(pady=4)
 
+    def pole_index(self):
+        '''
+        Write a configuration for the local solver naming only the index
+        files that solve images of the Pole region with this camera, and
+        use it
+        '''
+        import os
+        import tkFileDialog
+        from ppa_index import build
+        from ppa_wcs import read_records
+        size = None
+        for wcsfn in (self.iwcs_fn, self.hwcs_fn, self.vwcs_fn):
+            try:
+                size = read_records([wcsfn])[0].size()
+                break
+            except (IOError, OSError, KeyError):
+                pass
+        if not self.havescale or size is None:
+            stat_bar(self, 'Solve an image first, to know its scale')
+            return
+        source = self.local_configfile.get()
+        if not source:
+            source = tkFileDialog.askdirectory(
+                title='The directory of the index files')
+            if not source:
+                return
+        outfn = os.path.join(os.path.expanduser('~'), '.PhotoPolarAlign',
+                             'pole_astrometry.cfg')
+        if not os.path.isdir(os.path.dirname(outfn)):
+            os.makedirs(os.path.dirname(outfn))
+        try:
+            kept, kept_bytes, all_bytes = build(source, outfn, self.scale,
+                                                size[0], size[1])
+        except IOError, err:
+            stat_bar(self, str(err))
+            return
+        self.local_configfile.set(outfn)
+        stat_bar(self, '%d index files, %.0f of %.0f MB' %
+                 (len(kept), kept_bytes/1048576.0, all_bytes/1048576.0))
+
     def quit_method(self):
         '''
         User wants to quit
         '''
+        if self.busy_depth:
+            self.quit_later(self.quit_method)
+            return
         self.write_config_file()
+        ppa_metrics.flush()
         self.myparent.destroy()
 
+    def close_method(self):
+        '''
+        User closes the window
+        '''
+        if self.busy_depth:
+            self.quit_later(self.myparent.destroy)
+            return
+        self.myparent.destroy()
+
+    def quit_later(self, how):
+        '''
+        a solve is keeping the window alive, and destroying it now would
+        pull it from under the solve: cancel the solve, and quit (how)
+        once it stops
+        '''
+        self.quitting = how
+        self.cancel_solve = True
+        stat_bar(self, 'Exiting once the solve stops...')
+
+    def operations(self):
+        '''
+        the Operations buttons
+        '''
+        return [self.wvfn, self.wvsol, self.wlvsol, self.whfn, self.whsol,
+                self.wlhsol, self.wasol, self.wlasol, self.wann, self.wifn,
+                self.wisol, self.wlisol, self.wanni]
+
+    def probe_key(self):
+        '''
+        what the answer of the solver probe depends on, the PATH and the
+        shell
+        '''
+        import hashlib
+        import os
+        return hashlib.sha1(os.environ.get('PATH', '') + '\0' +
+                            self.local_shell.get()).hexdigest()
+
+    def probe_solver(self, startup=False):
+        '''
+        Find out, away from the window, whether we can run solve-field.
+        The answer is kept in the User preferences file until the PATH or
+        the shell change
+        '''
+        import threading
+        key = self.probe_key()
+        try:
+            if self.config.get('local', 'probe key') == key:
+                self.local_solver_found(
+                    self.config.getboolean('local', 'probe ok'))
+                if startup:
+                    startup_phase('solver probe', STARTUP[-1][2])
+                return
+        except:
+            pass
+        began = time.time() - START_TIME
+        shell = self.local_shell.get()
+        outcome = []
+
+        def work():
+            '''
+            the probe, in its own thread
+            '''
+            outcome.append(probe(shell))
+        thr = threading.Thread(target=work)
+        thr.daemon = True
+        thr.start()
+
+        def check():
+            '''
+            back in the window, once the probe is over
+            '''
+            if thr.is_alive():
+                self.after(100, check)
+                return
+            if startup:
+                startup_phase('solver probe', began)
+            if not self.config.has_section('local'):
+                self.config.add_section('local')
+            self.config.set('local', 'probe key', key)
+            self.config.set('local', 'probe ok', outcome[0])
+            with open(self.cfgfn, 'w') as cfgfile:
+                self.config.write(cfgfile)
+            self.local_solver_found(outcome[0])
+        self.after(100, check)
+
+    def local_solver_found(self, found):
+        '''
+        enable the local solver buttons, if we can run solve-field
+        '''
+        if not found:
+            print "Can't use local astrometry.net solver, check PATH"
+            state = 'disabled'
+        else:
+            state = 'active'
+        for widget in (self.wlvsol, self.wlhsol, self.wlisol, self.wlasol):
+            if self.busy_depth:
+                # they come back in this state when we are done
+                self.busy_states[widget] = state
+            else:
+                widget.configure(state=state)
+
+    def warm_up(self, todo=None, began=None):
+        '''
+        The window is up: import the heavy modules, so that the first
+        annotation does not wait for them. One at a time, whenever the
+        window has nothing else to do, and not in a thread: on Python 2
+        that would hold the import lock, and so hold up every import the
+        window makes, until all of them were done
+        '''
+        if todo is None:
+            startup_phase('first paint')
+            began = STARTUP[-1][2]
+            todo = list(HEAVY_MODULES)
+        if todo:
+            try:
+                __import__(todo[0])
+            except ImportError:
+                pass
+            self.after_idle(self.warm_up, todo[1:], began)
+            return
+        from ppa_catalog import default_catalog
+        default_catalog()
+        startup_phase('heavy imports', began)
+
+    def cancel_method(self, event=None):
+        '''
+        User wants to stop waiting for a solve
+        '''
+        self.cancel_solve = True
+
+    def solver_params(self, solver):
+        '''
+        the solver settings that make a difference to a plate solution
+        '''
+        if solver == 'local':
+            return {'solver': 'local',
+                    'downscale': self.local_downscale.get(),
+                    'xtra': self.local_xtra.get(),
+                    'stars': self.send_stars.get(),
+                    'binning': self.binning.get()}
+        return {'solver': 'nova', 'stars': self.send_stars.get(),
+                'binning': self.binning.get()}
+
+    def cached_solution(self, img, wcs, solvers=('nova', 'local')):
+        '''
+        copies a cached plate solution of img over wcs, if there is one;
+        only for images being picked or about to be solved
+        '''
+        try:
+            for solver in solvers:
+                key = self.cache.key(img, self.solver_params(solver))
+                if self.cache.fetch(key, wcs):
+                    return True
+        except (IOError, OSError):
+            pass
+        return False
+
+    def remember_solution(self, img, wcs, solver):
+        '''
+        keeps the plate solution of img in the cache
+        '''
+        try:
+            self.cache.store(self.cache.key(img, self.solver_params(solver)),
+                             wcs, hash_of(img))
+        except (IOError, OSError), err:
+            print "Couldn't cache the plate solution", err
+
     def happy_with(self, wcs, img):
         '''
-        check that .wcs (wcs) is compatible with .jpg (img)
+        check that .wcs (wcs) is compatible with .jpg (img): a solution
+        we made is checked against the content of the image it was made
+        for; only one we know nothing of goes by the file times
         '''
         import os
         from os.path import exists
-        if exists(wcs):
-            # DBG print wcs, 'exists'
-            # check timestamps
-            # DBG print os.stat(wcs).st_atime, os.stat(wcs).st_mtime, os.stat(wcs).st_ctime, 'wcs'
-            # DBG print os.stat(img).st_atime, os.stat(img).st_mtime, os.stat(img).st_ctime, 'img'
-            if os.stat(wcs).st_mtime> os.stat(img).st_mtime:
-                return True
-        return False
+        if not exists(wcs):
+            return False
+        try:
+            owner = self.cache.owner(wcs)
+            if owner is not None:
+                return owner == hash_of(img)
+            # DBG print os.stat(wcs).st_mtime, os.stat(img).st_mtime
+            return os.stat(wcs).st_mtime > os.stat(img).st_mtime
+        except (IOError, OSError):
+            return False
 
     def get_file(self, hint):
         '''
         User wants to select an image file
         '''
         import tkFileDialog
-        from os.path import splitext, dirname, basename
+        from os.path import dirname
         options = {}
         options['filetypes'] = [('JPEG files', '.jpg .jpeg .JPG .JPEG'),
                                 ('all files', '.*')]
@@ -826,30 +1064,37 @@ class PhotoPolarAlign(Frame):
         options['title'] = titles[hint]
         img = tkFileDialog.askopenfilename(**options)
         if img:
-            wcs = splitext(img)[0] + '.wcs'
-            if self.happy_with(wcs, img):
-                self.update_solved_labels(hint, 'active')
-            else:
-                self.update_solved_labels(hint, 'disabled')
+            self.use_image(hint, img)
             self.imgdir = dirname(img)
-            if hint == 'v':
-                self.vimg_fn = img
-                self.vwcs_fn = wcs
-                self.havev = True
-                self.wvar1.configure(text=basename(img))
-                self.wvfn.configure(bg='green', activebackground='green')
-            elif hint == 'h':
-                self.himg_fn = img
-                self.hwcs_fn = wcs
-                self.haveh = True
-                self.wvar2.configure(text=basename(img))
-                self.whfn.configure(bg='green', activebackground='green')
-            elif hint == 'i':
-                self.iimg_fn = img
-                self.iwcs_fn = wcs
-                self.havei = True
-                self.wvar3.configure(text=basename(img))
-                self.wifn.configure(bg='green', activebackground='green')
+
+    def use_image(self, hint, img):
+        '''
+        Make img the v, h or i image
+        '''
+        from os.path import splitext, basename
+        wcs = splitext(img)[0] + '.wcs'
+        if self.happy_with(wcs, img) or self.cached_solution(img, wcs):
+            self.update_solved_labels(hint, 'active')
+        else:
+            self.update_solved_labels(hint, 'disabled')
+        if hint == 'v':
+            self.vimg_fn = img
+            self.vwcs_fn = wcs
+            self.havev = True
+            self.wvar1.configure(text=basename(img))
+            self.wvfn.configure(bg='green', activebackground='green')
+        elif hint == 'h':
+            self.himg_fn = img
+            self.hwcs_fn = wcs
+            self.haveh = True
+            self.wvar2.configure(text=basename(img))
+            self.whfn.configure(bg='green', activebackground='green')
+        elif hint == 'i':
+            self.iimg_fn = img
+            self.iwcs_fn = wcs
+            self.havei = True
+            self.wvar3.configure(text=basename(img))
+            self.wifn.configure(bg='green', activebackground='green')
 
     def update_scale(self, hint):
         try: 
@@ -890,273 +1135,308 @@ class PhotoPolarAlign(Frame):
             stat_bar(self, ("couldn't open the image - Check the Image " +
                             'filename' + aimg))
             return
+        if self.cached_solution(aimg, awcs, [solver]):
+            self.update_solved_labels(hint, 'active')
+            self.update_scale(hint)
+            return
         stat_bar(self, 'Solving image...')
+        solved = False
         if solver=='nova':
-            img2wcs(self, self.apikey.get(), aimg, awcs, hint)
+            solved = img2wcs(self, self.apikey.get(), aimg, awcs, hint)
         if solver=='local':
-            limg2wcs(self, aimg, awcs, hint)
+            solved = limg2wcs(self, aimg, awcs, hint)
+        if solved:
+            self.remember_solution(aimg, awcs, solver)
         self.update_scale(hint)
             
-    def update_display(self, cpcrd, the_scale):
+    def solve_all(self, solver):
+        '''
+        Solve all the chosen, not yet solved, images at once
+        '''
+        todo = []
+        hints = []
+        for hint, have, aimg, awcs in (
+                ('v', self.havev, self.vimg_fn, self.vwcs_fn),
+                ('h', self.haveh, self.himg_fn, self.hwcs_fn),
+                ('i', self.havei, self.iimg_fn, self.iwcs_fn)):
+            if have and not (self.happy_with(awcs, aimg) or
+                             self.cached_solution(aimg, awcs)):
+                if aimg in [item[0] for item in todo]:
+                    stat_bar(self, ('Image filenames coincide - Check the ' +
+                                    'Image filenames'))
+                    return
+                todo.append((aimg, awcs))
+                hints.append(hint)
+        if not todo:
+            stat_bar(self, 'Nothing to solve')
+            return
+        errors = None
+        if solver == 'nova':
+            errors = img2wcs_many(self, self.apikey.get(), todo, hints)
+        if solver == 'local':
+            errors = limg2wcs_many(self, todo, hints)
+        for (aimg, awcs), err in zip(todo, errors or []):
+            if err is None:
+                self.remember_solution(aimg, awcs, solver)
+        for hint in hints:
+            self.update_scale(hint)
+
+    def watch_folder(self):
+        '''
+        User wants to watch (or stop watching) a capture folder, each new
+        image in it being solved and shown as the improvement image
+        '''
+        import tkFileDialog
+        from ppa_watch import FolderWatch
+        if self.watch is not None:
+            self.watch = None
+            self.watch_queue = []
+            self.filemenu.entryconfig(self.watch_entry,
+                                      label='Watch folder...')
+            stat_bar(self, 'Idle')
+            return
+        if self.axis is None:
+            stat_bar(self, "don't know where Polar Axis is - Find Polar Axis")
+            return
+        folder = tkFileDialog.askdirectory(
+            initialdir=self.imgdir,
+            title='The folder the camera saves its images in')
+        if not folder:
+            return
+        self.watch_solver = self.choose_solver('Watch folder',
+                                               'Solve the new images locally?')
+        self.watch = FolderWatch(folder)
+        self.filemenu.entryconfig(self.watch_entry, label='Stop watching')
+        stat_bar(self, 'Watching ' + folder)
+        self.after(WATCH_PERIOD, self.watch_tick)
+
+    def choose_solver(self, title, question):
+        '''
+        nova, or the local solver if we have it and the user wants it
+        '''
+        import tkMessageBox
+        state = self.busy_states.get(self.wlisol,
+                                     self.wlisol.cget('state'))
+        if str(state) != 'disabled':
+            if tkMessageBox.askyesno(title, question):
+                return 'local'
+        return 'nova'
+
+    def watch_tick(self):
+        '''
+        Look for new images in the watched folder and deal with them
+        '''
+        watch = self.watch
+        if watch is None:
+            return
+        self.watch_queue.extend(watch.poll())
+        if self.watch_queue and not self.busy_depth:
+            # the frames before the newest are out of date already
+            img = self.watch_queue[-1]
+            for old in self.watch_queue[:-1]:
+                print 'Skipping', old
+            self.watch_queue = []
+            with busy(self):
+                self.improve_with(img)
+        if self.watch is watch:
+            self.after(WATCH_PERIOD, self.watch_tick)
+
+    def improve_with(self, img):
+        '''
+        Solve img and show it as the improvement image
+        '''
+        self.use_image('i', img)
+        self.solve('i', self.watch_solver)
+        if self.happy_with(self.iwcs_fn, self.iimg_fn):
+            self.annotate_imp()
+        if self.watch is not None:
+            stat_bar(self, 'Watching ' + self.watch.folder)
+
+    def update_display(self, result):
         '''
         update Computed displayed quantities
         '''
-        import numpy
-        axis = self.axis
+        axis = result.axis
         x1a = axis[0]
         y1a = axis[1]
-        x2a = cpcrd[0][0]
-        y2a = cpcrd[0][1]
-        self.scale = the_scale
+        x2a = result.pole[0][0]
+        y2a = result.pole[0][1]
+        self.scale = result.scale
         self.havescale = True
-        self.wvar5.configure(text=('%.2f' % the_scale))
+        self.wvar5.configure(text=('%.2f' % result.scale))
         self.wvar6.configure(text=str(int(x1a))+','+str(int(y1a)))
         self.wvar7.configure(text=(str(int(x2a)) +',' + str(int(y2a))))
-        err = the_scale*numpy.sqrt((x1a-x2a)**2 + (y1a-y2a)**2)/60.0
-        self.wvar8.configure(text=('%.2f' % err))
-        if x2a > x1a:
-            inst = 'Right '
-        else:
-            inst = 'Left '
-        ddeg = abs(x2a - x1a)*the_scale/3600.0
-        inst = inst + ('%02d:%02d:%02d' % decdeg2dms(ddeg))
-        self.wvar9.configure(text=inst)
-        if y2a > y1a:
-            inst = inst + ' Down '
-        else:
-            inst = inst + ' Up '
-        ddeg = abs(y2a - y1a)*the_scale/3600.0
-        inst = inst + ('%02d:%02d:%02d' % decdeg2dms(ddeg))
-        self.wvar9.configure(text=inst)
+        self.wvar8.configure(text=('%.2f' % result.error))
+        self.wvar9.configure(text=result.instructions())
+
+    def show_annotated(self, img_fn, result, which):
+        '''
+        Annotate an image with the result and display the crop. The
+        window of the 'h' or 'i' image is reused; if it already shows
+        that part of the image, only the annotations are redrawn
+        '''
+        import os
+        from os.path import basename
+        box = crop_box(result)
+        sta = os.stat(img_fn)
+        ident = (img_fn, sta.st_size, sta.st_mtime)
+        viewer = self.viewers.get(which)
+        if viewer is not None and not viewer.winfo_exists():
+            viewer = None
+        if viewer is None or viewer.ident != ident or not (
+                viewer.box[0] <= box[0] and viewer.box[1] <= box[1] and
+                box[2] <= viewer.box[2] and box[3] <= viewer.box[3]):
+            with span('crop'):
+                img, reduce, origin = load_region(img_fn, box, PREVIEW_SIZE)
+            with span('display'):
+                if viewer is None:
+                    viewer = self.create_imgwin(img, img_fn, origin, reduce)
+                    self.viewers[which] = viewer
+                else:
+                    viewer.set_image(img, origin, reduce)
+                    viewer.master.title(basename(img_fn))
+                # Tk draws when idle, time that too
+                viewer.update_idletasks()
+            viewer.ident = ident
+            viewer.box = box
+        with span('drawing'):
+            viewer.set_overlay(annotations(result))
+            viewer.update_idletasks()
+        ppa_metrics.flush()
 
     def annotate_imp(self):
         '''
         Annotate the improvement image
         '''
-        from PIL import Image
-        from astropy.time import Time
-        from astropy.coordinates import SkyCoord
-        from astropy.coordinates import FK5
-        from astropy.io import fits
-        from astropy import wcs
-        import numpy
-        from os.path import splitext
+        from ppa_wcs import read_records
         if self.iimg_fn == self.himg_fn:
             stat_bar(self, ('Image filenames coincide - Check the Image ' +
                             'filenames'))
             return
         try:
-            imi = Image.open(self.iimg_fn)
-            # Load the FITS hdulist using astropy.io.fits
-            hdulisti = fits.open(self.iwcs_fn)
-            hdulisth = fits.open(self.hwcs_fn)
-        except IOError:
+            open(self.iimg_fn).close()
+            # the plate solutions, parsed once
+            headi, headh = read_records([self.iwcs_fn, self.hwcs_fn])
+        except (IOError, OSError):
             return
-        axis = self.axis
+        stat_bar(self, 'Annotating...')
         try:
-            axis[0]
-        except:
-            stat_bar(self,"don't know where Polar Axis is - Find Polar Axis")
+            result = solve_improvement(headi, headh, self.axis, self.hemi)
+        except AlignError, err:
+            stat_bar(self, str(err))
             return
-        stat_bar(self, 'Annotating...')
-        headi = hdulisti[0].header
-        headh = hdulisth[0].header
-        wcsi = wcs.WCS(headi)
-        now = Time.now()
-        if self.hemi == 'N':
-            cp = SkyCoord(ra=0, dec=90, frame='fk5', unit='deg', equinox=now)
-        else:
-            cp = SkyCoord(ra=0, dec=-90, frame='fk5', unit='deg', equinox=now)
-        cpj2000 = cp.transform_to(FK5(equinox='J2000'))
-        cpskycrd = numpy.array([[cpj2000.ra.deg, cpj2000.dec.deg]],
-                               numpy.float_)
-        cpcrdi = wcsi.wcs_world2pix(cpskycrd, 1)
-        scalei = scale_frm_header(headi)
-        widthi, heighti = wid_hei_frm_header(headi)
-        if wid_hei_frm_header(headi) != wid_hei_frm_header(headh) :
-            stat_bar(self,'Incompatible image dimensions...')
+        self.update_display(result)
+        self.show_annotated(self.iimg_fn, result, 'i')
+        stat_bar(self, 'Idle')
+
+    def annotate_frames(self):
+        '''
+        Find RA axis from several images at different RA rotations, all
+        pairs of them at once, and Annotate the last one
+        '''
+        import tkFileDialog
+        from os.path import splitext, dirname, basename
+        from ppa_wcs import read_records
+        options = {}
+        options['filetypes'] = [('JPEG files', '.jpg .jpeg .JPG .JPEG'),
+                                ('all files', '.*')]
+        options['initialdir'] = self.imgdir
+        options['title'] = 'Images of the Celestial Pole region at ' + \
+                           'different RA rotations'
+        imgs = self.tk.splitlist(tkFileDialog.askopenfilenames(**options))
+        if len(imgs) < 2:
             return
-        if parity_frm_header(headi) == 0 :
-            stat_bar(self,'Wrong parity...')
+        self.imgdir = dirname(imgs[0])
+        wcss = [splitext(img)[0] + '.wcs' for img in imgs]
+        todo = [(img, wcs) for img, wcs in zip(imgs, wcss)
+                if not (self.happy_with(wcs, img) or
+                        self.cached_solution(img, wcs))]
+        if todo:
+            solver = self.choose_solver('RA axis from frames',
+                                        'Solve the %d unsolved images '
+                                        'locally?' % len(todo))
+            hints = [basename(img) for img, wcs in todo]
+            if solver == 'nova':
+                errors = img2wcs_many(self, self.apikey.get(), todo, hints)
+            else:
+                errors = limg2wcs_many(self, todo, hints)
+            if errors is None or [err for err in errors if err is not None]:
+                return
+            for img, wcs in todo:
+                self.remember_solution(img, wcs, solver)
+        stat_bar(self, 'Finding RA axis from %d images...' % len(imgs))
+        try:
+            result = solve_frames(read_records(wcss))
+        except AlignError, err:
+            stat_bar(self, str(err))
             return
-        self.update_display(cpcrdi, scalei)
-        cpcircle(cpcrdi, imi, scalei)
-        cross([axis], imi, 'Red')
-        if self.hemi == 'N':
-            poli = wcsi.wcs_world2pix(self.polaris, 1)
-            lami = wcsi.wcs_world2pix(self.lam, 1)
-            circle(poli, imi, 'White', 'a')
-            circle(lami, imi, 'Orange', 'l')
-            left = int(min(cpcrdi[0][0], poli[0][0], lami[0][0], axis[0]))
-            right = int(max(cpcrdi[0][0], poli[0][0], lami[0][0], axis[0]))
-            bottom = int(min(cpcrdi[0][1], poli[0][1], lami[0][1], axis[1]))
-            top = int(max(cpcrdi[0][1], poli[0][1], lami[0][1], axis[1]))
-        else:
-            ori = wcsi.wcs_world2pix(self.chi, 1)
-            whi = wcsi.wcs_world2pix(self.sigma, 1)
-            rei = wcsi.wcs_world2pix(self.red, 1)
-            circle(whi, imi, 'White', 's')
-            circle(ori, imi, 'Orange', 'c')
-            circle(rei, imi, 'Red', '!')
-            left = int(min(cpcrdi[0][0], ori[0][0], whi[0][0], axis[0]))
-            right = int(max(cpcrdi[0][0], ori[0][0], whi[0][0], axis[0]))
-            bottom = int(min(cpcrdi[0][1], ori[0][1], whi[0][1], axis[1]))
-            top = int(max(cpcrdi[0][1], ori[0][1], whi[0][1], axis[1]))
-        margin = int(2500/scalei)
-        xl = max(1, left - margin)
-        xr = min(widthi, right + margin)
-        yt = min(heighti, top + margin)
-        yb = max(1, bottom - margin)
-        croppedi = imi.crop((xl, yb, xr, yt))
-        croppedi.load()
-        crop_fn = splitext(self.iimg_fn)[0] + '_cropi.ppm'
-        croppedi.save(crop_fn, 'PPM')
-        self.create_imgwin(crop_fn, self.iimg_fn)
-        stat_bar(self, 'Idle')
+        for i, j, resid, used in result.pairs:
+            if not used:
+                print 'Left out', basename(imgs[i]), basename(imgs[j]),
+                print 'moving the axis by %.1f pixels' % resid
+        # later improvement images are compared with the last image
+        self.use_image('v', imgs[0])
+        self.use_image('h', imgs[-1])
+        self.hemi = result.hemi
+        self.axis = result.axis
+        self.update_display(result)
+        self.show_annotated(self.himg_fn, result, 'h')
+        used = len([pair for pair in result.pairs if pair[3]])
+        msg = 'RA axis from %d of %d pairs' % (used, len(result.pairs))
+        if result.uncertainty is not None:
+            msg = msg + ', +/- %.1f, %.1f pixels' % tuple(result.uncertainty)
+        stat_bar(self, msg)
 
     def annotate(self):
         '''
         Find RA axis and Annotate the pair of horiz/vertical images
         '''
-        from PIL import Image
-        from astropy.time import Time
-        import scipy.optimize
-        from astropy.coordinates import SkyCoord
-        from astropy.coordinates import FK5
-        from astropy.io import fits
-        from astropy import wcs
-        import numpy
-        from os.path import splitext
+        from ppa_wcs import read_records
         #
         if self.vimg_fn == self.himg_fn:
             stat_bar(self, ('Image filenames coincide - Check the Image ' +
                             'filenames'))
             return
         try:
-            imh = Image.open(self.himg_fn)
-            # Load the FITS hdulist using astropy.io.fits
-            hdulistv = fits.open(self.vwcs_fn)
-            hdulisth = fits.open(self.hwcs_fn)
-        except IOError:
+            open(self.himg_fn).close()
+            # the plate solutions, parsed once
+            headv, headh = read_records([self.vwcs_fn, self.hwcs_fn])
+        except (IOError, OSError):
             return
         stat_bar(self, 'Finding RA axis...')
-        # Parse the WCS keywords in the primary HDU
-        headv = hdulistv[0].header
-        headh = hdulisth[0].header
-        wcsv = wcs.WCS(headv)
-        wcsh = wcs.WCS(headh)
-        decv = dec_frm_header(headv)
-        dech = dec_frm_header(headh)
-        if decv > 65 and dech > 65:
-            self.hemi = 'N'
-        elif decv < -65 and dech < -65:
-            self.hemi = 'S'
-        else:
-            stat_bar(self, 'Nowhere near (>25 deg) the Poles!')
+        try:
+            result = solve_pair(headv, headh)
+        except AlignError, err:
+            stat_bar(self, str(err))
             return
-        now = Time.now()
+        self.hemi = result.hemi
         if self.hemi == 'N':
-            cp = SkyCoord(ra=0, dec=90, frame='fk5', unit='deg', equinox=now)
+            print 'Northern Celestial Pole', headh.dec
         else:
-            cp = SkyCoord(ra=0, dec=-90, frame='fk5', unit='deg', equinox=now)
-
-        # CP now, in J2000 coordinates, precess
-        cpj2000 = cp.transform_to(FK5(equinox='J2000'))
-        # sky coordinates
-        cpskycrd = numpy.array([[cpj2000.ra.deg, cpj2000.dec.deg]],
-                               numpy.float_)
-        # pixel coordinates
-        cpcrdh = wcsh.wcs_world2pix(cpskycrd, 1)
-        if self.hemi == 'N':
-            print 'Northern Celestial Pole', dech
-        else:
-            print 'Southern Celestial Pole', dech
-        scaleh = scale_frm_header(headh)
-        widthh, heighth = wid_hei_frm_header(headh)
-        if wid_hei_frm_header(headh) != wid_hei_frm_header(headv):
-            stat_bar(self, 'Incompatible image dimensions...')
-            return
-        if parity_frm_header(headh) == 0 or parity_frm_header(headv) == 0 :
-            stat_bar(self, 'Wrong parity...')
-            return
-        
-        def displacement(coords):
-            '''
-            the movement of a sky object in the two images
-            '''
-            pixcrd1 = numpy.array([coords], numpy.float_)
-            skycrd = wcsv.wcs_pix2world(pixcrd1, 1)
-            pixcrd2 = wcsh.wcs_world2pix(skycrd, 1)
-            return pixcrd2 - pixcrd1
-        axis = scipy.optimize.broyden1(displacement, [widthh/2, heighth/2])
-        self.axis = axis
-        self.update_display(cpcrdh, scaleh)
+            print 'Southern Celestial Pole', headh.dec
+        self.axis = result.axis
+        self.update_display(result)
         #
         stat_bar(self, 'Annotating...')
-        cpcircle(cpcrdh, imh, scaleh)
-        cross([axis], imh, 'Red')
-        # add reference stars
-        if self.hemi == 'N':
-            polh = wcsh.wcs_world2pix(self.polaris, 1)
-            lamh = wcsh.wcs_world2pix(self.lam, 1)
-            circle(polh, imh, 'White', 'a')
-            circle(lamh, imh, 'Orange', 'l')
-            left = int(min(cpcrdh[0][0], polh[0][0], lamh[0][0], axis[0]))
-            right = int(max(cpcrdh[0][0], polh[0][0], lamh[0][0], axis[0]))
-            bottom = int(min(cpcrdh[0][1], polh[0][1], lamh[0][1], axis[1]))
-            top = int(max(cpcrdh[0][1], polh[0][1], lamh[0][1], axis[1]))
-        else:
-            orh = wcsh.wcs_world2pix(self.chi, 1)
-            whh = wcsh.wcs_world2pix(self.sigma, 1)
-            reh = wcsh.wcs_world2pix(self.red, 1)
-            circle(whh, imh, 'White', 's')
-            circle(orh, imh, 'Orange', 'c')
-            circle(reh, imh, 'Red', '!')
-            left = int(min(cpcrdh[0][0], orh[0][0], whh[0][0], axis[0]))
-            right = int(max(cpcrdh[0][0], orh[0][0], whh[0][0], axis[0]))
-            bottom = int(min(cpcrdh[0][1], orh[0][1], whh[0][1], axis[1]))
-            top = int(max(cpcrdh[0][1], orh[0][1], whh[0][1], axis[1]))
-        margin = int(2500/scaleh)
-        xl = max(1, left - margin)
-        xr = min(widthh, right + margin)
-        yt = min(heighth, top + margin)
-        yb = max(1, bottom - margin)
-        croppedh = imh.crop((xl, yb, xr, yt))
-        croppedh.load()
-        crop_fn = splitext(self.himg_fn)[0] + '_croph.ppm'
-        croppedh.save(crop_fn, 'PPM')
-        self.create_imgwin(crop_fn, self.himg_fn)
+        self.show_annotated(self.himg_fn, result, 'h')
         stat_bar(self, 'Idle')
 
-    def create_imgwin(self, img_fn, title):
+    def create_imgwin(self, img, title, origin=(0, 0), reduce=1.0):
         '''
-        creates a window to display an image
+        creates a window to display a (PIL) image, which starts at origin
+        of a bigger one and is reduced by reduce
         '''
         from os.path import basename
+        from ppa_viewer import ImageViewer
         # create child window
-        img = PhotoImage(file=img_fn)
         win = Toplevel()
-        wwid = min(800, img.width())
-        whei = min(800, img.height())
+        wwid = min(800, img.size[0])
+        whei = min(800, img.size[1])
         win.geometry(('%dx%d' % (wwid+28, whei+28)))
         win.title(basename(title))
-        frame = Frame(win, bd=0)
-        frame.pack()
-        xscrollbar = Scrollbar(frame, orient='horizontal')
-        xscrollbar.pack(side='bottom', fill='x')
-        yscrollbar = Scrollbar(frame, orient='vertical')
-        yscrollbar.pack(side='right', fill='y')
-        canvas = Canvas(frame, bd=0, width=wwid, height=whei,
-                        scrollregion=(0, 0, img.width(), img.height()),
-                        xscrollcommand=xscrollbar.set,
-                        yscrollcommand=yscrollbar.set)
-        canvas.pack(side='top', fill='both', expand=1)
-        canvas.create_image(0, 0, image=img, anchor='nw')
-        xscrollbar.config(command=canvas.xview)
-        yscrollbar.config(command=canvas.yview)
-        frame.pack()
-        # next statement is important! creates reference to img
-        canvas.img = img
+        viewer = ImageViewer(win, img, wwid, whei, origin, reduce)
+        viewer.pack(side='top', fill='both', expand=1)
+        return viewer
 
     def update_solved_labels(self, hint, sta):
         '''
@@ -1226,10 +1506,20 @@ class PhotoPolarAlign(Frame):
         self.menubar.add_cascade(label='Help', menu=self.helpmenu)
         self.filemenu.add_command(label='Settings...',
                                   command=self.settings_open)
+        self.filemenu.add_command(label='RA axis from frames...',
+                                  command=self.annotate_frames)
+        self.frames_entry = self.filemenu.index('end')
+        self.filemenu.add_command(label='Watch folder...',
+                                  command=self.watch_folder)
+        self.watch_entry = self.filemenu.index('end')
         self.filemenu.add_command(label='Exit', command=self.quit_method)
         self.helpmenu.add_command(label='Help', command=help_f)
+        self.helpmenu.add_command(label='Startup times...',
+                                  command=startup_f)
         self.helpmenu.add_command(label='About...', command=about_f)
         self.myparent.config(menu=self.menubar)
+        self.myparent.bind('<Escape>', self.cancel_method)
+        self.myparent.protocol('WM_DELETE_WINDOW', self.close_method)
         # #################################################################
         self.wfrop = LabelFrame(master, text='Operations')
         self.wfrop.pack(side='top', fill='x')
@@ -1260,6 +1550,15 @@ class PhotoPolarAlign(Frame):
         nxt.grid(row=5, column=1, sticky='ew', padx=10, pady=4)
         self.whok = nxt
         #
+        nxt = Button(self.wfrop, text='Nova (all)',
+                     command=lambda : self.solve_all('nova'))
+        nxt.grid(row=1, column=3, sticky='ew', padx=10, pady=4, columnspan=2)
+        self.wasol = nxt
+        nxt = Button(self.wfrop, text='Local (all)',
+                     command=lambda : self.solve_all('local'))
+        nxt.grid(row=2, column=3, sticky='ew', padx=10, pady=4, columnspan=2)
+        self.wlasol = nxt
+        #
         nxt = Button(self.wfrop, text='Find Polar Axis',
                      command=self.annotate)
         nxt.grid(row=6, column=0, sticky='ew', padx=10, pady=4, columnspan=2)
@@ -1354,22 +1653,8 @@ class PhotoPolarAlign(Frame):
 
     def __init__(self, master=None):
         import ConfigParser
-        import numpy
         import os 
-        # a F8Ib 2.0 mag star, Alpha Ursa Minoris
-        self.polaris = numpy.array([[037.954561, 89.264109]], numpy.float_)
-        #
-        # a M1III 6.4 mag star, Lambda Ursa Minoris
-        self.lam = numpy.array([[259.235229, 89.037706]], numpy.float_)
-        #
-        # a F0III 5.4 mag star, Sigma Octans
-        self.sigma = numpy.array([[317.195164, -88.956499]], numpy.float_)
-        #
-        # a K3IIICN 5.3 mag star, Chi Octans
-        self.chi = numpy.array([[283.696388, -87.605843]], numpy.float_)
-        #
-        # a M1III 7.2 mag star, HD90104
-        self.red = numpy.array([[130.522862, -89.460536]], numpy.float_)
+        # the reference stars are in refstars.dat (ppa_catalog)
         #
         # the pixel coords of the RA axis, if solution exists
         self.axis = None
@@ -1397,6 +1682,11 @@ class PhotoPolarAlign(Frame):
         except :
             k_ini = None
         self.apikey = StringVar(value=k_ini)
+        # ...the server (e.g. a stand-in, see ppa_fakenova.py)
+        try:
+            self.nova_server = self.config.get('nova', 'server', None)
+        except :
+            self.nova_server = NovaClient.default_url
         # ...the Image directory
         try: 
             self.imgdir = self.config.get('file', 'imgdir', None)
@@ -1414,6 +1704,55 @@ class PhotoPolarAlign(Frame):
             self.restrict_scale.set(self.config.get('operations','restrict scale', 0))
         except:
             self.restrict_scale.set(0)
+        # do we tell the solvers where on the sky to look
+        self.restrict_position = IntVar(0)
+        try:
+            self.restrict_position.set(self.config.get('operations','hint position', 0))
+        except:
+            self.restrict_position.set(0)
+        # the Pole of last time, until we know this time's
+        try:
+            self.last_hemi = self.config.get('operations','hemisphere', None) or None
+        except:
+            self.last_hemi = None
+        # do we find the stars ourselves and only send the solvers their list
+        self.send_stars = IntVar(0)
+        try:
+            self.send_stars.set(self.config.get('operations','send stars', 0))
+        except:
+            self.send_stars.set(0)
+        # do we give the solvers grey, binned, copies of the images
+        self.binning = IntVar(value=1)
+        try:
+            self.binning.set(self.config.get('operations','binning', 1))
+        except:
+            self.binning.set(1)
+        # the plate solution cache
+        try:
+            cachedir = self.config.get('cache', 'dir', None)
+        except:
+            cachedir = os.path.join(os.path.expanduser('~'),
+                                    '.PhotoPolarAlign', 'cache')
+        try:
+            max_mb = self.config.getint('cache', 'max_mb')
+        except:
+            max_mb = 100
+        self.cache = SolutionCache(cachedir, max_mb*1024*1024)
+        # the nova submissions in flight, to resume them
+        self.journal = JobJournal(os.path.join(os.path.expanduser('~'),
+                                               '.PhotoPolarAlign',
+                                               'journal.json'))
+        # JSON-lines file of the timings, Prometheus text file of their
+        # totals; empty for none
+        try:
+            self.metrics_jsonl = self.config.get('metrics', 'jsonl', '')
+        except:
+            self.metrics_jsonl = ''
+        try:
+            self.metrics_prom = self.config.get('metrics', 'prom', '')
+        except:
+            self.metrics_prom = ''
+        ppa_metrics.configure(self.metrics_jsonl, self.metrics_prom)
             
         # the filenames of images
         self.vimg_fn = ''
@@ -1435,10 +1774,26 @@ class PhotoPolarAlign(Frame):
         self.scale = None
         # the discovered hemisphere
         self.hemi = None
+        # the image windows of the h and i images
+        self.viewers = {}
+        # the capture folder we watch, the new images in it and the
+        # solver for them
+        self.watch = None
+        self.watch_queue = []
+        self.watch_solver = 'nova'
+        # set when the user wants to stop waiting for a solve
+        self.cancel_solve = False
+        # how many solves (or waits) deep we are, the states of the
+        # buttons they disabled, and how to quit once they are done
+        self.busy_depth = 0
+        self.busy_states = {}
+        self.quitting = None
         # initialise attributes set elsewhere
         self.menubar = None
         self.helpmenu = None
         self.filemenu = None
+        self.frames_entry = None
+        self.watch_entry = None
         self.wfrop = None
         self.wvfn = None
         self.wvsol = None
@@ -1457,6 +1812,8 @@ class PhotoPolarAlign(Frame):
 
         self.wann = None
         self.wanni = None
+        self.wasol = None
+        self.wlasol = None
 
         self.wfr2 = None
         self.wfrvar = None
@@ -1480,12 +1837,15 @@ class PhotoPolarAlign(Frame):
 
         
         self.stat_msg = 'Idle'
+        startup_phase('preferences')
         Frame.__init__(self, master)
         self.create_widgets(master)
+        startup_phase('widgets')
         # check local solver
         self.wlvsol.configure(state='disabled')
         self.wlhsol.configure(state='disabled')
         self.wlisol.configure(state='disabled')
+        self.wlasol.configure(state='disabled')
         try:
             self.local_shell.set(self.config.get('local','shell',''))
             self.local_downscale.set(self.config.get('local','downscale',1))
@@ -1494,14 +1854,6 @@ class PhotoPolarAlign(Frame):
             self.local_scale_low.set(self.config.get('local','scale_low',0))
             self.local_scale_hi.set(self.config.get('local','scale_hi',0))
             self.local_xtra.set(self.config.get('local','xtra',''))
-            # check solve-field cmd
-            exit_status = os.system(self.local_shell.get() % 'solve-field > /dev/null')
-            if exit_status != 0:
-                print "Can't use local astrometry.net solver, check PATH"
-            else:
-                self.wlvsol.configure(state='active')
-                self.wlhsol.configure(state='active')
-                self.wlisol.configure(state='active')
         except:
             self.local_shell.set('')
             self.local_downscale.set(1)
@@ -1513,9 +1865,17 @@ class PhotoPolarAlign(Frame):
         if not self.apikey.get() or self.apikey.get()=='':
             self.settings_open()
         self.pack()
+        # once the window is up
+        self.after_idle(self.warm_up)
+        # check solve-field cmd
+        self.after_idle(self.probe_solver, True)
         #
 
-ROOT = Tk()
-ROOT.geometry('440x470+300+300')
-APP = PhotoPolarAlign(master=ROOT)
-ROOT.mainloop()
+if __name__ == '__main__':
+    ROOT = Tk()
+    ROOT.geometry('440x470+300+300')
+    startup_phase('Tk')
+    APP = PhotoPolarAlign(master=ROOT)
+    if '--startup-times' in sys.argv:
+        report_startup(ROOT)
+    ROOT.mainloop()
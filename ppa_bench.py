@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of PhotoPolarAlign
+
+Times the annotate path (header parsing, the RA axis, precession, the
+overlay, decoding and cropping, the viewer's first tiles) over the
+images in Testing/ (the one next to this file, unless -d says
+otherwise), and prints the timings as JSON.
+
+The images come without plate solutions, so unless a .wcs sits next to
+an image, its solution is a SYNTHETIC one made up here: a TAN
+projection at the scale of the set (N: 4.21"/px from its notes; S:
+worked out from the focal length for 5.2 um pixels), with the vertical
+and horizontal frames 90 degrees apart about an RA axis 0.5 degrees
+from the Pole. The results say which solutions were synthetic.
+
+Usage: python ppa_bench.py [-n repeats] [-o out.json] [-d Testing]
+                           [set ...]
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import sys
+import time
+from os.path import abspath, dirname, join
+
+# the test images, unless -d says otherwise
+TESTING = join(dirname(abspath(__file__)), 'Testing')
+
+# the test sets: vertical, horizontal and improved images, the scale
+# (arcsec/pixel) and the Pole they are of; dir is in TESTING
+SETS = [
+    {'name': 'N-20141206', 'dir': 'N/20141206', 'hemi': 'N',
+     'scale': 4.21, 'v': 'vert.JPG', 'h': 'horiz.JPG',
+     'i': 'IMG_0004.JPG'},
+    {'name': 'S-20141202-42mm', 'dir': 'S/20141202', 'hemi': 'S',
+     'scale': 206.265*5.2/42, 'v': 'v_42mm_MG_3675.JPG',
+     'h': 'h_42mm_MG_3674.JPG', 'i': None},
+    {'name': 'S-20141202-108mm', 'dir': 'S/20141202', 'hemi': 'S',
+     'scale': 206.265*5.2/108, 'v': 'v_108mm_MG_3676.JPG',
+     'h': 'h_108mm_MG_3677.JPG', 'i': 'h2_108mm_MG_3678.JPG'},
+    {'name': 'S-20141202-200mm', 'dir': 'S/20141202', 'hemi': 'S',
+     'scale': 206.265*5.2/200, 'v': 'v_200mm_MG_3684.JPG',
+     'h': 'h_200mm_MG_3683.JPG', 'i': None}]
+
+
+def synthetic_header(img_fn, scale, rot, hemi, offset=0.5, shift=(0, 0)):
+    '''
+    a made-up plate solution of img_fn: rotated by rot degrees about an
+    RA axis (at 45% across, 55% down the image) that is offset degrees
+    from the Pole; shift (pixels) moves the axis, as an Alt/Az
+    adjustment would
+    '''
+    import math
+    from PIL import Image
+    from astropy.io import fits
+    wid, hei = Image.open(img_fn).size
+    ang = math.radians(rot)
+    sdeg = scale/3600.0
+    head = fits.Header()
+    head['CTYPE1'] = 'RA---TAN'
+    head['CTYPE2'] = 'DEC--TAN'
+    # the sky at the axis pixel is the same in all the frames
+    head['CRVAL1'] = 40.0
+    head['CRVAL2'] = (90.0 - offset) if hemi == 'N' else (offset - 90.0)
+    head['CRPIX1'] = 0.45*wid + shift[0]
+    head['CRPIX2'] = 0.55*hei + shift[1]
+    head['CD1_1'] = -sdeg*math.cos(ang)
+    head['CD1_2'] = sdeg*math.sin(ang)
+    head['CD2_1'] = sdeg*math.sin(ang)
+    head['CD2_2'] = sdeg*math.cos(ang)
+    head['IMAGEW'] = wid
+    head['IMAGEH'] = hei
+    head['COMMENT'] = 'scale: %f' % scale
+    head['COMMENT'] = 'parity: 1'
+    return head
+
+
+def fixtures(bset, tmpdir, testing=TESTING):
+    '''
+    the .wcs files of the v, h (and i) images of a set, and whether they
+    are synthetic
+    '''
+    import shutil
+    from os.path import exists, splitext
+    from astropy.io import fits
+    fns = {}
+    synthetic = {}
+    for hint, rot, shift in (('v', 0.0, (0, 0)), ('h', 90.0, (0, 0)),
+                             ('i', 90.0, (40, -25))):
+        if not bset[hint]:
+            continue
+        img = join(testing, bset['dir'], bset[hint])
+        real = splitext(img)[0] + '.wcs'
+        wcsfn = join(tmpdir, '%s_%s.wcs' % (bset['name'], hint))
+        if exists(real):
+            shutil.copyfile(real, wcsfn)
+            synthetic[hint] = False
+        else:
+            head = synthetic_header(img, bset['scale'], rot, bset['hemi'],
+                                    shift=shift)
+            fits.PrimaryHDU(header=head).writeto(wcsfn)
+            synthetic[hint] = True
+        fns[hint] = wcsfn
+    return fns, synthetic
+
+
+def maxrss_kb():
+    '''
+    the peak memory of the process so far (KB), None where we can't tell
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on OS X
+        peak = peak//1024
+    return peak
+
+
+def timed(func, repeats):
+    '''
+    runs func repeats times; its fastest and median seconds, the peak
+    memory afterwards and how much the stage raised it, and its last
+    result
+    '''
+    before = maxrss_kb()
+    times = []
+    res = None
+    for _ in range(repeats):
+        start = time.time()
+        res = func()
+        times.append(time.time() - start)
+    times.sort()
+    after = maxrss_kb()
+    stats = {'best_s': times[0], 'median_s': times[len(times)//2],
+             'repeats': repeats, 'maxrss_kb': after}
+    if before is not None:
+        stats['maxrss_growth_kb'] = after - before
+    return stats, res
+
+
+def bench_set(bset, repeats, testing=TESTING):
+    '''
+    the timings of the annotate path for one set, of the images in testing
+    '''
+    import shutil
+    import tempfile
+    from astropy.io import fits
+    import ppa_engine
+    import ppa_wcs
+    import PPA
+    from ppa_viewer import Pyramid, TILE
+    tmpdir = tempfile.mkdtemp(prefix='ppa_bench_')
+    try:
+        fns, synthetic = fixtures(bset, tmpdir, testing)
+        hint = 'i' if 'i' in fns else 'h'
+        img_fn = join(testing, bset['dir'], bset[hint])
+        stages = {}
+        heads = dict([(key, fits.getheader(fn)) for key, fn in fns.items()])
+        stages['parse_header'], recs = timed(
+            lambda: dict([(key, ppa_wcs.parse_header(head))
+                          for key, head in heads.items()]), repeats)
+
+        def cold():
+            '''
+            read the records with no sidecar index
+            '''
+            ppa_wcs._INDEXES.clear()
+            try:
+                import os
+                os.remove(join(tmpdir, ppa_wcs.INDEX_FN))
+            except OSError:
+                pass
+            return ppa_wcs.read_records(fns.values())
+        stages['read_records_cold'], _ = timed(cold, repeats)
+
+        def warm():
+            '''
+            read the records from the sidecar index
+            '''
+            ppa_wcs._INDEXES.clear()
+            return ppa_wcs.read_records(fns.values())
+        stages['read_records_index'], _ = timed(warm, repeats)
+        stages['axis'], result = timed(
+            lambda: ppa_engine.solve_pair(recs['v'], recs['h']), repeats)
+        if hint == 'i':
+            stages['improvement'], result = timed(
+                lambda: ppa_engine.solve_improvement(
+                    recs['i'], recs['h'], result.axis, result.hemi),
+                repeats)
+        stages['precession'], _ = timed(
+            lambda: ppa_engine._precess_pole(bset['hemi'], time.time()),
+            repeats)
+        stages['precession_cached'], _ = timed(
+            lambda: ppa_engine.celestial_pole(bset['hemi']), repeats)
+        stages['overlay'], _ = timed(lambda: PPA.annotations(result), repeats)
+        box = PPA.crop_box(result)
+        stages['decode_crop'], crop = timed(
+            lambda: PPA.load_region(img_fn, box, PPA.PREVIEW_SIZE), repeats)
+        img = crop[0]
+
+        def first_tiles():
+            '''
+            the tiles of the viewer's first view, and one zoom out
+            '''
+            pyr = Pyramid(img)
+            view = min(PPA.PREVIEW_SIZE, img.size[0]), \
+                min(PPA.PREVIEW_SIZE, img.size[1])
+            tiles = []
+            for zoom in (0, -1):
+                for row in range((view[1] - 1)//TILE + 1):
+                    for col in range((view[0] - 1)//TILE + 1):
+                        tiles.append(pyr.tile(zoom, col, row))
+            return tiles
+        stages['display_tiles'], _ = timed(first_tiles, repeats)
+        return {'image': img_fn, 'scale': bset['scale'],
+                'synthetic_wcs': synthetic,
+                'crop': list(box), 'crop_pixels': list(img.size),
+                'reduce': crop[1], 'stages': stages}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(names=None, repeats=5, testing=TESTING):
+    '''
+    the benchmarks of the sets named (default all), of the images in
+    testing, as a dict
+    '''
+    import platform
+    import warnings
+    warnings.simplefilter('ignore')
+    out = {'when': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'note': 'maxrss_kb is the peak of the whole process so far',
+           'sets': {}}
+    for bset in SETS:
+        if names and bset['name'] not in names:
+            continue
+        out['sets'][bset['name']] = bench_set(bset, repeats, testing)
+    return out
+
+
+def main(argv):
+    '''
+    run the benchmarks from the command line
+    '''
+    import json
+    import optparse
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('-n', dest='repeats', type='int', default=5,
+                      help='times to run each stage (default %default)')
+    parser.add_option('-o', dest='output', help='write the JSON here')
+    parser.add_option('-d', dest='testing', default=TESTING,
+                      help='the test images (default %default)')
+    opts, names = parser.parse_args(argv[1:])
+    res = json.dumps(run(names, opts.repeats, opts.testing), indent=1,
+                     sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as fle:
+            fle.write(res + '\n')
+    else:
+        print res
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Plate solution cache of PhotoPolarAlign
+
+Solutions are kept by the content of the image (and the solver
+parameters), not by file name or time, so a copied, renamed or
+re-downloaded frame does not need solving again. The cache also knows,
+by their content, which image each of its solutions was made for, so a
+.wcs next to an image can be checked against the image itself.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import threading
+from ppa_metrics import count
+
+_LOCK = threading.Lock()
+# (path, size, mtime) -> hash, so we read each image once
+_HASHES = {}
+
+
+def image_hash(fn, chunk_size=1024*1024):
+    '''
+    the SHA-1 of a file's content, as hex
+    '''
+    import hashlib
+    sha = hashlib.sha1()
+    with open(fn, 'rb') as fle:
+        while True:
+            chunk = fle.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_of(fn):
+    '''
+    the hash of an image, remembered while the file is unchanged (the
+    ctime too, as a rewrite can keep the size and put back the mtime)
+    '''
+    import os
+    sta = os.stat(fn)
+    ident = (fn, sta.st_size, sta.st_mtime, sta.st_ctime)
+    with _LOCK:
+        if ident in _HASHES:
+            return _HASHES[ident]
+    digest = image_hash(fn)
+    with _LOCK:
+        _HASHES[ident] = digest
+    return digest
+
+
+class SolutionCache(object):
+    '''
+    a directory of .wcs files named by key, at most maxbytes big; the
+    least recently used are thrown away first
+    '''
+    def __init__(self, cachedir, maxbytes=100*1024*1024):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+
+    def key(self, imgfn, params=None):
+        '''
+        the cache key of an image solved with these parameters
+        '''
+        import hashlib
+        if params is None:
+            params = {}
+        sha = hashlib.sha1(hash_of(imgfn))
+        for name in sorted(params):
+            sha.update('\0%s=%r' % (name, params[name]))
+        return sha.hexdigest()
+
+    def path(self, key):
+        '''
+        where a solution is kept
+        '''
+        from os.path import join
+        return join(self.cachedir, key + '.wcs')
+
+    def owner_path(self, wcsfn):
+        '''
+        where the hash of the image the solution in wcsfn was made for
+        is kept
+        '''
+        from os.path import join
+        return join(self.cachedir, image_hash(wcsfn) + '.owner')
+
+    def owner(self, wcsfn):
+        '''
+        the hash of the image the solution in wcsfn was made for, None if
+        it isn't one of ours
+        '''
+        try:
+            with open(self.owner_path(wcsfn)) as fle:
+                return fle.read().strip() or None
+        except IOError:
+            return None
+
+    def fetch(self, key, wcsfn):
+        '''
+        copies a cached solution to wcsfn, returns whether there was one
+        '''
+        import os
+        import shutil
+        src = self.path(key)
+        try:
+            shutil.copyfile(src, wcsfn)
+        except IOError:
+            count('cache_misses', cache='solution')
+            return False
+        count('cache_hits', cache='solution')
+        try:
+            # mark it as recently used
+            os.utime(src, None)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, wcsfn, imghash=None):
+        '''
+        keeps a copy of the solution in wcsfn, made for the image of hash
+        imghash
+        '''
+        import os
+        import shutil
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        tmp = self.path(key) + '.tmp'
+        shutil.copyfile(wcsfn, tmp)
+        if os.path.exists(self.path(key)):
+            # Windows won't rename over an existing file
+            self.forget(self.path(key))
+        os.rename(tmp, self.path(key))
+        if imghash is not None:
+            with open(self.owner_path(self.path(key)), 'w') as fle:
+                fle.write(imghash)
+        self.evict()
+
+    def forget(self, fn):
+        '''
+        removes the cached solution fn, and its owner
+        '''
+        import os
+        try:
+            os.remove(self.owner_path(fn))
+        except (IOError, OSError):
+            pass
+        os.remove(fn)
+
+    def evict(self):
+        '''
+        throws away the least recently used solutions until the cache
+        fits in maxbytes
+        '''
+        import os
+        from os.path import join
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not name.endswith('.wcs'):
+                continue
+            try:
+                sta = os.stat(join(self.cachedir, name))
+            except OSError:
+                continue
+            entries.append((sta.st_mtime, sta.st_size, name))
+            total = total + sta.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                self.forget(join(self.cachedir, name))
+                total = total - size
+            except OSError:
+                pass
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Reference star catalog of PhotoPolarAlign
+
+The stars we annotate images with live in a small text file,
+refstars.dat, one star per line:
+
+    label colour RA Dec pmRA pmDec mag name
+
+RA, Dec in J2000 degrees (epoch J2000), proper motions in mas/yr (pmRA
+includes the cos(Dec)), label is the character drawn in the symbol
+font next to the star. The stars are put in buckets of a few grids on
+the unit sphere, so the stars in an image are found without looking at
+them all.
+
+Usage: python ppa_catalog.py stars.csv refstars.dat [min |Dec| [max mag]]
+builds refstars.dat from a Tycho-2 or Hipparcos CSV (e.g. from VizieR),
+python ppa_catalog.py --vizier refstars.dat [min |Dec| [max mag]]
+fetches the Tycho-2 stars around both Poles from VizieR and builds it
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import sys
+
+# the bundled catalog, next to this file
+CATALOG_FN = 'refstars.dat'
+# grid cell sizes (chord on the unit sphere), 0.01 is ~0.6 degrees
+CELLS = [0.01*2**k for k in range(9)]
+# the first of January 2000, 12:00 TT, as unix time (near enough)
+J2000_UNIX = 946728000.0
+# the Tycho-2 catalog on VizieR, as tab separated values
+VIZIER_URL = 'http://vizier.cds.unistra.fr/viz-bin/asu-tsv'
+VIZIER_COLUMNS = ['TYC1', 'TYC2', 'TYC3', 'RAmdeg', 'DEmdeg', 'pmRA', 'pmDE',
+                  'BTmag', 'VTmag', 'RAdeg', 'DEdeg']
+
+
+def unit_vectors(ra, dec):
+    '''
+    RA, Dec (degrees, arrays) as rows of x, y, z on the unit sphere
+    '''
+    import numpy
+    rar = numpy.radians(ra)
+    decr = numpy.radians(dec)
+    return numpy.column_stack((numpy.cos(decr)*numpy.cos(rar),
+                               numpy.cos(decr)*numpy.sin(rar),
+                               numpy.sin(decr)))
+
+
+def footprint(wcsx, width, height):
+    '''
+    the RA, Dec of the middle of an image of width x height pixels with
+    plate solution wcsx, and the radius (degrees) of the circle around
+    its corners
+    '''
+    import numpy
+    pix = numpy.array([[(width + 1)/2.0, (height + 1)/2.0],
+                       [0.5, 0.5], [width + 0.5, 0.5],
+                       [0.5, height + 0.5], [width + 0.5, height + 0.5]])
+    sky = wcsx.wcs_pix2world(pix, 1)
+    vecs = unit_vectors(sky[:, 0], sky[:, 1])
+    cosr = numpy.clip(numpy.dot(vecs[1:], vecs[0]), -1.0, 1.0).min()
+    return (float(sky[0][0]), float(sky[0][1]),
+            float(numpy.degrees(numpy.arccos(cosr))))
+
+
+class Catalog(object):
+    '''
+    stars, with an index to find those within some radius of a point
+    '''
+    def __init__(self, stars):
+        import numpy
+        # (label, colour, ra, dec, pmra, pmdec, mag, name)
+        self.labels = [star[0] for star in stars]
+        self.colours = [star[1] for star in stars]
+        self.names = [star[7] for star in stars]
+        num = numpy.array([star[2:7] for star in stars],
+                          numpy.float_).reshape(-1, 5)
+        self.ra = num[:, 0]
+        self.dec = num[:, 1]
+        self.pmra = num[:, 2]
+        self.pmdec = num[:, 3]
+        self.mag = num[:, 4]
+        self.vecs = unit_vectors(self.ra, self.dec)
+        # one dict of cell -> star indices per grid
+        self.grids = []
+        for cell in CELLS:
+            keys = numpy.floor((self.vecs + 1.0)/cell).astype(int)
+            grid = {}
+            for i, key in enumerate(map(tuple, keys)):
+                grid.setdefault(key, []).append(i)
+            self.grids.append(grid)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def near(self, ra, dec, radius):
+        '''
+        the indices of the stars within radius (degrees) of ra, dec
+        '''
+        import numpy
+        import itertools
+        cen = unit_vectors([ra], [dec])[0]
+        chord = 2*numpy.sin(numpy.radians(min(radius, 180.0))/2)
+        # the finest grid where the search is at most 3 cells across
+        level = 0
+        while level < len(CELLS) - 1 and CELLS[level] < chord:
+            level = level + 1
+        cell = CELLS[level]
+        grid = self.grids[level]
+        lows = numpy.floor((cen - chord + 1.0)/cell).astype(int)
+        highs = numpy.floor((cen + chord + 1.0)/cell).astype(int)
+        idx = []
+        for key in itertools.product(*[range(lo, hi + 1)
+                                       for lo, hi in zip(lows, highs)]):
+            idx.extend(grid.get(key, ()))
+        idx = numpy.array(sorted(idx), int)
+        if len(idx) == 0:
+            return idx
+        close = numpy.dot(self.vecs[idx], cen) >= numpy.cos(
+            numpy.radians(radius))
+        return idx[close]
+
+    def radec(self, idx, when=None):
+        '''
+        RA, Dec of the stars idx, moved on by their proper motions to
+        unix time when (default now), as rows
+        '''
+        import time
+        import numpy
+        if when is None:
+            when = time.time()
+        years = (when - J2000_UNIX)/(365.25*86400.0)
+        dec = self.dec[idx] + self.pmdec[idx]*years/3.6e6
+        cosd = numpy.maximum(numpy.cos(numpy.radians(self.dec[idx])), 1e-6)
+        ra = self.ra[idx] + self.pmra[idx]*years/3.6e6/cosd
+        return numpy.column_stack((ra % 360.0, dec))
+
+    def in_footprint(self, wcsx, width, height):
+        '''
+        the indices of the stars that may be in an image of width x height
+        pixels with plate solution wcsx (those within the circle around
+        its corners)
+        '''
+        return self.near(*footprint(wcsx, width, height))
+
+
+def read_catalog(fn):
+    '''
+    the stars of a catalog file
+    '''
+    stars = []
+    with open(fn) as fle:
+        for line in fle:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            tkns = line.split(None, 7)
+            if len(tkns) < 8:
+                tkns.append('')
+            stars.append((tkns[0], tkns[1]) +
+                         tuple([float(tkn) for tkn in tkns[2:7]]) +
+                         (tkns[7],))
+    return Catalog(stars)
+
+
+def write_catalog(fn, stars, comment=''):
+    '''
+    writes stars (label, colour, ra, dec, pmra, pmdec, mag, name) to a
+    catalog file
+    '''
+    with open(fn, 'w') as fle:
+        for line in comment.splitlines():
+            fle.write('# %s\n' % line)
+        fle.write('# label colour RA Dec pmRA pmDec mag name\n')
+        for star in stars:
+            fle.write('%s %s %.6f %.6f %.2f %.2f %.2f %s\n' % star)
+
+
+_DEFAULT = []
+
+
+def default_catalog():
+    '''
+    the bundled catalog, read once
+    '''
+    if not _DEFAULT:
+        from os.path import abspath, dirname, join
+        _DEFAULT.append(read_catalog(join(dirname(abspath(__file__)),
+                                          CATALOG_FN)))
+    return _DEFAULT[0]
+
+
+def colour_frm_bv(bv):
+    '''
+    the colour we draw a star of B-V colour index bv in
+    '''
+    if bv < 0.3:
+        return 'White'
+    elif bv < 0.8:
+        return 'Yellow'
+    elif bv < 1.4:
+        return 'Orange'
+    return 'Red'
+
+
+def _column(row, names):
+    '''
+    the first of the columns names that the row has a value for
+    '''
+    for name in names:
+        val = row.get(name, '')
+        if val is not None and val.strip() != '':
+            return val.strip()
+    return None
+
+
+def select_stars(rows, min_dec=80.0, max_mag=9.0):
+    '''
+    the stars of rows (dicts of Tycho-2 or Hipparcos columns) that are
+    within 90 - min_dec degrees of either Pole and brighter than max_mag,
+    brightest first
+    '''
+    stars = []
+    for row in rows:
+        rad = _column(row, ('RAmdeg', 'RAdeg', 'RA_ICRS', 'RAICRS', 'ra'))
+        decd = _column(row, ('DEmdeg', 'DEdeg', 'DE_ICRS', 'DEICRS', 'dec'))
+        if rad is None or decd is None:
+            continue
+        dec = float(decd)
+        if abs(dec) < min_dec:
+            continue
+        vmag = _column(row, ('Vmag', 'VTmag', 'Hpmag', 'mag'))
+        if vmag is None or float(vmag) > max_mag:
+            continue
+        bmag = _column(row, ('BTmag',))
+        bv = _column(row, ('B-V', 'BV'))
+        if bv is not None:
+            bv = float(bv)
+        elif bmag is not None:
+            # Tycho's BT-VT to Johnson's B-V, roughly
+            bv = 0.85*(float(bmag) - float(vmag))
+        else:
+            bv = 0.5
+        pmra = float(_column(row, ('pmRA', 'pmra')) or 0.0)
+        pmdec = float(_column(row, ('pmDE', 'pmdec')) or 0.0)
+        name = _column(row, ('HIP', 'TYC', 'Name', 'name')) or ''
+        if 'TYC1' in row:
+            name = 'TYC%s-%s-%s' % (row['TYC1'].strip(),
+                                    row['TYC2'].strip(),
+                                    row['TYC3'].strip())
+        elif _column(row, ('HIP',)):
+            name = 'HIP' + name
+        stars.append(('*', colour_frm_bv(bv), float(rad), dec, pmra,
+                      pmdec, float(vmag), name.replace(' ', '_')))
+    stars.sort(key=lambda star: star[6])
+    return stars
+
+
+def build_catalog(csvfn, outfn, min_dec=80.0, max_mag=9.0):
+    '''
+    writes a catalog of the stars of a Tycho-2 or Hipparcos CSV that are
+    within 90 - min_dec degrees of either Pole and brighter than max_mag.
+    Returns how many stars it kept
+    '''
+    import csv
+    with open(csvfn, 'rb') as fle:
+        stars = select_stars(csv.DictReader(fle), min_dec, max_mag)
+    write_catalog(outfn, stars, 'built from %s, |Dec| >= %g, mag <= %g'
+                  % (csvfn, min_dec, max_mag))
+    return len(stars)
+
+
+def read_tsv(fle):
+    '''
+    the rows (dicts) of a VizieR asu-tsv answer: comments, a line of
+    column names, one of units, one of dashes, then the stars
+    '''
+    names = None
+    for line in fle:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line[0] == '#':
+            continue
+        if names is None:
+            names = [name.strip() for name in line.split('\t')]
+            units = True
+            continue
+        if units:
+            # the line of units
+            units = False
+            continue
+        if not line.replace('\t', '').replace(' ', '').strip('-'):
+            continue
+        yield dict(zip(names, line.split('\t')))
+
+
+def fetch_catalog(outfn, min_dec=80.0, max_mag=9.0, url=VIZIER_URL):
+    '''
+    writes a catalog of the Tycho-2 stars within 90 - min_dec degrees of
+    either Pole and brighter than max_mag, fetched from VizieR. Returns
+    how many stars it kept
+    '''
+    import urllib
+    import urllib2
+    stars = []
+    for pole in ('0 +90', '0 -90'):
+        query = urllib.urlencode([('-source', 'I/259/tyc2'),
+                                  ('-out', ','.join(VIZIER_COLUMNS)),
+                                  ('-out.max', 'unlimited'),
+                                  ('-c', pole), ('-c.rd', 90.0 - min_dec),
+                                  ('VTmag', '<%g' % max_mag)])
+        print 'Fetching', url + '?' + query
+        fle = urllib2.urlopen(url + '?' + query, timeout=300)
+        try:
+            stars.extend(select_stars(read_tsv(fle), min_dec, max_mag))
+        finally:
+            fle.close()
+    stars.sort(key=lambda star: star[6])
+    write_catalog(outfn, stars, 'Tycho-2 (VizieR I/259), |Dec| >= %g, '
+                  'mag <= %g' % (min_dec, max_mag))
+    return len(stars)
+
+
+def main(argv):
+    '''
+    build a catalog from the command line
+    '''
+    if len(argv) not in (3, 4, 5):
+        print >> sys.stderr, __doc__
+        return 2
+    args = [float(arg) for arg in argv[3:]]
+    if argv[1] == '--vizier':
+        num = fetch_catalog(argv[2], *args)
+    else:
+        num = build_catalog(argv[1], argv[2], *args)
+    print 'Wrote %d stars to %s' % (num, argv[2])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+The alignment engine of PhotoPolarAlign, without any GUI.
+
+Takes the plate solutions (.wcs) of the vertical, horizontal and,
+optionally, improved images and works out where the RA axis and the
+Celestial Pole are, the error and the moves needed to correct it.
+
+Usage: python ppa_engine.py vert.wcs horiz.wcs [improved.wcs]
+       python ppa_engine.py --frames first.wcs second.wcs ... last.wcs
+
+--frames fits the RA axis to several frames taken at different RA
+rotations, all pairs of them at once, and places it in the last one
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import sys
+from ppa_metrics import count, span
+
+# pairs of images turned less than this (degrees) about the RA axis
+# don't tell where it is
+MIN_ROTATION = 0.5
+# images further (degrees) than this from the Celestial Pole can't be used
+POLE_LIMIT = 25.0
+
+
+class AlignError(Exception):
+    '''
+    An exception that happens when the solutions can't be used to align
+    '''
+    pass
+
+
+def scale_frm_wcs(fn):
+    '''
+    the scale of the plate-solution file fn
+    '''
+    from ppa_wcs import read_record
+    return read_record(fn).scale
+
+
+def parity_frm_header(head):
+    '''
+    look in the plate-solution header for the parity information
+    '''
+    from ppa_wcs import as_record
+    return as_record(head).parity
+
+
+def scale_frm_header(head):
+    '''
+    look in the plate-solution header for the scale information
+    '''
+    from ppa_wcs import as_record
+    return as_record(head).scale
+
+
+def dec_frm_header(head):
+    '''
+    look in header for the Dec of the image
+    '''
+    from ppa_wcs import as_record
+    return as_record(head).dec
+
+
+def wid_hei_frm_header(head):
+    '''
+    look in header for width and height of image
+    '''
+    from ppa_wcs import as_record
+    return as_record(head).size()
+
+
+def decdeg2dms(dd):
+    mnt,sec = divmod(dd*3600,60)
+    deg,mnt = divmod(mnt,60)
+    return deg,mnt,sec
+
+
+def hemisphere(decv, dech):
+    '''
+    which Celestial Pole the two images are near, 'N' or 'S'
+    '''
+    near = 90.0 - POLE_LIMIT
+    if decv > near and dech > near:
+        return 'N'
+    elif decv < -near and dech < -near:
+        return 'S'
+    raise AlignError('Nowhere near (>%g deg) the Poles!' % POLE_LIMIT)
+
+
+# the precessed poles, by hemisphere: (minute, J2000 coordinates)
+_POLES = {}
+
+
+def celestial_pole(hemi, when=None):
+    '''
+    the Celestial Pole of now (or of unix time when), in J2000 sky
+    coordinates. The pole moves by ~20 mas per hour, so we only work it
+    out once a minute
+    '''
+    import time
+    if when is None:
+        when = time.time()
+    minute = int(when // 60)
+    cached = _POLES.get(hemi)
+    if cached is None or cached[0] != minute:
+        count('cache_misses', cache='pole')
+        cached = (minute, _precess_pole(hemi, minute*60.0))
+        _POLES[hemi] = cached
+    else:
+        count('cache_hits', cache='pole')
+    return cached[1].copy()
+
+
+def _precess_pole(hemi, when):
+    '''
+    the Celestial Pole of unix time when, in J2000 sky coordinates
+    '''
+    from astropy.time import Time
+    from astropy.coordinates import SkyCoord
+    from astropy.coordinates import FK5
+    import numpy
+    with span('precession'):
+        now = Time(when, format='unix')
+        if hemi == 'N':
+            cp = SkyCoord(ra=0, dec=90, frame='fk5', unit='deg', equinox=now)
+        else:
+            cp = SkyCoord(ra=0, dec=-90, frame='fk5', unit='deg',
+                          equinox=now)
+        # CP now, in J2000 coordinates, precess
+        cpj2000 = cp.transform_to(FK5(equinox='J2000'))
+    return numpy.array([[cpj2000.ra.deg, cpj2000.dec.deg]], numpy.float_)
+
+
+def rotation(amat):
+    '''
+    the angle (degrees) an affine mapping, of matrix amat, turns by
+    '''
+    import math
+    return math.degrees(math.atan2(amat[1][0] - amat[0][1],
+                                   amat[0][0] + amat[1][1]))
+
+
+def find_axis(wcsv, wcsh, width, height, steps=4):
+    '''
+    the pixel (in the horizontal image) that does not move between
+    the vertical and horizontal images, i.e. the RA axis, and how far
+    (pixels) it still moves
+    '''
+    import numpy
+
+    def mapping(pixcrd):
+        '''
+        where pixels of the vertical image land in the horizontal one
+        '''
+        skycrd = wcsv.wcs_pix2world(pixcrd, 1)
+        return wcsh.wcs_world2pix(skycrd, 1)
+    # the mapping is close to a rotation, fit an affine one on a grid
+    gxs, gys = numpy.meshgrid(numpy.linspace(1, width, 5),
+                              numpy.linspace(1, height, 5))
+    src = numpy.column_stack((gxs.ravel(), gys.ravel()))
+    dst = mapping(src)
+    design = numpy.column_stack((src, numpy.ones(len(src))))
+    coef = numpy.linalg.lstsq(design, dst, rcond=None)[0]
+    amat = coef[:2].T
+    tvec = coef[2]
+    if abs(rotation(amat)) < MIN_ROTATION:
+        raise AlignError('The images are not rotated - Check the images')
+    try:
+        # its fixed point, x = A x + t
+        axis = numpy.linalg.solve(numpy.eye(2) - amat, tvec)
+        # and a few Newton steps on the real mapping
+        offs = numpy.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+        for _ in range(steps):
+            pts = axis + offs
+            disp = mapping(pts) - pts
+            jac = numpy.column_stack((disp[1] - disp[0], disp[2] - disp[0]))
+            delta = numpy.linalg.solve(jac, -disp[0])
+            axis = axis + delta
+            if numpy.hypot(delta[0], delta[1]) < 1e-6:
+                break
+    except numpy.linalg.LinAlgError:
+        raise AlignError('The images are not rotated - Check the images')
+    pnt = numpy.array([axis])
+    resid = mapping(pnt) - pnt
+    return axis, float(numpy.hypot(resid[0][0], resid[0][1]))
+
+
+def find_axis_frames(wcss, width, height, nsigma=3.0, steps=4):
+    '''
+    the pixel that does not move between any of the frames wcss, i.e.
+    the RA axis, fitted to all pairs of frames at once. Pairs turned
+    less than MIN_ROTATION, and those that move it more than nsigma
+    (robust) sigmas above the median, are left out.
+    Returns the axis, its 1 sigma uncertainty (pixels, x and y; None
+    from a single pair) and the (i, j, residual, used) of each pair
+    '''
+    import numpy
+    nfr = len(wcss)
+    pairs = [(i, j) for i in range(nfr) for j in range(i + 1, nfr)]
+    if not pairs:
+        raise AlignError('Need at least two frames')
+
+    def displacements(pts):
+        '''
+        how far each pair of frames moves the pixels pts, a
+        (pairs, points, 2) array
+        '''
+        sky = [wcsx.wcs_pix2world(pts, 1) for wcsx in wcss]
+        return numpy.array([wcss[j].wcs_world2pix(sky[i], 1) - pts
+                            for i, j in pairs])
+
+    def jacobian(disp):
+        '''
+        the (pairs x 2, 2) Jacobian of the displacements, from those at
+        a point and one pixel to the right of and below it
+        '''
+        return numpy.concatenate(
+            (disp[:, 1] - disp[:, 0], disp[:, 2] - disp[:, 0]),
+            axis=1).reshape(-1, 2, 2).transpose(0, 2, 1).reshape(-1, 2)
+    # the mappings are close to rotations, fit affine ones on a grid; the
+    # grid is the same for all pairs, so one pseudo-inverse does them all
+    gxs, gys = numpy.meshgrid(numpy.linspace(1, width, 5),
+                              numpy.linspace(1, height, 5))
+    src = numpy.column_stack((gxs.ravel(), gys.ravel()))
+    design = numpy.column_stack((src, numpy.ones(len(src))))
+    dst = displacements(src) + src
+    coef = numpy.einsum('kn,pnc->pkc', numpy.linalg.pinv(design), dst)
+    amat = coef[:, :2, :].transpose(0, 2, 1)
+    tvec = coef[:, 2, :]
+    # (I - A_ij) x = t_ij, stacked for all the pairs
+    mat = (numpy.eye(2)[None] - amat).reshape(-1, 2)
+    vec = tvec.reshape(-1)
+    turned = numpy.array([abs(rotation(amt)) >= MIN_ROTATION
+                          for amt in amat])
+    if not turned.any():
+        raise AlignError('The images are not rotated - Check the images')
+    used = turned.copy()
+    offs = numpy.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    for _ in range(5):
+        rows = numpy.repeat(used, 2)
+        if numpy.linalg.matrix_rank(mat[rows]) < 2:
+            raise AlignError('The images are not rotated - Check the images')
+        axis = numpy.linalg.lstsq(mat[rows], vec[rows], rcond=None)[0]
+        # and a few Gauss-Newton steps on the real mappings
+        for _ in range(steps):
+            disp = displacements(axis + offs)[used]
+            delta = numpy.linalg.lstsq(jacobian(disp), -disp[:, 0].reshape(-1),
+                                       rcond=None)[0]
+            axis = axis + delta
+            if numpy.hypot(delta[0], delta[1]) < 1e-6:
+                break
+        disp = displacements(numpy.array([axis]))[:, 0]
+        resid = numpy.hypot(disp[:, 0], disp[:, 1])
+        if turned.sum() < 3:
+            break
+        # leave out the pairs that do not fit, robustly
+        med = numpy.median(resid[used])
+        mad = 1.4826*numpy.median(numpy.abs(resid[used] - med))
+        keep = turned & (resid <= med + nsigma*max(mad, 1e-3))
+        if keep.sum() < 2 or (keep == used).all():
+            break
+        used = keep
+    # the uncertainty, from the scatter of the pairs that were used
+    disp = displacements(axis + offs)[used]
+    jac = jacobian(disp)
+    res = disp[:, 0].reshape(-1)
+    dof = len(res) - 2
+    if dof > 0:
+        cov = numpy.linalg.inv(numpy.dot(jac.T, jac))*numpy.dot(res, res)/dof
+        sigma = numpy.sqrt(numpy.diag(cov))
+    else:
+        sigma = None
+    return axis, sigma, [(i, j, float(resid[k]), bool(used[k]))
+                         for k, (i, j) in enumerate(pairs)]
+
+
+def corrections(axis, cpcrd, the_scale):
+    '''
+    the error (arcmin) and the moves (degrees) that take the RA axis
+    onto the Celestial Pole
+    '''
+    import numpy
+    x1a = axis[0]
+    y1a = axis[1]
+    x2a = cpcrd[0][0]
+    y2a = cpcrd[0][1]
+    err = the_scale*numpy.sqrt((x1a-x2a)**2 + (y1a-y2a)**2)/60.0
+    if x2a > x1a:
+        horiz = 'Right'
+    else:
+        horiz = 'Left'
+    hdeg = abs(x2a - x1a)*the_scale/3600.0
+    if y2a > y1a:
+        vert = 'Down'
+    else:
+        vert = 'Up'
+    vdeg = abs(y2a - y1a)*the_scale/3600.0
+    return err, (horiz, hdeg), (vert, vdeg)
+
+
+class AlignResult(object):
+    '''
+    The outcome of an alignment: where the RA axis and the Celestial Pole
+    are (pixels), the error (arcmin) and the moves (degrees)
+    '''
+    def __init__(self, hemi, axis, pole, the_scale, width, height, stars,
+                 residual=None):
+        self.hemi = hemi
+        self.axis = axis
+        # how far (pixels) the axis moves between the images
+        self.residual = residual
+        self.pole = pole
+        self.scale = the_scale
+        self.width = width
+        self.height = height
+        # (label, colour, pixel coords) of the reference stars
+        self.stars = stars
+        err, horiz, vert = corrections(axis, pole, the_scale)
+        self.error = err
+        self.horizontal = horiz
+        self.vertical = vert
+        # from several frames: the uncertainty (pixels, x and y) of the
+        # axis and the (i, j, residual, used) of each pair of frames
+        self.uncertainty = None
+        self.pairs = None
+
+    def instructions(self):
+        '''
+        the moves, as displayed to the user
+        '''
+        inst = self.horizontal[0] + ' '
+        inst = inst + ('%02d:%02d:%02d' % decdeg2dms(self.horizontal[1]))
+        inst = inst + ' ' + self.vertical[0] + ' '
+        inst = inst + ('%02d:%02d:%02d' % decdeg2dms(self.vertical[1]))
+        return inst
+
+    def as_dict(self):
+        '''
+        the result as plain python types
+        '''
+        res = {'hemi': self.hemi,
+               'axis': [float(self.axis[0]), float(self.axis[1])],
+               'pole': [float(self.pole[0][0]), float(self.pole[0][1])],
+               'scale': float(self.scale),
+               'error': float(self.error),
+               'residual': self.residual,
+               self.horizontal[0].lower(): float(self.horizontal[1]),
+               self.vertical[0].lower(): float(self.vertical[1])}
+        if self.pairs is not None:
+            res['uncertainty'] = None
+            if self.uncertainty is not None:
+                res['uncertainty'] = [float(self.uncertainty[0]),
+                                      float(self.uncertainty[1])]
+            res['pairs'] = [{'frames': [i, j], 'residual': resid,
+                             'used': used}
+                            for i, j, resid, used in self.pairs]
+        return res
+
+
+def _result(hemi, wcsx, rec, axis, residual=None):
+    '''
+    the Celestial Pole and reference stars in an image, given the axis
+    '''
+    import numpy
+    from ppa_catalog import default_catalog
+    width, height = rec.size()
+    cat = default_catalog()
+    idx = cat.in_footprint(wcsx, width, height)
+    # the pole and all the stars, in one go
+    sky = numpy.concatenate((celestial_pole(hemi), cat.radec(idx)))
+    pix = wcsx.wcs_world2pix(sky, 1)
+    cpcrd = pix[0:1]
+    stars = []
+    for i, star in enumerate(idx):
+        spix = pix[i+1:i+2]
+        if (0.5 <= spix[0][0] <= width + 0.5 and
+                0.5 <= spix[0][1] <= height + 0.5):
+            stars.append((cat.labels[star], cat.colours[star], spix))
+    return AlignResult(hemi, axis, cpcrd, rec.scale, width, height, stars,
+                       residual)
+
+
+def solve_pair(headv, headh):
+    '''
+    Find RA axis from the pair of vertical/horizontal plate solutions
+    (headers or WcsRecords)
+    '''
+    from ppa_wcs import as_record
+    recv = as_record(headv)
+    rech = as_record(headh)
+    hemi = hemisphere(recv.dec, rech.dec)
+    if rech.size() != recv.size():
+        raise AlignError('Incompatible image dimensions...')
+    if rech.parity == 0 or recv.parity == 0:
+        raise AlignError('Wrong parity...')
+    with span('axis', method='pair'):
+        wcsh = rech.wcs()
+        axis, residual = find_axis(recv.wcs(), wcsh, rech.width,
+                                   rech.height)
+    return _result(hemi, wcsh, rech, axis, residual)
+
+
+def solve_improvement(headi, headh, axis, hemi):
+    '''
+    Where the Celestial Pole is in the improved image, for a known axis
+    '''
+    from ppa_wcs import as_record
+    if axis is None:
+        raise AlignError("don't know where Polar Axis is - Find Polar Axis")
+    reci = as_record(headi)
+    if reci.size() != as_record(headh).size():
+        raise AlignError('Incompatible image dimensions...')
+    if reci.parity == 0:
+        raise AlignError('Wrong parity...')
+    return _result(hemi, reci.wcs(), reci, axis)
+
+
+def solve_frames(heads, nsigma=3.0):
+    '''
+    Find RA axis from the plate solutions of several frames at different
+    RA rotations; the result is placed in the last frame
+    '''
+    from ppa_wcs import as_record
+    if len(heads) < 2:
+        raise AlignError('Need at least two frames')
+    recs = [as_record(head) for head in heads]
+    decs = [rec.dec for rec in recs]
+    # all near the same Pole
+    hemi = hemisphere(min(decs), max(decs))
+    size = recs[-1].size()
+    for rec in recs:
+        if rec.size() != size:
+            raise AlignError('Incompatible image dimensions...')
+        if rec.parity == 0:
+            raise AlignError('Wrong parity...')
+    with span('axis', method='frames'):
+        wcss = [rec.wcs() for rec in recs]
+        axis, sigma, pairs = find_axis_frames(wcss, size[0], size[1],
+                                              nsigma)
+    rms = [resid for i, j, resid, used in pairs if used]
+    result = _result(hemi, wcss[-1], recs[-1], axis,
+                     float(sum([r*r for r in rms])/len(rms))**0.5)
+    result.uncertainty = sigma
+    result.pairs = pairs
+    return result
+
+
+def align_frames(wcs_fns):
+    '''
+    Align from the .wcs files of several frames
+    '''
+    from ppa_wcs import read_records
+    return solve_frames(read_records(wcs_fns))
+
+
+def align(vwcs_fn, hwcs_fn, iwcs_fn=None):
+    '''
+    Align from the .wcs files, returns the AlignResult of the improved
+    image if given, otherwise of the horizontal image
+    '''
+    from ppa_wcs import read_records
+    recs = read_records([fn for fn in (vwcs_fn, hwcs_fn, iwcs_fn) if fn])
+    result = solve_pair(recs[0], recs[1])
+    if iwcs_fn:
+        result = solve_improvement(recs[2], recs[1], result.axis,
+                                   result.hemi)
+    return result
+
+
+def main(argv):
+    '''
+    align from the command line, print the result as JSON
+    '''
+    import json
+    frames = len(argv) > 1 and argv[1] == '--frames'
+    if (frames and len(argv) < 4) or (not frames and len(argv) not in (3, 4)):
+        print >> sys.stderr, __doc__
+        return 2
+    try:
+        if frames:
+            result = align_frames(argv[2:])
+        else:
+            result = align(*argv[1:])
+    except AlignError, err:
+        print >> sys.stderr, err
+        return 1
+    print json.dumps(result.as_dict())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
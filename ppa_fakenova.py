@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+A stand-in for nova.astrometry.net, for PhotoPolarAlign
+
+Serves the parts of the API NovaClient uses (login, upload,
+submissions/<id>, jobs/<id>, jobs_by_tag, myjobs/ and wcs_file/<id>)
+from memory, with plate solutions of the images in Testing/ (a .wcs
+next to an image, or the synthetic one of ppa_bench). How long
+requests, the queue and the solves take, and how often things go
+wrong, can be set.
+
+Usage: python ppa_fakenova.py serve [options]
+       python ppa_fakenova.py load [options]
+
+serve runs the server until interrupted; point PPA at it with
+
+    [nova]
+    server = http://127.0.0.1:8765/api/
+
+load runs many solves at once against it (started in this process,
+unless --url is given) and prints the client's throughput, the
+connections it opened and how much it polled, as JSON.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import sys
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+# where we listen by default
+PORT = 8765
+# the image the load driver uploads by default
+LOAD_IMAGE = 'Testing/N/20141206/vert.JPG'
+
+
+def canned_solutions():
+    '''
+    image file name -> the .wcs (bytes) of that image, for the images of
+    the benchmark sets
+    '''
+    import io
+    from os.path import basename, exists, join, splitext
+    from astropy.io import fits
+    from ppa_bench import SETS, TESTING, synthetic_header
+    sols = {}
+    for bset in SETS:
+        for hint, rot in (('v', 0.0), ('h', 90.0), ('i', 90.0)):
+            if not bset[hint]:
+                continue
+            img = join(TESTING, bset['dir'], bset[hint])
+            real = splitext(img)[0] + '.wcs'
+            if exists(real):
+                with open(real, 'rb') as fle:
+                    sols[basename(img)] = fle.read()
+                continue
+            if not exists(img):
+                continue
+            buf = io.BytesIO()
+            fits.PrimaryHDU(header=synthetic_header(
+                img, bset['scale'], rot, bset['hemi'])).writeto(buf)
+            sols[basename(img)] = buf.getvalue()
+    return sols
+
+
+class FakeNova(object):
+    '''
+    the submissions and jobs of the stand-in. An upload gets a job after
+    queue_delay seconds, which is solved (or, with probability fail_rate,
+    fails) solve_time seconds later. Every request takes latency seconds
+    more, and is answered with a 500 with probability error_rate, or not
+    at all (the connection is dropped) with probability drop_rate
+    '''
+    def __init__(self, solutions=None, latency=0.0, queue_delay=1.0,
+                 solve_time=2.0, fail_rate=0.0, error_rate=0.0,
+                 drop_rate=0.0, seed=None):
+        import random
+        if solutions is None:
+            solutions = canned_solutions()
+        self.solutions = solutions
+        self.latency = latency
+        self.queue_delay = queue_delay
+        self.solve_time = solve_time
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        # id -> (when uploaded, image name, job id or None)
+        self.subs = {}
+        # id -> (when started, image name, fails)
+        self.jobs = {}
+        self.stats = {'connections': 0, 'requests': 0, 'uploads': 0,
+                      'polls': 0, 'downloads': 0, 'errors': 0,
+                      'dropped': 0}
+
+    def count(self, name):
+        '''
+        one more of name
+        '''
+        with self.lock:
+            self.stats[name] = self.stats[name] + 1
+
+    def misbehave(self):
+        '''
+        None, 'error' or 'drop', as the failure rates say
+        '''
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.drop_rate:
+            return 'drop'
+        if draw < self.drop_rate + self.error_rate:
+            return 'error'
+        return None
+
+    def login(self, args):
+        '''
+        any API key will do
+        '''
+        import uuid
+        sess = uuid.uuid4().hex
+        with self.lock:
+            self.sessions.add(sess)
+        return {'status': 'success', 'message': 'authenticated user',
+                'session': sess}
+
+    def upload(self, args, fname):
+        '''
+        a new submission of the image fname
+        '''
+        with self.lock:
+            subid = len(self.subs) + 1
+            self.subs[subid] = (time.time(), fname, None)
+        self.count('uploads')
+        return {'status': 'success', 'subid': subid, 'hash': '%040x' % subid}
+
+    def submission(self, subid):
+        '''
+        the status of a submission, it gets its job after queue_delay
+        '''
+        self.count('polls')
+        now = time.time()
+        with self.lock:
+            if subid not in self.subs:
+                return {'status': 'error', 'errormessage': 'no submission'}
+            when, fname, jobid = self.subs[subid]
+            if jobid is None and now - when >= self.queue_delay:
+                jobid = len(self.jobs) + 1
+                self.jobs[jobid] = (now, fname,
+                                    self.random.random() < self.fail_rate)
+                self.subs[subid] = (when, fname, jobid)
+        jobs = [jobid] if jobid is not None else []
+        return {'processing_started': time.strftime('%Y-%m-%d %H:%M:%S',
+                                                    time.gmtime(when)),
+                'jobs': jobs, 'job_calibrations': [], 'user': 1,
+                'user_images': [subid]}
+
+    def job(self, jobid):
+        '''
+        the status of a job, solved (or failed) after solve_time
+        '''
+        self.count('polls')
+        with self.lock:
+            if jobid not in self.jobs:
+                return {'status': 'error', 'errormessage': 'no job'}
+            when, fname, fails = self.jobs[jobid]
+        if time.time() - when < self.solve_time:
+            return {'status': 'solving'}
+        return {'status': 'failure' if fails else 'success'}
+
+    def wcs_file(self, jobid):
+        '''
+        the plate solution of a solved job, None if there is none
+        '''
+        with self.lock:
+            job = self.jobs.get(jobid)
+        if (job is None or job[2] or
+                time.time() - job[0] < self.solve_time):
+            return None
+        self.count('downloads')
+        sol = self.solutions.get(job[1])
+        if sol is None and self.solutions:
+            # an image we have no solution of (a star list, a binned
+            # copy), any solution will do
+            sol = self.solutions[sorted(self.solutions)[0]]
+        return sol
+
+    def myjobs(self):
+        '''
+        all the jobs
+        '''
+        with self.lock:
+            return {'status': 'success', 'jobs': sorted(self.jobs)}
+
+
+class NovaHandler(BaseHTTPRequestHandler):
+    '''
+    the requests of one connection to the stand-in, kept alive
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.nova.count('connections')
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def do_GET(self):
+        '''
+        a GET, only wcs_file/<id>
+        '''
+        self.answer(self.path, '')
+
+    def do_POST(self):
+        '''
+        a POST, an API call
+        '''
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.answer(self.path, self.rfile.read(length))
+
+    def send(self, status, body, ctype='application/json'):
+        '''
+        answers with body
+        '''
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, path, body):
+        '''
+        answers a request to path with body
+        '''
+        import json
+        nova = self.server.nova
+        nova.count('requests')
+        if nova.latency > 0:
+            time.sleep(nova.latency)
+        trouble = nova.misbehave()
+        if trouble == 'drop':
+            nova.count('dropped')
+            self.close_connection = 1
+            return
+        if trouble == 'error':
+            nova.count('errors')
+            self.send(500, '<html>injected failure</html>', 'text/html')
+            return
+        path = path.split('?')[0]
+        if path.startswith('/wcs_file/'):
+            sol = nova.wcs_file(_number(path))
+            if sol is None:
+                self.send(404, 'no such file', 'text/plain')
+            else:
+                self.send(200, sol, 'application/fits')
+            return
+        args, fname = _request_json(self.headers.getheader('Content-Type')
+                                    or '', body)
+        if args is None:
+            self.send(400, 'no request-json', 'text/plain')
+            return
+        service = path[len('/api/'):] if path.startswith('/api/') else path
+        if service == 'login':
+            res = nova.login(args)
+        elif args.get('session') not in nova.sessions:
+            res = {'status': 'error', 'errormessage': 'no session'}
+        elif service == 'upload':
+            res = nova.upload(args, fname)
+        elif service.startswith('submissions/'):
+            res = nova.submission(_number(service))
+        elif service.startswith('jobs/'):
+            res = nova.job(_number(service))
+        elif service.startswith('jobs_by_tag'):
+            res = {'status': 'success', 'jobs': []}
+        elif service.startswith('myjobs'):
+            res = nova.myjobs()
+        else:
+            self.send(404, 'no such service', 'text/plain')
+            return
+        self.send(200, json.dumps(res))
+
+
+def _number(path):
+    '''
+    the number at the end of a path, 0 if there is none
+    '''
+    try:
+        return int(path.rstrip('/').split('/')[-1])
+    except ValueError:
+        return 0
+
+
+def _request_json(ctype, body):
+    '''
+    the request JSON (as python) of a form or multipart body, and the
+    name of the file sent with it, if any
+    '''
+    import json
+    import re
+    from urlparse import parse_qs
+    fname = None
+    if ctype.startswith('multipart/form-data'):
+        text = None
+        for part in body.split('\r\n--'):
+            head, sep, data = part.partition('\r\n\r\n')
+            if 'name="request-json"' in head:
+                text = data.rstrip('\r\n')
+            found = re.search(r'filename="([^"]*)"', head)
+            if found:
+                fname = found.group(1)
+    else:
+        text = parse_qs(body).get('request-json', [None])[0]
+    try:
+        return json.loads(text), fname
+    except (TypeError, ValueError):
+        return None, fname
+
+
+class FakeNovaServer(ThreadingMixIn, HTTPServer):
+    '''
+    the stand-in's HTTP server, a thread per connection
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, nova, port=PORT, host='127.0.0.1', verbose=False):
+        HTTPServer.__init__(self, (host, port), NovaHandler)
+        self.nova = nova
+        self.verbose = verbose
+
+    def api_url(self):
+        '''
+        the URL a NovaClient talks to
+        '''
+        return 'http://%s:%d/api/' % self.server_address
+
+    def start(self):
+        '''
+        serve in a thread of our own
+        '''
+        thr = threading.Thread(target=self.serve_forever)
+        thr.daemon = True
+        thr.start()
+        return thr
+
+
+def load_test(url, image=LOAD_IMAGE, submissions=20, concurrency=8,
+              first=0.1, longest=1.0, deadline=120.0):
+    '''
+    solves image submissions times, concurrency at a time, with one
+    NovaClient (as PPA does); the client's throughput, connections and
+    polling, as a dict
+    '''
+    import shutil
+    import tempfile
+    from os.path import join
+    import ppa_metrics
+    from ppa_nova import NovaClient
+    from ppa_pool import run_parallel
+    clnt = NovaClient(url)
+    ppa_metrics.reset()
+    scratch = tempfile.mkdtemp(prefix='ppa_load_')
+    start = time.time()
+    try:
+        clnt.login('fake')
+
+        def one(num):
+            '''
+            solve the image once, how long it took
+            '''
+            began = time.time()
+            clnt.solve(image, join(scratch, '%d.wcs' % num), first=first,
+                       longest=longest, deadline=deadline)
+            return time.time() - began
+        results = run_parallel(one, range(submissions), concurrency)
+    finally:
+        wall = time.time() - start
+        clnt.transport.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+    took = sorted([res for res, err in results if err is None])
+    failed = {}
+    for res, err in results:
+        if err is not None:
+            name = err.__class__.__name__
+            failed[name] = failed.get(name, 0) + 1
+    counters = {}
+    for ctr in ppa_metrics.snapshot()['counters']:
+        counters[ctr['name']] = counters.get(ctr['name'], 0) + ctr['count']
+    out = {'submissions': submissions, 'concurrency': concurrency,
+           'solved': len(took), 'failed': failed, 'wall_s': wall,
+           'solves_per_s': len(took)/wall if wall > 0 else None,
+           'connections_opened': clnt.transport.opened,
+           'http_requests': counters.get('http_requests', 0),
+           'poll_iterations': counters.get('poll_iterations', 0)}
+    if took:
+        out['solve_s'] = {'min': took[0], 'median': took[len(took)//2],
+                          'max': took[-1]}
+        out['polls_per_solve'] = out['poll_iterations']/float(submissions)
+    return out
+
+
+def main(argv):
+    '''
+    serve, or load test, from the command line
+    '''
+    import json
+    import optparse
+    from os.path import abspath, dirname, join
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--port', type='int', default=PORT,
+                      help='port to listen on (default %default)')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds added to every request')
+    parser.add_option('--queue-delay', type='float', default=1.0,
+                      help='seconds before a submission gets its job')
+    parser.add_option('--solve-time', type='float', default=2.0,
+                      help='seconds a job takes to solve')
+    parser.add_option('--fail-rate', type='float', default=0.0,
+                      help='fraction of jobs that fail')
+    parser.add_option('--error-rate', type='float', default=0.0,
+                      help='fraction of requests answered with a 500')
+    parser.add_option('--drop-rate', type='float', default=0.0,
+                      help='fraction of requests left unanswered')
+    parser.add_option('--seed', type='int', help='for the failures')
+    parser.add_option('-v', dest='verbose', action='store_true',
+                      help='log every request')
+    parser.add_option('--url', help='load test this server instead')
+    parser.add_option('-n', dest='submissions', type='int', default=20,
+                      help='solves of the load test (default %default)')
+    parser.add_option('-c', dest='concurrency', type='int', default=8,
+                      help='solves at once (default %default)')
+    parser.add_option('--image', help='image the load test uploads')
+    opts, args = parser.parse_args(argv[1:])
+    if opts.image is None:
+        opts.image = join(dirname(abspath(__file__)), LOAD_IMAGE)
+    if args not in (['serve'], ['load']):
+        parser.print_usage(sys.stderr)
+        return 2
+    server = None
+    url = opts.url
+    if args[0] == 'serve' or url is None:
+        nova = FakeNova(latency=opts.latency, queue_delay=opts.queue_delay,
+                        solve_time=opts.solve_time, fail_rate=opts.fail_rate,
+                        error_rate=opts.error_rate,
+                        drop_rate=opts.drop_rate, seed=opts.seed)
+        server = FakeNovaServer(nova, opts.port, verbose=opts.verbose)
+        url = server.api_url()
+    if args[0] == 'serve':
+        print 'Serving on', url
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if server is not None:
+        server.start()
+    # the client's chatter goes to stderr, the results to stdout
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        res = load_test(url, opts.image, opts.submissions, opts.concurrency)
+    finally:
+        sys.stdout = out
+    if server is not None:
+        server.shutdown()
+        res['server'] = server.nova.stats
+    print json.dumps(res, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Pole index sets of PhotoPolarAlign
+
+solve-field loads every index file its configuration names, for every
+solve, though PPA only ever images the Celestial Pole region with one
+camera. This writes a trimmed astrometry.net configuration naming only
+the index files that can solve such images: the scales whose quads are
+10% to 100% of the field of view, and of the index files split in
+healpix tiles, only the tiles that reach within 25 degrees of a Pole
+(the limit the alignment itself enforces).
+
+Usage: python ppa_index.py source out.cfg scale width height [min |Dec|]
+
+source is the astrometry.net configuration (or a directory of index
+files), scale is in arcsec/pixel, width and height in pixels
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import re
+import sys
+
+# the index files, index-4208.fits or index-4203-17.fits
+INDEX_RE = re.compile(r'^index-(\d+)(?:-(\d+))?\.fits?$')
+# the tiles we keep reach this |Dec| (degrees)
+MIN_DEC = 65.0
+# the first line of the configurations we write, naming their source
+SOURCE_TAG = '# ppa_index source: '
+# the settings of the source configuration we keep
+KEEP = ('cpulimit', 'inparallel', 'minwidth', 'maxwidth', 'depths')
+# the base healpix rings, north polar, equatorial, south polar
+JRLL = [2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4]
+
+
+def quad_range(num):
+    '''
+    the smallest and largest quads (arcmin) of index scale num, e.g. 8
+    for index-4208
+    '''
+    return 2.0*2**(num/2.0), 2.0*2**((num + 1)/2.0)
+
+
+def wanted_scales(scale, width, height):
+    '''
+    the index scales for images of width x height pixels of scale
+    arcsec/pixel: quads from 10% of the short side to the long side
+    '''
+    short = scale*min(width, height)/60.0
+    longest = scale*max(width, height)/60.0
+    return [num for num in range(20)
+            if quad_range(num)[1] >= 0.1*short and
+            quad_range(num)[0] <= longest]
+
+
+def ring_z(ring, nside):
+    '''
+    z (sin Dec) of healpix ring ring (0 the North Pole, 4 nside the
+    South Pole)
+    '''
+    if ring < nside:
+        return 1.0 - ring*ring/(3.0*nside*nside)
+    if ring > 3*nside:
+        return -1.0 + (4*nside - ring)**2/(3.0*nside*nside)
+    return (2*nside - ring)*2.0/(3*nside)
+
+
+def reaches_pole(hpx, nside, min_dec=MIN_DEC):
+    '''
+    does the healpix tile hpx (astrometry.net's numbering, base tile,
+    then x, then y) of nside reach |Dec| >= min_dec?
+    '''
+    import math
+    base, rest = divmod(hpx, nside*nside)
+    xxx, yyy = divmod(rest, nside)
+    ring = JRLL[base]*nside - xxx - yyy - 1
+    limit = math.sin(math.radians(min_dec))
+    if base < 4:
+        # its northern corner
+        return ring_z(ring - 1, nside) >= limit
+    if base >= 8:
+        # its southern corner
+        return ring_z(ring + 1, nside) <= -limit
+    return False
+
+
+def index_info(fn):
+    '''
+    the index id, healpix tile and nside of an index file, from its
+    header or else its name; tile and nside are None for all-sky ones.
+    None if it isn't an index file
+    '''
+    from os.path import basename
+    mtc = INDEX_RE.match(basename(fn))
+    if mtc is None:
+        return None
+    indexid = int(mtc.group(1))
+    hpx = int(mtc.group(2)) if mtc.group(2) is not None else None
+    nside = None
+    try:
+        from astropy.io import fits
+        head = fits.getheader(fn)
+        indexid = int(head.get('INDEXID', indexid))
+        if head.get('ALLSKY', False):
+            hpx = None
+        elif 'HEALPIX' in head:
+            hpx = int(head['HEALPIX'])
+            nside = int(head.get('HPNSIDE', 1))
+    except (IOError, OSError, ValueError, TypeError):
+        pass
+    if hpx is not None and hpx < 0:
+        hpx = None
+    return indexid, hpx, nside
+
+
+def read_config(cfgfn):
+    '''
+    the index directories, index files and settings we keep of an
+    astrometry.net configuration; one we wrote is read through to its
+    source
+    '''
+    from os.path import dirname, isabs, join
+    with open(cfgfn) as fle:
+        lines = fle.readlines()
+    if lines and lines[0].startswith(SOURCE_TAG):
+        return read_config(lines[0][len(SOURCE_TAG):].strip())
+    dirs = []
+    names = []
+    keep = []
+    for line in lines:
+        tkns = line.split('#')[0].split()
+        if not tkns:
+            continue
+        if tkns[0] == 'add_path' and len(tkns) > 1:
+            path = ' '.join(tkns[1:])
+            dirs.append(path if isabs(path) else join(dirname(cfgfn), path))
+        elif tkns[0] == 'index' and len(tkns) > 1:
+            names.append(' '.join(tkns[1:]))
+        elif tkns[0] in KEEP:
+            keep.append(line.strip())
+    return dirs, names, keep
+
+
+def find_indexes(dirs, names=()):
+    '''
+    the index files in dirs, and those named (alone, or in dirs)
+    '''
+    import glob
+    from os.path import exists, isabs, join
+    fns = []
+    for dirn in dirs:
+        fns.extend(sorted(glob.glob(join(dirn, 'index-*.fits'))))
+    for name in names:
+        if isabs(name):
+            cands = [name, name + '.fits']
+        else:
+            cands = [join(dirn, name + ext) for dirn in dirs
+                     for ext in ('', '.fits')]
+        found = [fn for fn in cands if exists(fn)]
+        if found and found[0] not in fns:
+            fns.append(found[0])
+    return fns
+
+
+def select(fns, scale, width, height, min_dec=MIN_DEC):
+    '''
+    the index files, of fns, that can solve a Pole image of width x
+    height pixels of scale arcsec/pixel
+    '''
+    scales = wanted_scales(scale, width, height)
+    infos = [(fn, index_info(fn)) for fn in fns]
+    # the nside of tiles named only by their file names
+    tiles = {}
+    for fn, info in infos:
+        if info is not None and info[1] is not None:
+            tiles[info[0]] = max(tiles.get(info[0], 0), info[1])
+    kept = []
+    for fn, info in infos:
+        if info is None or info[0] % 100 not in scales:
+            continue
+        indexid, hpx, nside = info
+        if hpx is not None:
+            if nside is None:
+                nside = 1
+                while 12*nside*nside <= tiles[indexid]:
+                    nside = nside*2
+            if not reaches_pole(hpx, nside, min_dec):
+                continue
+        kept.append(fn)
+    return kept
+
+
+def write_config(outfn, fns, keep=(), source=''):
+    '''
+    writes an astrometry.net configuration naming the index files fns
+    '''
+    from os.path import abspath
+    with open(outfn, 'w') as fle:
+        fle.write(SOURCE_TAG + source + '\n')
+        fle.write('# the Pole region index files, written by ppa_index.py\n')
+        for line in keep:
+            fle.write(line + '\n')
+        for fn in fns:
+            fle.write('index %s\n' % abspath(fn))
+
+
+def build(source, outfn, scale, width, height, min_dec=MIN_DEC):
+    '''
+    writes the Pole configuration outfn for images of width x height
+    pixels of scale arcsec/pixel, from the configuration (or directory
+    of index files) source. Returns the index files kept, and the sizes
+    (bytes) of those kept and of all of them
+    '''
+    import os
+    from os.path import abspath, isdir
+    if isdir(source):
+        dirs, names, keep = [source], [], []
+    else:
+        dirs, names, keep = read_config(source)
+    fns = find_indexes(dirs, names)
+    if not fns:
+        raise IOError('no index files in %s' % source)
+    kept = select(fns, scale, width, height, min_dec)
+    if not kept:
+        raise IOError('none of the index files of %s fit images of '
+                      '%.2f"/pixel' % (source, scale))
+    write_config(outfn, kept, keep, abspath(source))
+    return (kept, sum([os.path.getsize(fn) for fn in kept]),
+            sum([os.path.getsize(fn) for fn in fns]))
+
+
+def main(argv):
+    '''
+    build a Pole configuration from the command line
+    '''
+    if len(argv) not in (6, 7):
+        print >> sys.stderr, __doc__
+        return 2
+    nums = [float(arg) for arg in argv[3:]]
+    kept, size, total = build(argv[1], argv[2], nums[0], int(nums[1]),
+                              int(nums[2]), *nums[3:])
+    print 'Wrote %s: %d index files, %.0f of %.0f MB' % (
+        argv[2], len(kept), size/1048576.0, total/1048576.0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Job journal of PhotoPolarAlign
+
+The nova submissions in flight (their sub id, job id and state) are
+kept in a small journal file, by the content of the image and how it was
+sent, so a solve that was cancelled, timed out or cut short by closing
+PPA picks up polling the same job next time instead of uploading the
+image again and going to the back of the queue.
+
+The file has one JSON object per line, each change to an entry being
+appended as a line, so a write cut short by a crash loses that change
+only; the journal is written afresh at its first change after it is
+read.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import threading
+
+# entries older than this (seconds) are forgotten
+MAX_AGE = 2*24*60*60.0
+
+
+class JobJournal(object):
+    '''
+    key -> {'subid', 'jobid', 'state', 'when'} of the submissions in
+    flight, in the journal file fn; state is 'submitted' until the
+    submission has a job, then 'solving'
+    '''
+    def __init__(self, fn, max_age=MAX_AGE):
+        import time
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.entries = {}
+        # the file needs writing afresh before we append to it
+        self.stale = True
+        try:
+            with open(fn) as fle:
+                for line in fle:
+                    self.replay(line)
+        except IOError:
+            pass
+        now = time.time()
+        self.entries = dict([(key, ent) for key, ent in self.entries.items()
+                             if now - ent.get('when', 0) < max_age])
+
+    def replay(self, line):
+        '''
+        applies a line of the file to the entries; a line cut short, or
+        otherwise damaged, is left out
+        '''
+        import json
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(rec, dict):
+            return
+        if 'key' not in rec:
+            # a journal written in one go, as PPA once did
+            for key, ent in rec.items():
+                if isinstance(ent, dict):
+                    self.entries[key] = ent
+            return
+        key = rec.pop('key')
+        if rec.get('dropped'):
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = rec
+
+    def key(self, fne, server, upload_args=None, xylist=False, binning=1):
+        '''
+        the journal key of an image sent to server this way
+        '''
+        import hashlib
+        from ppa_cache import hash_of
+        sha = hashlib.sha1(hash_of(fne))
+        params = dict(upload_args or {})
+        # a job found with one position hint will do for another
+        for name in ('center_ra', 'center_dec', 'radius'):
+            params.pop(name, None)
+        params.update(server=server, xylist=bool(xylist), binning=binning)
+        for name in sorted(params):
+            sha.update('\0%s=%r' % (name, params[name]))
+        return sha.hexdigest()
+
+    def get(self, key):
+        '''
+        the entry of key, None if there is none
+        '''
+        with self.lock:
+            ent = self.entries.get(key)
+            return dict(ent) if ent is not None else None
+
+    def put(self, key, **fields):
+        '''
+        sets fields of the entry of key and writes the journal
+        '''
+        import time
+        with self.lock:
+            ent = self.entries.setdefault(key, {'subid': None,
+                                                'jobid': None,
+                                                'state': 'submitted'})
+            ent.update(fields)
+            ent['when'] = time.time()
+            self.append(dict(ent, key=key))
+
+    def drop(self, key):
+        '''
+        forget key, its job is done (or will never be)
+        '''
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.append({'key': key, 'dropped': True})
+
+    def append(self, rec):
+        '''
+        adds a line to the journal; with the lock held
+        '''
+        import json
+        if self.stale:
+            self.save()
+            return
+        try:
+            with open(self.fn, 'a') as fle:
+                fle.write(json.dumps(rec) + '\n')
+        except (IOError, OSError):
+            # we may have left half a line
+            self.stale = True
+
+    def save(self):
+        '''
+        write the journal afresh, in one go; with the lock held. One we
+        can't write just goes without
+        '''
+        import json
+        import os
+        from os.path import dirname
+        tmp = self.fn + '.tmp'
+        try:
+            if dirname(self.fn) and not os.path.isdir(dirname(self.fn)):
+                os.makedirs(dirname(self.fn))
+            with open(tmp, 'w') as fle:
+                for key in sorted(self.entries):
+                    fle.write(json.dumps(dict(self.entries[key], key=key)) +
+                              '\n')
+            if os.path.exists(self.fn):
+                # Windows won't rename over an existing file
+                os.remove(self.fn)
+            os.rename(tmp, self.fn)
+            self.stale = False
+        except (IOError, OSError):
+            pass
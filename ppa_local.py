@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Local astrometry.net (solve-field) solver of PhotoPolarAlign
+
+Each solve runs as its own process, without going through a shell
+command line, in its own scratch directory. Several solves can run
+side by side, one per core.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+from ppa_metrics import span
+
+
+class LocalSolveError(Exception):
+    '''
+    An exception that happens when solve-field can't solve an image
+    '''
+    pass
+
+
+def solve_field_args(filename, configfile='', units=None, low=None,
+                     high=None, downscale=1, xtra='', size=None, ra=None,
+                     dec=None, radius=None):
+    '''
+    the solve-field command line, as a list of arguments; size is the
+    (width, height) of the image when filename is an x,y list; ra, dec
+    and radius (degrees) limit where on the sky it looks
+    '''
+    import shlex
+    args = ['solve-field']
+    if configfile:
+        args = args + ['-b', configfile]
+    if units is not None:
+        args = args + ['-u', units, '-L', '%.2f' % low, '-H', '%.2f' % high]
+    if radius is not None:
+        args = args + ['--ra', '%.4f' % ra, '--dec', '%.4f' % dec,
+                       '--radius', '%.2f' % radius]
+    if size is not None:
+        args = args + ['--width', '%d' % size[0], '--height', '%d' % size[1],
+                       '--x-column', 'X', '--y-column', 'Y',
+                       '--sort-column', 'FLUX']
+    elif downscale != 1:
+        args = args + ['-z', '%d' % downscale]
+    args = args + shlex.split(xtra)
+    args = args + ['--no-plots', '-O', filename]
+    return args
+
+
+def wrap_shell(shell, args):
+    '''
+    wrap the arguments in the user's shell template (e.g. the Cygwin
+    'bash --login -c "%s"'), if there is one
+    '''
+    import pipes
+    import shlex
+    if shell.strip() in ('', '%s'):
+        return args
+    cmd = ' '.join([pipes.quote(arg) for arg in args])
+    wrapped = []
+    # not posix, so that Windows paths keep their backslashes
+    for tkn in shlex.split(shell, posix=False):
+        if '%s' in tkn:
+            if len(tkn) > 1 and tkn[0] == tkn[-1] and tkn[0] in '"\'':
+                tkn = tkn[1:-1]
+            tkn = tkn.replace('%s', cmd)
+        wrapped.append(tkn)
+    return wrapped
+
+
+def run(args, logfn, cwd=None):
+    '''
+    runs a command, its output going to logfn, returns the exit status
+    '''
+    import subprocess
+    log = open(logfn, 'wb')
+    try:
+        proc = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT,
+                                cwd=cwd)
+        return proc.wait()
+    finally:
+        log.close()
+
+
+def probe(shell=''):
+    '''
+    whether solve-field can be run (through the user's shell template)
+    '''
+    import os
+    import subprocess
+    devnull = open(os.devnull, 'wb')
+    try:
+        return subprocess.call(wrap_shell(shell, ['solve-field']),
+                               stdout=devnull, stderr=subprocess.STDOUT) == 0
+    except OSError:
+        return False
+    finally:
+        devnull.close()
+
+
+def log_tail(logfn, lines=10):
+    '''
+    the last lines of a log
+    '''
+    try:
+        with open(logfn) as log:
+            return ''.join(log.readlines()[-lines:])
+    except IOError:
+        return ''
+
+
+def solve_local(filename, wcsfn, shell='', xylist=False, binning=1,
+                **kwargs):
+    '''
+    plate solves an image with solve-field and puts the plate solution
+    in wcsfn; with xylist, we find the stars and solve-field only gets
+    their list; with binning > 1, solve-field gets a grey copy binned by
+    that much. kwargs go to solve_field_args()
+    '''
+    if binning > 1:
+        from ppa_prep import with_binning
+        return with_binning(
+            lambda img, wcs: solve_local(img, wcs, shell, xylist, **kwargs),
+            filename, wcsfn, binning)
+    import os
+    import shutil
+    import tempfile
+    from os.path import abspath, basename, exists, join, splitext
+    scratch = tempfile.mkdtemp(prefix='ppa_')
+    try:
+        if xylist:
+            from ppa_stars import make_xylist
+            image = join(scratch, splitext(basename(filename))[0] + '.xyls')
+            kwargs['size'] = make_xylist(filename, image)
+        else:
+            # solve a link (or copy), so all the output lands in scratch
+            image = join(scratch, basename(filename))
+            try:
+                os.symlink(abspath(filename), image)
+            except (AttributeError, OSError):
+                shutil.copyfile(filename, image)
+        args = wrap_shell(shell, solve_field_args(image, **kwargs))
+        logfn = join(scratch, 'solve-field.log')
+        print ' '.join(args)
+        try:
+            with span('solve', solver='local'):
+                status = run(args, logfn, scratch)
+        except OSError, err:
+            raise LocalSolveError("couldn't run solve-field: %s" % err)
+        if status != 0:
+            print log_tail(logfn)
+            raise LocalSolveError('solve-field exited with status %d'
+                                  % status)
+        solution = splitext(image)[0] + '.wcs'
+        if not exists(solution):
+            print log_tail(logfn)
+            raise LocalSolveError('solve-field found no solution')
+        shutil.copyfile(solution, wcsfn)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def solve_local_many(todo, workers=None, **kwargs):
+    '''
+    solves several images at once, one per core; todo is a list of
+    (image, wcs) file names. Returns the exceptions (None when solved)
+    in the order of todo
+    '''
+    import multiprocessing
+    from ppa_pool import run_parallel
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    def one(item):
+        '''
+        solve one image
+        '''
+        return solve_local(item[0], item[1], **kwargs)
+    return [err for res, err in run_parallel(one, todo, workers)]
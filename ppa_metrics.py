@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Timings and counters of PhotoPolarAlign
+
+The stages of an alignment (upload, queue wait, solve, WCS download,
+header parse, axis, precession, drawing, crop, display) are timed as
+spans, and the HTTP requests, poll iterations and cache hits counted:
+
+    with span('upload', solver='nova'):
+        ...
+    count('http_requests')
+
+Each span can be appended to a JSON-lines file as it ends, and the
+totals written to a Prometheus text file (for node_exporter's textfile
+collector); see configure(). Without either, they are only kept in
+memory, for snapshot().
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# what we prefix the Prometheus metrics with
+PREFIX = 'ppa'
+
+_LOCK = threading.Lock()
+# (stage, labels) -> [count, total seconds, longest seconds]
+_SPANS = {}
+# (name, labels) -> count
+_COUNTERS = {}
+# where to write them, see configure()
+_SINKS = {'jsonl': None, 'prom': None}
+
+
+def configure(jsonl=None, prom=None):
+    '''
+    append each span to the JSON-lines file jsonl, and write the totals
+    to the Prometheus text file prom on flush(); None for neither
+    '''
+    with _LOCK:
+        _SINKS['jsonl'] = jsonl or None
+        _SINKS['prom'] = prom or None
+
+
+def _key(name, labels):
+    '''
+    the dict key of a metric with labels
+    '''
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, inc=1, **labels):
+    '''
+    adds inc to the counter name
+    '''
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + inc
+
+
+def record(stage, secs, **labels):
+    '''
+    a span of stage that took secs seconds
+    '''
+    key = _key(stage, labels)
+    with _LOCK:
+        tot = _SPANS.get(key)
+        if tot is None:
+            tot = _SPANS[key] = [0, 0.0, 0.0]
+        tot[0] = tot[0] + 1
+        tot[1] = tot[1] + secs
+        tot[2] = max(tot[2], secs)
+        jsonl = _SINKS['jsonl']
+    if jsonl is not None:
+        _append(jsonl, stage, secs, labels)
+
+
+@contextmanager
+def span(stage, **labels):
+    '''
+    times the with block as a span of stage; one that raises is recorded
+    with error=<the exception's class>
+    '''
+    start = time.time()
+    try:
+        yield
+    except Exception, err:
+        labels['error'] = err.__class__.__name__
+        raise
+    finally:
+        record(stage, time.time() - start, **labels)
+
+
+def _append(jsonl, stage, secs, labels):
+    '''
+    appends a span to the JSON-lines file; one we can't write to just
+    goes without
+    '''
+    import json
+    import os
+    import socket
+    line = {'ts': round(time.time(), 3), 'host': socket.gethostname(),
+            'pid': os.getpid(), 'stage': stage, 'seconds': round(secs, 6)}
+    line.update(labels)
+    try:
+        with open(jsonl, 'a') as fle:
+            fle.write(json.dumps(line, sort_keys=True) + '\n')
+    except (IOError, OSError):
+        pass
+
+
+def snapshot():
+    '''
+    the spans and counters so far, as plain python types
+    '''
+    with _LOCK:
+        spans = [dict(labels, stage=stage, count=tot[0], seconds=tot[1],
+                      longest=tot[2])
+                 for (stage, labels), tot in sorted(_SPANS.items())]
+        counters = [dict(labels, name=name, count=num)
+                    for (name, labels), num in sorted(_COUNTERS.items())]
+    return {'spans': spans, 'counters': counters}
+
+
+def _labels(labels, **more):
+    '''
+    Prometheus labels, {a="b",...}
+    '''
+    items = sorted(list(labels) + more.items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (key, str(val).replace(
+        '\\', '\\\\').replace('"', '\\"')) for key, val in items])
+
+
+def prometheus_text():
+    '''
+    the spans and counters in the Prometheus text format
+    '''
+    with _LOCK:
+        spans = sorted(_SPANS.items())
+        counters = sorted(_COUNTERS.items())
+    lines = []
+    for suffix, col, typ, hlp in (
+            ('stage_seconds_total', 1, 'counter', 'time spent in a stage'),
+            ('stage_runs_total', 0, 'counter', 'times a stage ran'),
+            ('stage_seconds_max', 2, 'gauge', 'longest run of a stage')):
+        lines.append('# HELP %s_%s %s' % (PREFIX, suffix, hlp))
+        lines.append('# TYPE %s_%s %s' % (PREFIX, suffix, typ))
+        for (stage, labels), tot in spans:
+            lines.append('%s_%s%s %r' % (PREFIX, suffix,
+                                         _labels(labels, stage=stage),
+                                         tot[col]))
+    names = []
+    for (name, labels), num in counters:
+        if name not in names:
+            names.append(name)
+            lines.append('# TYPE %s_%s_total counter' % (PREFIX, name))
+        lines.append('%s_%s_total%s %d' % (PREFIX, name, _labels(labels),
+                                           num))
+    return '\n'.join(lines) + '\n'
+
+
+def flush():
+    '''
+    writes the Prometheus text file, if there is one; in one go, so the
+    collector never reads half of it
+    '''
+    import os
+    prom = _SINKS['prom']
+    if prom is None:
+        return
+    tmp = prom + '.tmp'
+    try:
+        with open(tmp, 'w') as fle:
+            fle.write(prometheus_text())
+        if os.path.exists(prom):
+            # Windows won't rename over an existing file
+            os.remove(prom)
+        os.rename(tmp, prom)
+    except (IOError, OSError):
+        pass
+
+
+def reset():
+    '''
+    forget the spans and counters so far
+    '''
+    with _LOCK:
+        _SPANS.clear()
+        _COUNTERS.clear()
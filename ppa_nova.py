@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""
+nova.astrometry.net client of PhotoPolarAlign
+
+Connections to the server are kept alive and pooled, and a logged-in
+client is shared by all the solves of a process (see get_client).
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import threading
+from ppa_metrics import count, span
+
+
+class RequestError(Exception):
+    '''
+    An exception that happens when talking to the plate solver
+    '''
+    pass
+
+
+class TransportError(RequestError):
+    '''
+    The connection to the plate solver broke (dropped, reset, or an answer
+    that is not HTTP)
+    '''
+    pass
+
+
+class SolveFailed(RequestError):
+    '''
+    The plate solver gave up on our image
+    '''
+    pass
+
+
+class PollTimeout(RequestError):
+    '''
+    The plate solver took longer than we were prepared to wait
+    '''
+    pass
+
+
+class Cancelled(RequestError):
+    '''
+    The user stopped waiting for the plate solver
+    '''
+    pass
+
+
+def poll(check, first=1.0, factor=1.6, longest=15.0, jitter=0.2,
+         deadline=900.0, cancel=None, sleep=None, clock=None):
+    '''
+    calls check() until it returns something other than None and returns
+    that. The waits start short and grow by factor (with some jitter) up
+    to longest seconds. Gives up after deadline seconds, or as soon as
+    cancel() returns True. check() may raise to stop early. sleep(secs)
+    and clock() (time.sleep and time.time by default) are how we wait
+    and tell the time
+    '''
+    import random
+    import time
+    if sleep is None:
+        sleep = time.sleep
+    if clock is None:
+        clock = time.time
+    t_end = clock() + deadline
+    interval = first
+    while True:
+        if cancel is not None and cancel():
+            raise Cancelled('cancelled')
+        count('poll_iterations')
+        res = check()
+        if res is not None:
+            return res
+        left = t_end - clock()
+        if left <= 0:
+            raise PollTimeout('no answer after %d seconds' % deadline)
+        wait = interval*random.uniform(1.0 - jitter, 1.0 + jitter)
+        sleep(min(wait, left))
+        interval = min(interval*factor, longest)
+
+
+def json2python(json):
+    '''
+    translates JSON to python
+    '''
+    import ujson
+    try:
+        return ujson.loads(json)
+    except:
+        pass
+    return None
+
+
+def python2json(pyd):
+    '''
+    translates python  to JSON
+    '''
+    import ujson
+    return ujson.dumps(pyd)
+
+
+class Transport(object):
+    '''
+    a pool of keep-alive HTTP connections to one server
+    '''
+    def __init__(self, url, maxsize=4):
+        from urlparse import urlsplit
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.maxsize = maxsize
+        self.idle = []
+        self.lock = threading.Lock()
+        # how many connections were opened, for the curious
+        self.opened = 0
+
+    def _connect(self):
+        '''
+        a new connection to the server
+        '''
+        import httplib
+        with self.lock:
+            self.opened = self.opened + 1
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.netloc, timeout=60)
+        return httplib.HTTPConnection(self.netloc, timeout=60)
+
+    def _checkout(self):
+        '''
+        an idle connection if there is one, or a new one
+        '''
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        '''
+        keep a connection for the next request
+        '''
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, conn, method, path, body, headers):
+        '''
+        send one request on a connection, return the response and its body
+        '''
+        if not hasattr(body, 'chunks'):
+            conn.request(method, path, body, headers)
+        else:
+            # stream the body, we never hold it all in memory
+            conn.putrequest(method, path)
+            for key, val in headers.items():
+                conn.putheader(key, val)
+            conn.putheader('Content-Length', str(body.length))
+            conn.endheaders()
+            for chunk in body.chunks():
+                conn.send(chunk)
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def request(self, method, url, body=None, headers=None):
+        '''
+        performs a request, returns (status, reason, body)
+        '''
+        import httplib
+        import socket
+        from urlparse import urlsplit
+        parts = urlsplit(url)
+        path = parts.path
+        if parts.query:
+            path = path + '?' + parts.query
+        if headers is None:
+            headers = {}
+        count('http_requests', method=method)
+        conn, reused = self._checkout()
+        try:
+            resp, data = self._send(conn, method, path, body, headers)
+        except (httplib.HTTPException, socket.error), err:
+            conn.close()
+            if not reused:
+                raise TransportError('%s %s: %r' % (method, url, err))
+            # the server dropped an idle connection, try a fresh one
+            conn = self._connect()
+            try:
+                resp, data = self._send(conn, method, path, body, headers)
+            except (httplib.HTTPException, socket.error), err:
+                conn.close()
+                raise TransportError('%s %s: %r' % (method, url, err))
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return resp.status, resp.reason, data
+
+    def close(self):
+        '''
+        closes all idle connections
+        '''
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for conn in idle:
+            conn.close()
+
+
+class MultipartFile(object):
+    '''
+    a multipart/form-data body made of the request JSON and one file,
+    read from disk in chunks while it is sent
+    '''
+    chunk_size = 64*1024
+
+    def __init__(self, json, fne, progress=None):
+        import os
+        import uuid
+        boundary = '===============%s==' % uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary="%s"' % boundary
+        self.head = ('--%s\r\n' % boundary +
+                     'Content-Type: text/plain\r\n' +
+                     'MIME-Version: 1.0\r\n' +
+                     'Content-disposition: form-data; name="request-json"' +
+                     '\r\n\r\n' + json + '\r\n' +
+                     '--%s\r\n' % boundary +
+                     'Content-Type: application/octet-stream\r\n' +
+                     'MIME-Version: 1.0\r\n' +
+                     'Content-disposition: form-data; name="file"; ' +
+                     'filename="%s"' % os.path.basename(fne) +
+                     '\r\n\r\n')
+        self.tail = '\r\n--%s--\r\n' % boundary
+        self.fne = fne
+        self.size = os.path.getsize(fne)
+        self.length = len(self.head) + self.size + len(self.tail)
+        self.progress = progress
+
+    def chunks(self):
+        '''
+        the body, a chunk at a time
+        '''
+        sent = 0
+        yield self.head
+        fle = open(self.fne, 'rb')
+        try:
+            while True:
+                chunk = fle.read(self.chunk_size)
+                if not chunk:
+                    break
+                sent = sent + len(chunk)
+                if self.progress is not None:
+                    self.progress(sent, self.size)
+                yield chunk
+        finally:
+            fle.close()
+        yield self.tail
+
+
+class NovaClient(object):
+    '''
+    nova.astrometry.net client
+    '''
+    default_url = 'http://nova.astrometry.net/api/'
+
+    def __init__(self, apiurl=default_url, transport=None):
+        self.session = None
+        self.apikey = None
+        self.apiurl = apiurl
+        if transport is None:
+            transport = Transport(apiurl)
+        self.transport = transport
+        self.lock = threading.Lock()
+
+    def get_url(self, service):
+        '''
+        constructs URL for a plate-solver service
+        '''
+        return self.apiurl + service
+
+    def send_request(self, service, args=None, file_args=None, relogin=True,
+                     progress=None):
+        '''
+        service: string
+        args: dict
+        file_args: name of the file to send, if any
+        progress: called as progress(sent, total) while a file is sent
+        '''
+        from urllib import urlencode
+        if args is None:
+            args = {}
+        sent = dict(args)
+        if self.session is not None:
+            sent.update({'session': self.session})
+        # print 'Python:', (sent)
+        json = python2json(sent)
+        # print 'Sending json:', json
+        url = self.get_url(service)
+        print 'Sending to URL:', url
+        # If we're sending a file, format a multipart/form-data
+        if file_args is not None:
+            data = MultipartFile(json, file_args, progress)
+            headers = {'Content-type': data.content_type}
+        else:
+            # Else send x-www-form-encoded
+            data = {'request-json': json}
+            # print 'Sending form data:', data
+            data = urlencode(data)
+            # print 'Sending data:', data
+            headers = {'Content-type': 'application/x-www-form-urlencoded'}
+        status, reason, txt = self.transport.request('POST', url, data,
+                                                     headers)
+        if status >= 400:
+            import tempfile
+            from os.path import join
+            print 'HTTPError', status, reason
+            errfn = join(tempfile.gettempdir(), 'ppa_err.html')
+            try:
+                with open(errfn, 'wb') as fle:
+                    fle.write(txt)
+                print 'Wrote error text to', errfn
+            except (IOError, OSError):
+                pass
+            return None
+        # DEBUG print 'Got json:', txt
+        result = json2python(txt)
+        # DEBUG print 'Got result:', result
+        if result is None:
+            raise RequestError('server sent no JSON')
+        stat = result.get('status')
+        # DEBUG print 'Got status:', stat
+        if stat == 'error':
+            errstr = result.get('errormessage', '(none)')
+            if (relogin and self.apikey is not None and
+                    self.session is not None and 'session' in errstr):
+                # our session has expired, get a new one and try again
+                self.session = None
+                self.login(self.apikey)
+                return self.send_request(service, args, file_args, False,
+                                         progress)
+            raise RequestError('server error message: ' + errstr)
+        return result
+
+    def login(self, apikey):
+        '''
+        Logs us into the plate-solver and gets a session key
+        '''
+        import string
+        args = {'apikey': string.strip(apikey)}
+        result = self.send_request('login', args, relogin=False)
+        if result is None:
+            raise RequestError('no result from login')
+        sess = result.get('session')
+        print 'Got session:', sess
+        if not sess:
+            raise RequestError('no session in result')
+        self.session = sess
+        self.apikey = apikey
+
+    def ensure_login(self, apikey):
+        '''
+        Logs us in, unless we already have a session for this key
+        '''
+        with self.lock:
+            if self.session is None or self.apikey != apikey:
+                self.session = None
+                self.login(apikey)
+
+    def _get_upload_args(self, **kwargs):
+        '''
+        returns the specified solving options
+        '''
+        args = {}
+        lkdt = [('allow_commercial_use', 'd', str),
+                ('allow_modifications', 'd', str),
+                ('publicly_visible', 'y', str),
+                ('scale_units', None, str),
+                ('scale_type', None, str),
+                ('scale_lower', None, float),
+                ('scale_upper', None, float),
+                ('scale_est', None, float),
+                ('scale_err', None, float),
+                ('center_ra', None, float),
+                ('center_dec', None, float),
+                ('radius', None, float),
+                ('downsample_factor', None, int),
+                ('tweak_order', None, int),
+                ('crpix_center', None, bool),
+                ('image_width', None, int),
+                ('image_height', None, int), ]
+        for key, default, typ in lkdt:
+            if key in kwargs:
+                val = kwargs.pop(key)
+                val = typ(val)
+                args.update({key: val})
+            elif default is not None:
+                args.update({key: default})
+        # print 'Upload args:', args
+        return args
+
+    def upload(self, fne, progress=None, **kwargs):
+        '''
+        uploads an image file, streaming it from disk
+        '''
+        args = self._get_upload_args(**kwargs)
+        try:
+            with span('upload', solver='nova'):
+                result = self.send_request('upload', args, fne,
+                                           progress=progress)
+            return result
+        except IOError:
+            print 'File %s does not exist' % fne
+            raise
+
+    def myjobs(self):
+        '''
+        queries server for our jobs
+        '''
+        result = self.send_request('myjobs/')
+        if result is None:
+            raise RequestError('no result from myjobs')
+        return result['jobs']
+
+    def job_status(self, job_id, justdict=False):
+        '''
+        queries server to see if a job is finished
+        '''
+        result = self.send_request('jobs/%s' % job_id)
+        if justdict or result is None:
+            return result
+        return result.get('status')
+
+    def sub_status(self, sub_id, justdict=False):
+        '''
+        queries server for submission status
+        '''
+        result = self.send_request('submissions/%s' % sub_id)
+        if justdict or result is None:
+            return result
+        return result.get('status')
+
+    def wait_for_job(self, sub_id, **kwargs):
+        '''
+        polls a submission until it has a job, returns the job id; raises
+        SolveFailed if the server rejects the submission. kwargs go to
+        poll()
+        '''
+        def check():
+            try:
+                stat = self.sub_status(sub_id, justdict=True)
+            except TransportError, err:
+                print 'Lost the connection:', err
+                stat = None
+            # print 'Got status:', stat
+            if stat is None:
+                # a hiccup, ask again
+                return None
+            for j in stat.get('jobs', []):
+                if j is not None:
+                    print 'Selecting job id', j
+                    return j
+            if stat.get('error_message'):
+                raise SolveFailed('submission %s failed: %s'
+                                  % (sub_id, stat['error_message']))
+            if (stat.get('status', '') == 'failure' or
+                    stat.get('processing_finished') not in (None, '',
+                                                            'None')):
+                # done with, and no job came of it
+                raise SolveFailed('submission %s failed' % sub_id)
+            return None
+        with span('queue_wait', solver='nova'):
+            return poll(check, **kwargs)
+
+    def wait_for_result(self, job_id, **kwargs):
+        '''
+        polls a job until it is solved, raises SolveFailed if it can't be;
+        kwargs go to poll()
+        '''
+        def check():
+            try:
+                stat = self.job_status(job_id, justdict=True)
+            except TransportError, err:
+                print 'Lost the connection:', err
+                stat = None
+            # print 'Got job status:', stat
+            if stat is None:
+                # a hiccup, ask again
+                return None
+            if stat.get('status', '') == 'success':
+                return stat['status']
+            if stat.get('status', '') == 'failure':
+                raise SolveFailed('job %s failed' % job_id)
+            return None
+        with span('solve', solver='nova'):
+            return poll(check, **kwargs)
+
+    def wcs_url(self, job_id):
+        '''
+        where the plate solution of a job is
+        '''
+        # We don't need the API for this, just construct URL
+        return self.apiurl.replace('/api/', '/wcs_file/%i' % job_id)
+
+    def solve(self, fne, wcsfn, upload_args=None, progress=None,
+              xylist=False, binning=1, journal=None, key=None, offload=None,
+              **kwargs):
+        '''
+        uploads an image, waits until it is solved and downloads the
+        plate solution to wcsfn; with xylist, we find the stars and only
+        upload their list; with binning > 1, the solver gets a grey copy
+        binned by that much. With a JobJournal, a submission of the same
+        image still in flight is polled again instead of uploading the
+        image once more. offload(func) calls func for us and returns what
+        it does, e.g. in another thread while a window is kept alive; the
+        star finding goes through it. kwargs go to poll(). Returns the job
+        id
+        '''
+        import os
+        import tempfile
+        if journal is not None and key is None:
+            key = journal.key(fne, self.apiurl, upload_args, xylist, binning)
+        if binning > 1:
+            from ppa_prep import with_binning
+            return with_binning(
+                lambda img, wcs: self.solve(img, wcs, upload_args, progress,
+                                            xylist, journal=journal,
+                                            key=key, offload=offload,
+                                            **kwargs),
+                fne, wcsfn, binning)
+        entry = journal.get(key) if journal is not None else None
+        if entry is None:
+            upload_args = dict(upload_args or {})
+            if xylist:
+                from ppa_stars import make_xylist
+                fdes, xyfn = tempfile.mkstemp(suffix='.xyls')
+                os.close(fdes)
+                try:
+                    if offload is None:
+                        wid, hei = make_xylist(fne, xyfn)
+                    else:
+                        wid, hei = offload(lambda: make_xylist(fne, xyfn))
+                    upload_args.update(image_width=wid, image_height=hei)
+                    return self.solve(xyfn, wcsfn, upload_args, progress,
+                                      journal=journal, key=key, **kwargs)
+                finally:
+                    os.remove(xyfn)
+            upres = self.upload(fne, progress=progress, **upload_args)
+            if upres is None or upres.get('status') != 'success':
+                print 'Upload failed:', upres
+                raise RequestError('upload failed')
+            entry = {'subid': upres['subid'], 'jobid': None}
+            if journal is not None:
+                journal.put(key, subid=entry['subid'], state='submitted')
+        else:
+            print 'Resuming submission', entry['subid'], 'job', entry['jobid']
+            count('journal_resumes')
+            if progress is not None:
+                # nothing to upload
+                progress(1, 1)
+        try:
+            job_id = entry['jobid']
+            if job_id is None:
+                job_id = self.wait_for_job(entry['subid'], **kwargs)
+                if journal is not None:
+                    journal.put(key, jobid=job_id, state='solving')
+            self.wait_for_result(job_id, **kwargs)
+        except (Cancelled, PollTimeout):
+            # still in flight, we come back to it
+            raise
+        except RequestError:
+            # failed, or the server doesn't know it (any more)
+            if journal is not None:
+                journal.drop(key)
+            raise
+        self.download(self.wcs_url(job_id), wcsfn)
+        if journal is not None:
+            journal.drop(key)
+        return job_id
+
+    def jobs_by_tag(self, tag, exact):
+        '''
+        not sure what that does
+        '''
+        from urllib import quote
+        exact_option = 'exact=yes' if exact else ''
+        result = self.send_request('jobs_by_tag?query=%s&%s'
+                                   % (quote(tag.strip()), exact_option), {}, )
+        return result
+
+    def download(self, url, fne):
+        '''
+        fetches a result file (e.g. the wcs) over our connections
+        '''
+        print 'Retrieving file from', url
+        with span('wcs_download', solver='nova'):
+            status, reason, txt = self.transport.request('GET', url)
+        if status >= 400:
+            raise RequestError('could not retrieve %s: %d %s'
+                               % (url, status, reason))
+        wfl = open(fne, 'wb')
+        wfl.write(txt)
+        wfl.close()
+        print 'Wrote to', fne
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(apikey, apiurl=NovaClient.default_url):
+    '''
+    the logged-in client for this server and key, shared by all the
+    solves of the process
+    '''
+    with _CLIENTS_LOCK:
+        clnt = _CLIENTS.get(apiurl)
+        if clnt is None:
+            clnt = NovaClient(apiurl)
+            _CLIENTS[apiurl] = clnt
+    clnt.ensure_login(apikey)
+    return clnt
+
+
+def solve_many(clnt, todo, upload_args=None, **kwargs):
+    '''
+    solves several images at once; todo is a list of (image, wcs) file
+    names. The uploads and the waits all overlap, so this takes about as
+    long as the slowest solve. Returns the exceptions (None when solved)
+    in the order of todo
+    '''
+    from ppa_pool import run_parallel
+
+    def one(item):
+        '''
+        solve one image
+        '''
+        return clnt.solve(item[0], item[1], upload_args, **kwargs)
+    return [err for res, err in run_parallel(one, todo, len(todo))]
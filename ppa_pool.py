@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Running the solves of PhotoPolarAlign side by side
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+
+def run_parallel(func, items, workers):
+    '''
+    calls func on each of items using up to workers threads, returns
+    a list of (result, exception) in the order of items
+    '''
+    import threading
+    import Queue
+    results = [(None, None)]*len(items)
+    todo = Queue.Queue()
+    for i, item in enumerate(items):
+        todo.put((i, item))
+
+    def worker():
+        '''
+        take items until there are none left
+        '''
+        while True:
+            try:
+                i, item = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (func(item), None)
+            except Exception, err:
+                results[i] = (None, err)
+    threads = []
+    for _ in range(max(1, min(workers, len(items)))):
+        thr = threading.Thread(target=worker)
+        thr.daemon = True
+        thr.start()
+        threads.append(thr)
+    for thr in threads:
+        thr.join()
+    return results
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Image preparation of PhotoPolarAlign
+
+The solvers are given a grey, binned, re-encoded copy of an image,
+which is smaller to upload and quicker to solve. The plate solution is
+then mapped back to the pixels of the full image, so that the rest of
+PPA never knows.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+
+def prepare_image(fn, outfn, factor, quality=90):
+    '''
+    writes a grey JPEG of the image, binned factor x factor, to outfn.
+    Returns the width and height of the full image
+    '''
+    from PIL import Image
+    import numpy
+    img = Image.open(fn)
+    wid, hei = img.size
+    bwid = wid // factor
+    bhei = hei // factor
+    if img.format == 'JPEG' and factor in (2, 4, 8):
+        # let libjpeg do (most of) the binning while decoding
+        img.draft('L', (bwid, bhei))
+    img = img.convert('L')
+    # what is left to bin, after any scaling by libjpeg
+    step = factor // int(round(float(wid)/img.size[0]))
+    arr = numpy.asarray(img, numpy.float32)
+    if step > 1:
+        # the rest of the binning, block means
+        arr = arr[:bhei*step, :bwid*step]
+        arr = arr.reshape(bhei, step, bwid, step).mean(axis=(1, 3))
+    else:
+        arr = arr[:bhei, :bwid]
+    out = Image.fromarray(numpy.clip(arr + 0.5, 0, 255).astype(numpy.uint8))
+    out.save(outfn, 'JPEG', quality=quality)
+    return wid, hei
+
+
+def rescale_header(head, factor, width, height):
+    '''
+    maps a plate solution of the binned image onto the full image
+    '''
+    import re
+    # the centre of binned pixel p is full pixel factor*(p - 0.5) + 0.5
+    for key in ('CRPIX1', 'CRPIX2'):
+        if key in head:
+            head[key] = factor*(head[key] - 0.5) + 0.5
+    for key in ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2', 'CDELT1', 'CDELT2'):
+        if key in head:
+            head[key] = head[key]/float(factor)
+    # SIP terms are polynomials in pixel offsets from CRPIX
+    sip = re.compile(r'^(A|B|AP|BP)_(\d+)_(\d+)$')
+    for key in head.keys():
+        mtc = sip.match(key)
+        if mtc:
+            power = int(mtc.group(2)) + int(mtc.group(3))
+            head[key] = head[key]*float(factor)**(1 - power)
+    if 'IMAGEW' in head:
+        head['IMAGEW'] = width
+        head['IMAGEH'] = height
+    if 'NAXIS1' in head and head['NAXIS1']:
+        head['NAXIS1'] = width
+        head['NAXIS2'] = height
+    # nova's wcs files have the scale in the comments
+    if 'COMMENT' in head:
+        comments = head['COMMENT']
+        for i in range(len(comments)):
+            if comments[i][0:5] == 'scale':
+                tkns = comments[i].split(' ')
+                tkns[1] = '%g' % (float(tkns[1])/factor)
+                head['COMMENT', i] = ' '.join(tkns)
+    return head
+
+
+def rescale_wcs_file(wcsfn, factor, width, height):
+    '''
+    maps the plate solution in wcsfn onto the full image, in place
+    '''
+    from astropy.io import fits
+    hdul = fits.open(wcsfn)
+    try:
+        rescale_header(hdul[0].header, factor, width, height)
+        hdul.writeto(wcsfn + '.tmp', overwrite=True)
+    finally:
+        hdul.close()
+    import os
+    if os.path.exists(wcsfn):
+        # Windows won't rename over an existing file
+        os.remove(wcsfn)
+    os.rename(wcsfn + '.tmp', wcsfn)
+
+
+def with_binning(func, fne, wcsfn, factor):
+    '''
+    calls func(image, wcsfn) on a grey copy of the image binned by
+    factor, then maps the plate solution back onto the full image.
+    Returns what func returns
+    '''
+    import os
+    import tempfile
+    fdes, tmp = tempfile.mkstemp(suffix='.jpg')
+    os.close(fdes)
+    try:
+        width, height = prepare_image(fne, tmp, factor)
+        res = func(tmp, wcsfn)
+        rescale_wcs_file(wcsfn, factor, width, height)
+        return res
+    finally:
+        os.remove(tmp)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Star extraction of PhotoPolarAlign
+
+Finds the stars in an image and writes them as an x,y list (a FITS
+table, as astrometry.net's image2xy would), which is all the plate
+solver needs, a few KB instead of the whole image.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+
+def load_gray(fn):
+    '''
+    the image as a 2D array of grey levels, ours to work on in place
+    '''
+    from PIL import Image
+    import numpy
+    img = Image.open(fn)
+    if img.mode != 'L':
+        img = img.convert('L')
+    return numpy.array(img, numpy.float32)
+
+
+def subtract_background(img, box=64):
+    '''
+    subtracts the sky background (median of box x box blocks, nearest
+    block) from the image, in place, a row of blocks at a time. Returns
+    the noise around it
+    '''
+    import numpy
+    hei, wid = img.shape
+    nby = max(1, hei // box)
+    nbx = max(1, wid // box)
+    cols = numpy.minimum(numpy.arange(wid) // box, nbx - 1)
+    for row in range(nby):
+        top = row*box
+        strip = img[top:top + box, :nbx*box]
+        blocks = strip.reshape(len(strip), nbx, box).transpose(1, 0, 2)
+        bkg = numpy.median(blocks.reshape(nbx, -1), axis=1)
+        # the rows below the last block row go with it
+        end = top + box if row < nby - 1 else hei
+        img[top:end] -= bkg[cols]
+    # the noise, from the median absolute deviation
+    sample = img[::4, ::4]
+    sigma = 1.4826*numpy.median(numpy.abs(sample - numpy.median(sample)))
+    return max(float(sigma), 1e-3)
+
+
+def smooth(img, rows=64):
+    '''
+    averages the image over 3 x 3 pixels, to beat the (JPEG) noise; in
+    place, rows rows at a time
+    '''
+    hei = img.shape[0]
+    for top in range(0, hei, rows):
+        blk = img[top:top + rows]
+        orig = blk.copy()
+        blk[:, 1:-1] += orig[:, :-2]
+        blk[:, 1:-1] += orig[:, 2:]
+    above = None
+    for top in range(0, hei, rows):
+        blk = img[top:top + rows]
+        orig = blk.copy()
+        blk[1:] += orig[:-1]
+        blk[:-1] += orig[1:]
+        if above is not None:
+            blk[0] += above
+        if top + rows < hei:
+            # not done yet
+            blk[-1] += img[top + rows]
+        above = orig[-1]
+    img *= 1/9.0
+
+
+def detection_radius(img, xs, ys, thresh, most=64, gap=12):
+    '''
+    how far (pixels, at most most) the light of each peak reaches out
+    above thresh, in any of 8 directions, across gaps (the dark middle
+    of an out of focus star) of less than gap pixels
+    '''
+    import numpy
+    hei, wid = img.shape
+    steps = numpy.arange(1, most + gap + 1)
+    rad = numpy.zeros(len(xs))
+    for dx, dy in ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1),
+                   (0, -1), (1, -1)):
+        above = img[numpy.clip(ys[:, None] + dy*steps, 0, hei - 1),
+                    numpy.clip(xs[:, None] + dx*steps, 0, wid - 1)] > thresh
+        # the first run of gap steps that are not
+        runs = numpy.cumsum(above, axis=1)
+        dark = (runs[:, gap:] - runs[:, :-gap]) == 0
+        reach = numpy.where(dark.any(axis=1), dark.argmax(axis=1), most)
+        rad = numpy.maximum(rad, reach*numpy.hypot(dx, dy))
+    return rad
+
+
+def suppress(xs, ys, seps, most):
+    '''
+    the indices of the points, best first, not within seps (pixels, of
+    each point) of a better one; at most most of them
+    '''
+    cell = max(1, int(max(seps)) + 1)
+    cells = {}
+    kept = []
+    for i in range(len(xs)):
+        cellx = int(xs[i] // cell)
+        celly = int(ys[i] // cell)
+        near = False
+        for key in [(cellx + dx, celly + dy) for dx in (-1, 0, 1)
+                    for dy in (-1, 0, 1)]:
+            for j in cells.get(key, ()):
+                if (xs[j] - xs[i])**2 + (ys[j] - ys[i])**2 <= seps[j]**2:
+                    near = True
+                    break
+            if near:
+                break
+        if near:
+            continue
+        cells.setdefault((cellx, celly), []).append(i)
+        kept.append(i)
+        if len(kept) == most:
+            break
+    return kept
+
+
+def find_stars(img, nsigma=5.0, radius=3, min_sep=12, max_stars=300):
+    '''
+    the stars in an image, brightest first, as an array of rows of
+    x, y (FITS, 1-based pixels) and flux. The image (float32, from
+    load_gray) is background subtracted and smoothed in place
+    '''
+    import numpy
+    sigma = subtract_background(img)
+    smooth(img)
+    hei, wid = img.shape
+    thresh = nsigma*sigma/3.0
+    # the pixels above the threshold, away from the edges, that are
+    # local maxima
+    ys, xs = numpy.nonzero(img[radius:hei - radius, radius:wid - radius] >
+                           thresh)
+    ys = ys + radius
+    xs = xs + radius
+    val = img[ys, xs]
+    peak = numpy.ones(len(val), bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy != 0 or dx != 0:
+                peak &= val >= img[ys + dy, xs + dx]
+    ys = ys[peak]
+    xs = xs[peak]
+    if len(xs) == 0:
+        return numpy.zeros((0, 3))
+    # centroid in a (2r+1)^2 window around each peak, all at once
+    offs = numpy.arange(-radius, radius + 1)
+    wy = ys[:, None, None] + offs[None, :, None]
+    wx = xs[:, None, None] + offs[None, None, :]
+    cut = numpy.clip(img[wy, wx], 0, None)
+    flux = cut.sum(axis=(1, 2))
+    cenx = xs + (cut.sum(axis=1)*offs[None, :]).sum(axis=1)/flux
+    ceny = ys + (cut.sum(axis=2)*offs[None, :]).sum(axis=1)/flux
+    del cut
+    # big, flat-topped (saturated) or out of focus stars give several
+    # peaks, keep the brightest within its detection radius (and the
+    # centroid window), or min_sep
+    order = numpy.argsort(-flux, kind='mergesort')[:4*max_stars]
+    seps = numpy.maximum(detection_radius(img, xs[order], ys[order],
+                                          thresh, gap=min_sep) + radius,
+                         min_sep)
+    order = order[suppress(xs[order], ys[order], seps, max_stars)]
+    # 0-based array indices to 1-based FITS pixels
+    return numpy.column_stack((cenx[order] + 1, ceny[order] + 1,
+                               flux[order]))
+
+
+def write_xylist(fn, stars, width, height):
+    '''
+    writes the stars as a FITS table of X, Y, FLUX
+    '''
+    from astropy.io import fits
+    cols = [fits.Column(name='X', format='E', array=stars[:, 0]),
+            fits.Column(name='Y', format='E', array=stars[:, 1]),
+            fits.Column(name='FLUX', format='E', array=stars[:, 2])]
+    tbl = fits.BinTableHDU.from_columns(cols)
+    tbl.header['IMAGEW'] = width
+    tbl.header['IMAGEH'] = height
+    fits.HDUList([fits.PrimaryHDU(), tbl]).writeto(fn, overwrite=True)
+
+
+def make_xylist(imgfn, xyfn, **kwargs):
+    '''
+    finds the stars in an image and writes them to xyfn; kwargs go to
+    find_stars(). Returns the width and height of the image
+    '''
+    img = load_gray(imgfn)
+    stars = find_stars(img, **kwargs)
+    hei, wid = img.shape
+    print 'Found %d stars in %s' % (len(stars), imgfn)
+    write_xylist(xyfn, stars, wid, hei)
+    return wid, hei
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Image viewer of PhotoPolarAlign
+
+Shows a PIL image, handed over in memory, on a scrollable and zoomable
+canvas. Only the tiles in view are made into Tk images, from a pyramid
+of halved copies of the image that is built as it is needed, so a big
+crop never needs one big Tk image.
+
+Annotations are not drawn into the image but kept as an Overlay, drawn
+as canvas items over it, so changing them does not touch the image.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+from Tkinter import Frame, Canvas, Scrollbar
+
+# tiles are TILE x TILE (screen) pixels
+TILE = 256
+# how far in (2**ZOOM_IN) and out (1/2**ZOOM_OUT) we zoom
+ZOOM_IN = 2
+ZOOM_OUT = 4
+# the Greek letters of the Symbol font (the labels of the catalog)
+SYMBOL = dict(zip('abcdefghijklmnopqrstuvwxyz',
+                  u'αβχδεφγηιϕκλμνοπθρστυϖωξψζ'))
+# the Tk font of the overlays, made once
+FONTS = {}
+
+
+def overlay_font():
+    '''
+    the Tk font of the overlays' labels and numbers; the labels are
+    already Unicode Greek, which Helvetica (or the font Tk puts in its
+    place) has, so one font does for both
+    '''
+    import tkFont
+    if 'overlay' not in FONTS:
+        FONTS['overlay'] = tkFont.Font(family='Helvetica', size=-24)
+    return FONTS['overlay']
+
+
+class Overlay(object):
+    '''
+    what is drawn over an image, placed in pixels of the (full) image.
+    Sizes are in screen pixels, or in image pixels when scaled
+    '''
+    def __init__(self):
+        self.items = []
+
+    def line(self, x, y, offsets, colour, width=1, scaled=False):
+        '''
+        a line from (x, y) + offsets[0:2] to (x, y) + offsets[2:4]
+        '''
+        self.items.append(('line', x, y, offsets, colour, width, scaled))
+
+    def circle(self, x, y, radius, colour, scaled=False):
+        '''
+        a circle around (x, y)
+        '''
+        self.items.append(('circle', x, y, radius, colour, scaled))
+
+    def text(self, x, y, offset, text, colour, font='text', scaled=False):
+        '''
+        text with its top left at (x, y) + offset; with font 'symbol'
+        the letters are the Symbol font's, i.e. Greek
+        '''
+        if font == 'symbol':
+            text = u''.join([SYMBOL.get(char, char) for char in text])
+        self.items.append(('text', x, y, offset, text, colour, scaled))
+
+    def draw(self, viewer, tag='overlay'):
+        '''
+        draws the overlay on the canvas of a viewer
+        '''
+        canvas = viewer.canvas
+        mag = 2.0**viewer.zoom/viewer.reduce
+        for item in self.items:
+            cnx, cny = viewer.to_canvas(item[1], item[2])
+            if item[0] == 'line':
+                offs, colour, width, scaled = item[3:]
+                fac = mag if scaled else 1.0
+                canvas.create_line(cnx + offs[0]*fac, cny + offs[1]*fac,
+                                   cnx + offs[2]*fac, cny + offs[3]*fac,
+                                   fill=colour, width=width, tags=tag)
+            elif item[0] == 'circle':
+                rad, colour, scaled = item[3:]
+                if scaled:
+                    rad = rad*mag
+                canvas.create_oval(cnx - rad, cny - rad, cnx + rad, cny + rad,
+                                   outline=colour, tags=tag)
+            elif item[0] == 'text':
+                offs, text, colour, scaled = item[3:]
+                fac = mag if scaled else 1.0
+                canvas.create_text(cnx + offs[0]*fac, cny + offs[1]*fac,
+                                   text=text, fill=colour, anchor='nw',
+                                   font=overlay_font(), tags=tag)
+
+
+class Pyramid(object):
+    '''
+    an image, and its copies halved again and again, made as needed
+    '''
+    def __init__(self, img):
+        self.levels = [img]
+
+    def level(self, num):
+        '''
+        the image halved num times
+        '''
+        from PIL import Image
+        while len(self.levels) <= num:
+            last = self.levels[-1]
+            self.levels.append(last.resize((max(1, last.size[0]//2),
+                                            max(1, last.size[1]//2)),
+                                           Image.BOX))
+        return self.levels[num]
+
+    def size(self, zoom):
+        '''
+        the size of the image, zoomed by 2**zoom
+        '''
+        wid, hei = self.levels[0].size
+        return int(wid*2.0**zoom), int(hei*2.0**zoom)
+
+    def tile(self, zoom, col, row):
+        '''
+        the tile in column col, row row of the image zoomed by 2**zoom,
+        as a PIL image
+        '''
+        from PIL import Image
+        if zoom <= 0:
+            img = self.level(-zoom)
+            return img.crop((col*TILE, row*TILE,
+                             min(img.size[0], (col + 1)*TILE),
+                             min(img.size[1], (row + 1)*TILE)))
+        # zoomed in, blow up a piece of the image
+        mag = 2**zoom
+        src = TILE//mag
+        img = self.levels[0]
+        box = (col*src, row*src, min(img.size[0], (col + 1)*src),
+               min(img.size[1], (row + 1)*src))
+        piece = img.crop(box)
+        return piece.resize(((box[2] - box[0])*mag, (box[3] - box[1])*mag),
+                            Image.NEAREST)
+
+
+class ImageViewer(Frame):
+    '''
+    a canvas with scrollbars showing an image, tile by tile, and an
+    overlay; the mouse wheel or +/- zoom, dragging pans. The image may be
+    a piece of a bigger one, starting at origin and reduced by reduce;
+    the overlay is placed in pixels of the bigger one
+    '''
+    def __init__(self, master, img, width=800, height=800, origin=(0, 0),
+                 reduce=1.0):
+        Frame.__init__(self, master, bd=0)
+        self.pyramid = Pyramid(img)
+        self.origin = origin
+        self.reduce = reduce
+        self.zoom = 0
+        self.overlay = None
+        # (col, row) -> (Tk image, canvas item) of the tiles of this zoom
+        self.tiles = {}
+        xscrollbar = Scrollbar(self, orient='horizontal')
+        xscrollbar.pack(side='bottom', fill='x')
+        yscrollbar = Scrollbar(self, orient='vertical')
+        yscrollbar.pack(side='right', fill='y')
+        self.canvas = Canvas(self, bd=0, highlightthickness=0,
+                             width=min(width, img.size[0]),
+                             height=min(height, img.size[1]),
+                             xscrollcommand=xscrollbar.set,
+                             yscrollcommand=yscrollbar.set)
+        self.canvas.pack(side='top', fill='both', expand=1)
+        xscrollbar.config(command=self.xview)
+        yscrollbar.config(command=self.yview)
+        self.canvas.bind('<Configure>', self.show_tiles)
+        self.canvas.bind('<ButtonPress-1>', self.pan_start)
+        self.canvas.bind('<B1-Motion>', self.pan)
+        self.canvas.bind('<MouseWheel>', self.wheel)
+        self.canvas.bind('<Button-4>', self.wheel)
+        self.canvas.bind('<Button-5>', self.wheel)
+        self.canvas.bind('<Key-plus>', lambda evt: self.set_zoom(1))
+        self.canvas.bind('<Key-equal>', lambda evt: self.set_zoom(1))
+        self.canvas.bind('<Key-minus>', lambda evt: self.set_zoom(-1))
+        self.canvas.bind('<Enter>', lambda evt: self.canvas.focus_set())
+        self.set_zoom(0)
+
+    def xview(self, *args):
+        '''
+        the horizontal scrollbar moved
+        '''
+        self.canvas.xview(*args)
+        self.show_tiles()
+
+    def yview(self, *args):
+        '''
+        the vertical scrollbar moved
+        '''
+        self.canvas.yview(*args)
+        self.show_tiles()
+
+    def pan_start(self, event):
+        '''
+        the user grabbed the image
+        '''
+        self.canvas.scan_mark(event.x, event.y)
+
+    def pan(self, event):
+        '''
+        the user drags the image
+        '''
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.show_tiles()
+
+    def wheel(self, event):
+        '''
+        the mouse wheel zooms, about the pointer
+        '''
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.set_zoom(1, event.x, event.y)
+        else:
+            self.set_zoom(-1, event.x, event.y)
+
+    def set_zoom(self, step, wx=None, wy=None):
+        '''
+        zoom in (step > 0) or out, keeping the image pixel at window
+        pixel wx, wy (default the middle) where it is
+        '''
+        zoom = max(-ZOOM_OUT, min(ZOOM_IN, self.zoom + step))
+        if step != 0 and zoom == self.zoom:
+            return
+        if wx is None:
+            wx = self.canvas.winfo_width()//2
+            wy = self.canvas.winfo_height()//2
+        imx, imy = self.image_at(wx, wy)
+        self.zoom = zoom
+        self.refresh(imx, imy, wx, wy)
+
+    def set_image(self, img, origin=(0, 0), reduce=1.0):
+        '''
+        show another image, keeping the image pixel in the middle of the
+        window where it is
+        '''
+        wx = self.canvas.winfo_width()//2
+        wy = self.canvas.winfo_height()//2
+        imx, imy = self.image_at(wx, wy)
+        self.pyramid = Pyramid(img)
+        self.origin = origin
+        self.reduce = reduce
+        self.refresh(imx, imy, wx, wy)
+
+    def set_overlay(self, overlay):
+        '''
+        draw overlay over the image, instead of what was there
+        '''
+        self.overlay = overlay
+        self.zoomed()
+
+    def image_at(self, wx, wy):
+        '''
+        the image pixel at window pixel wx, wy
+        '''
+        return self.to_image(self.canvas.canvasx(wx),
+                             self.canvas.canvasy(wy))
+
+    def refresh(self, imx, imy, wx, wy):
+        '''
+        show the image afresh, with image pixel imx, imy at window pixel
+        wx, wy
+        '''
+        for tkimg, item in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles = {}
+        wid, hei = self.pyramid.size(self.zoom)
+        self.canvas.config(scrollregion=(0, 0, wid, hei))
+        cnx, cny = self.to_canvas(imx, imy)
+        if wid > 0:
+            self.canvas.xview_moveto(max(0.0, (cnx - wx)/float(wid)))
+        if hei > 0:
+            self.canvas.yview_moveto(max(0.0, (cny - wy)/float(hei)))
+        self.zoomed()
+        self.show_tiles()
+
+    def zoomed(self):
+        '''
+        called when the zoom (or image) changes, draws the overlay afresh
+        '''
+        self.canvas.delete('overlay')
+        if self.overlay is not None:
+            self.overlay.draw(self)
+
+    def to_canvas(self, imx, imy):
+        '''
+        image pixels to canvas pixels, at this zoom
+        '''
+        mag = 2.0**self.zoom/self.reduce
+        return (imx - self.origin[0])*mag, (imy - self.origin[1])*mag
+
+    def to_image(self, cnx, cny):
+        '''
+        canvas pixels to image pixels, at this zoom
+        '''
+        mag = 2.0**self.zoom/self.reduce
+        return cnx/mag + self.origin[0], cny/mag + self.origin[1]
+
+    def show_tiles(self, event=None):
+        '''
+        make the tiles in view (and only those) into Tk images
+        '''
+        from PIL import ImageTk
+        wid, hei = self.pyramid.size(self.zoom)
+        left = max(0, int(self.canvas.canvasx(0)))
+        top = max(0, int(self.canvas.canvasy(0)))
+        right = min(wid, int(self.canvas.canvasx(self.canvas.winfo_width())))
+        bottom = min(hei,
+                     int(self.canvas.canvasy(self.canvas.winfo_height())))
+        wanted = set()
+        for row in range(top//TILE, (bottom - 1)//TILE + 1):
+            for col in range(left//TILE, (right - 1)//TILE + 1):
+                wanted.add((col, row))
+        for key in self.tiles.keys():
+            if key not in wanted:
+                self.canvas.delete(self.tiles.pop(key)[1])
+        for col, row in wanted:
+            if (col, row) in self.tiles:
+                continue
+            tkimg = ImageTk.PhotoImage(self.pyramid.tile(self.zoom, col, row),
+                                       master=self.canvas)
+            item = self.canvas.create_image(col*TILE, row*TILE, image=tkimg,
+                                            anchor='nw', tags='tile')
+            # the tiles go under the overlay
+            self.canvas.tag_lower(item)
+            self.tiles[(col, row)] = (tkimg, item)
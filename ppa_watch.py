@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Capture folder watch of PhotoPolarAlign
+
+Looks, every so often, for images that appear in a folder (e.g. where
+the camera software saves its frames) and hands over each one once it
+has stopped changing, i.e. the camera has finished writing it.
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+# the images we look for
+PATTERNS = ('*.jpg', '*.jpeg', '*.JPG', '*.JPEG')
+
+
+class FolderWatch(object):
+    '''
+    the new images of a folder; those already there when we start
+    watching are not new
+    '''
+    def __init__(self, folder, patterns=PATTERNS, settle=1.0):
+        self.folder = folder
+        self.patterns = patterns
+        # seconds an image must be unchanged before we hand it over
+        self.settle = settle
+        # file name -> (size, mtime, when we first saw it so)
+        self.pending = {}
+        self.seen = set(self.images())
+
+    def images(self):
+        '''
+        the images in the folder now
+        '''
+        import glob
+        from os.path import join
+        names = set()
+        for pattern in self.patterns:
+            names.update(glob.glob(join(self.folder, pattern)))
+        return names
+
+    def poll(self, now=None):
+        '''
+        the new images that have settled since the last poll, oldest
+        first
+        '''
+        import os
+        import time
+        if now is None:
+            now = time.time()
+        ready = []
+        current = self.images()
+        for name in set(self.pending) - current:
+            # gone before it settled
+            del self.pending[name]
+        for name in current - self.seen:
+            try:
+                sta = os.stat(name)
+            except OSError:
+                # gone again
+                self.pending.pop(name, None)
+                continue
+            ident = (sta.st_size, sta.st_mtime)
+            if sta.st_size == 0:
+                continue
+            before = self.pending.get(name)
+            if before is None or before[0:2] != ident:
+                # new, or still being written
+                self.pending[name] = ident + (now,)
+            elif now - before[2] >= self.settle:
+                del self.pending[name]
+                self.seen.add(name)
+                ready.append((sta.st_mtime, name))
+        ready.sort()
+        return [name for mtime, name in ready]
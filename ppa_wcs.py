@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Plate solution records of PhotoPolarAlign
+
+A .wcs header is read once, in a single pass over its cards, into a
+small WcsRecord holding what PPA needs of it: scale, parity, Dec, image
+size, the CD matrix and the SIP distortion terms. The records of a
+directory are kept in a sidecar index file there, so a solution is only
+parsed again when its file changes (size, mtime or inode).
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import threading
+from ppa_metrics import count, span
+
+# the sidecar index, in the directory of the .wcs files
+INDEX_FN = '.ppa_wcs_index'
+# bump this when WcsRecord changes, older indexes are then ignored
+INDEX_VERSION = 1
+# other cards that make a difference to the sky coordinates
+EXTRA_KEYS = ('LONPOLE', 'LATPOLE', 'EQUINOX', 'RADESYS', 'CUNIT1', 'CUNIT2')
+
+
+class WcsRecord(object):
+    '''
+    what PPA needs of a plate solution
+    '''
+    __slots__ = ('scale', 'parity', 'dec', 'width', 'height', 'ctype',
+                 'crval', 'crpix', 'cd', 'sip', 'extra')
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def as_dict(self):
+        '''
+        the record as plain python types
+        '''
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    @classmethod
+    def from_dict(cls, dct):
+        '''
+        the record of as_dict()
+        '''
+        return cls(**dict([(str(key), val) for key, val in dct.items()]))
+
+    def size(self):
+        '''
+        the width and height of the image
+        '''
+        return self.width, self.height
+
+    def header(self):
+        '''
+        a FITS header with the WCS of the record
+        '''
+        from astropy.io import fits
+        head = fits.Header()
+        head['WCSAXES'] = 2
+        for i in range(2):
+            head['CTYPE%d' % (i + 1)] = str(self.ctype[i])
+            head['CRVAL%d' % (i + 1)] = self.crval[i]
+            head['CRPIX%d' % (i + 1)] = self.crpix[i]
+        for i in range(2):
+            for j in range(2):
+                head['CD%d_%d' % (i + 1, j + 1)] = self.cd[i][j]
+        for key, val in self.extra + self.sip:
+            head[str(key)] = val
+        head['IMAGEW'] = self.width
+        head['IMAGEH'] = self.height
+        return head
+
+    def wcs(self):
+        '''
+        the astropy WCS of the record
+        '''
+        from astropy import wcs
+        return wcs.WCS(self.header())
+
+
+def parse_header(head):
+    '''
+    the WcsRecord of a FITS header, in one pass over its cards
+    '''
+    with span('header_parse'):
+        return _parse_header(head)
+
+
+def _parse_header(head):
+    '''
+    the WcsRecord of a FITS header, untimed
+    '''
+    import math
+    import re
+    sip = re.compile(r'^(A|B|AP|BP)_(\d+_\d+|ORDER)$')
+    keys = {}
+    scale = None
+    parity = None
+    sipterms = []
+    extra = []
+    for card in head.cards:
+        key = card.keyword
+        val = card.value
+        if key == 'COMMENT':
+            # nova's wcs files have the scale and parity in the comments
+            text = str(val)
+            if text[0:5] == 'scale' and scale is None:
+                scale = float(text.split(' ')[1])
+            elif text[0:6] == 'parity' and parity is None:
+                parity = int(text.split(' ')[1])
+        elif sip.match(key):
+            sipterms.append((key, val))
+        elif key in EXTRA_KEYS:
+            extra.append((key, val))
+        else:
+            keys[key] = val
+    # nova's and AstroArt's wcs files have CRVAL2
+    dec = keys['CRVAL2']
+    # nova's wcs files have IMAGEW / IMAGEH, AstroArt's NAXIS1 / NAXIS2
+    width = keys.get('IMAGEW', keys.get('NAXIS1', 0))
+    height = keys.get('IMAGEH', keys.get('NAXIS2', 0))
+    if 'CD1_1' in keys:
+        cd = [[keys.get('CD1_1', 0.0), keys.get('CD1_2', 0.0)],
+              [keys.get('CD2_1', 0.0), keys.get('CD2_2', 0.0)]]
+    else:
+        # AstroArt's have CDELT (deg/pixel), with PC or CROTA2
+        cdelt = [keys.get('CDELT1', 1.0), keys.get('CDELT2', 1.0)]
+        if 'PC1_1' in keys:
+            pcm = [[keys.get('PC1_1', 1.0), keys.get('PC1_2', 0.0)],
+                   [keys.get('PC2_1', 0.0), keys.get('PC2_2', 1.0)]]
+        else:
+            rot = math.radians(keys.get('CROTA2', 0.0))
+            ratio = cdelt[1]/cdelt[0] if cdelt[0] else 1.0
+            pcm = [[math.cos(rot), -math.sin(rot)*ratio],
+                   [math.sin(rot)/ratio, math.cos(rot)]]
+        cd = [[cdelt[0]*pcm[0][0], cdelt[0]*pcm[0][1]],
+              [cdelt[1]*pcm[1][0], cdelt[1]*pcm[1][1]]]
+    if scale is None:
+        if 'CDELT1' in keys:
+            scale = abs(float(keys['CDELT1']))*60.0*60.0
+        elif 'CD1_1' in keys:
+            det = cd[0][0]*cd[1][1] - cd[0][1]*cd[1][0]
+            scale = math.sqrt(abs(det))*60.0*60.0
+        else:
+            scale = 1.0
+    if parity is None:
+        parity = 1
+    return WcsRecord(scale=scale, parity=parity, dec=dec, width=width,
+                     height=height,
+                     ctype=[keys.get('CTYPE1', 'RA---TAN'),
+                            keys.get('CTYPE2', 'DEC--TAN')],
+                     crval=[keys.get('CRVAL1', 0.0), dec],
+                     crpix=[keys.get('CRPIX1', 0.0), keys.get('CRPIX2', 0.0)],
+                     cd=cd, sip=sipterms, extra=extra)
+
+
+def as_record(head):
+    '''
+    a WcsRecord, from a header or a WcsRecord
+    '''
+    if isinstance(head, WcsRecord):
+        return head
+    return parse_header(head)
+
+
+def file_ident(sta):
+    '''
+    what tells us a file has changed, from its os.stat()
+    '''
+    return [sta.st_size, sta.st_mtime, sta.st_ino]
+
+
+class WcsIndex(object):
+    '''
+    the records of the .wcs files of a directory, kept in its sidecar
+    index file
+    '''
+    def __init__(self, dirname):
+        import json
+        from os.path import join
+        self.fn = join(dirname, INDEX_FN)
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(self.fn) as fle:
+                index = json.load(fle)
+            if (index.get('version') == INDEX_VERSION and
+                    isinstance(index['entries'], dict)):
+                self.entries = index['entries']
+        except (IOError, ValueError, KeyError, AttributeError):
+            pass
+
+    def record(self, fn):
+        '''
+        the record of the .wcs file fn, parsed again only if it changed
+        '''
+        import os
+        from os.path import basename
+        from astropy.io import fits
+        ident = file_ident(os.stat(fn))
+        entry = self.entries.get(basename(fn))
+        try:
+            if (entry['ident'] == ident and
+                    set(entry['record']) == set(WcsRecord.__slots__)):
+                count('cache_hits', cache='wcs_index')
+                return WcsRecord.from_dict(entry['record'])
+        except (KeyError, TypeError, AttributeError):
+            # no entry, or a damaged one
+            pass
+        count('cache_misses', cache='wcs_index')
+        with fits.open(fn) as hdul:
+            rec = parse_header(hdul[0].header)
+        self.entries[basename(fn)] = {'ident': ident,
+                                      'record': rec.as_dict()}
+        self.changed = True
+        return rec
+
+    def save(self):
+        '''
+        write the index back, if it changed; a directory we can't write to
+        just goes without
+        '''
+        import json
+        import os
+        if not self.changed:
+            return
+        tmp = self.fn + '.tmp'
+        try:
+            with open(tmp, 'w') as fle:
+                json.dump({'version': INDEX_VERSION,
+                           'entries': self.entries}, fle)
+            if os.path.exists(self.fn):
+                # Windows won't rename over an existing file
+                os.remove(self.fn)
+            os.rename(tmp, self.fn)
+            self.changed = False
+        except (IOError, OSError):
+            pass
+
+
+# directory -> WcsIndex, so each index is read once
+_INDEXES = {}
+_LOCK = threading.Lock()
+
+
+def read_records(fns):
+    '''
+    the records of the .wcs files fns
+    '''
+    from os.path import abspath, dirname
+    recs = []
+    with _LOCK:
+        used = []
+        for fn in fns:
+            dirn = dirname(abspath(fn))
+            if dirn not in _INDEXES:
+                _INDEXES[dirn] = WcsIndex(dirn)
+            recs.append(_INDEXES[dirn].record(fn))
+            used.append(_INDEXES[dirn])
+        for index in set(used):
+            index.save()
+    return recs
+
+
+def read_record(fn):
+    '''
+    the record of the .wcs file fn
+    '''
+    return read_records([fn])[0]
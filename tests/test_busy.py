@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the busy state of the window during solves
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import PPA
+from Tkinter import TclError
+
+
+class Widget(object):
+    '''
+    a button, as far as busy() is concerned
+    '''
+    def __init__(self, state):
+        self.state = state
+
+    def cget(self, name):
+        return self.state
+
+    def configure(self, state):
+        self.state = state
+
+
+class Menu(object):
+    def __init__(self):
+        self.states = {}
+
+    def entryconfig(self, index, state):
+        self.states[index] = state
+
+
+class Window(object):
+    '''
+    what busy() and in_background() need of PhotoPolarAlign
+    '''
+    def __init__(self):
+        self.buttons = [Widget('normal'), Widget('disabled')]
+        self.filemenu = Menu()
+        self.frames_entry = 1
+        self.busy_depth = 0
+        self.busy_states = {}
+        self.quitting = None
+        self.cancel_solve = False
+        self.idle = []
+        self.updates = 0
+        self.gone = False
+
+    def operations(self):
+        return self.buttons
+
+    def after_idle(self, func):
+        self.idle.append(func)
+
+    def update(self):
+        self.updates = self.updates + 1
+        if self.gone:
+            raise TclError('can\'t invoke "update" command')
+
+
+class TestBusy(unittest.TestCase):
+    def test_buttons_disabled_and_restored(self):
+        win = Window()
+        with PPA.busy(win):
+            self.assertEqual([btn.state for btn in win.buttons],
+                             ['disabled', 'disabled'])
+            self.assertEqual(win.filemenu.states, {1: 'disabled'})
+            with PPA.busy(win):
+                pass
+            self.assertEqual(win.buttons[0].state, 'disabled')
+        self.assertEqual([btn.state for btn in win.buttons],
+                         ['normal', 'disabled'])
+        self.assertEqual(win.filemenu.states, {1: 'normal'})
+        self.assertEqual(win.busy_depth, 0)
+
+    def test_quit_waits(self):
+        win = Window()
+        quits = []
+        with PPA.busy(win):
+            win.quitting = lambda: quits.append(True)
+        self.assertEqual(quits, [])
+        self.assertEqual(len(win.idle), 1)
+        win.idle[0]()
+        self.assertEqual(quits, [True])
+
+    def test_in_background(self):
+        import time
+        win = Window()
+
+        def work():
+            self.assertEqual(win.busy_depth, 1)
+            time.sleep(0.2)
+            return 42
+        self.assertEqual(PPA.in_background(win, work), 42)
+        self.assertTrue(win.updates > 0)
+        self.assertEqual(win.buttons[0].state, 'normal')
+
+    def test_window_gone(self):
+        import time
+        win = Window()
+        win.gone = True
+        self.assertEqual(PPA.in_background(win, lambda: time.sleep(0.2)),
+                         None)
+        self.assertTrue(win.cancel_solve)
+
+
+if __name__ == '__main__':
+    unittest.main()
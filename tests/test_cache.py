@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the plate solution cache
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_cache
+from ppa_cache import SolutionCache
+from ppa_journal import JobJournal
+
+
+class Settings(object):
+    '''
+    what PhotoPolarAlign's cache methods need of it
+    '''
+    def __init__(self, cache):
+        self.cache = cache
+
+    def solver_params(self, solver):
+        return {'solver': solver}
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        self.img = os.path.join(self.tmpdir, 'v.jpg')
+        self.wcs = os.path.join(self.tmpdir, 'v.wcs')
+        with open(self.img, 'wb') as fle:
+            fle.write('not really a jpeg')
+        self.cache = SolutionCache(os.path.join(self.tmpdir, 'cache'))
+        self.hashed = []
+        self.image_hash = ppa_cache.image_hash
+
+        def image_hash(fn):
+            self.hashed.append(fn)
+            return self.image_hash(fn)
+        ppa_cache.image_hash = image_hash
+
+    def tearDown(self):
+        ppa_cache.image_hash = self.image_hash
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write_wcs(self, text, age=0.0):
+        with open(self.wcs, 'w') as fle:
+            fle.write(text)
+        when = os.stat(self.img).st_mtime + age
+        os.utime(self.wcs, (when, when))
+
+    def remember(self, text):
+        from PPA import PhotoPolarAlign
+        self.write_wcs(text, 10.0)
+        settings = Settings(self.cache)
+        PhotoPolarAlign.remember_solution.im_func(settings, self.img,
+                                                  self.wcs, 'nova')
+        return settings
+
+    def test_happy_with_is_read_only(self):
+        from PPA import PhotoPolarAlign
+        settings = self.remember('cached')
+        self.write_wcs('stale', -10.0)
+        happy_with = PhotoPolarAlign.happy_with.im_func
+        self.assertFalse(happy_with(settings, self.wcs, self.img))
+        with open(self.wcs) as fle:
+            self.assertEqual(fle.read(), 'stale')
+        # one we know nothing of goes by the times
+        self.write_wcs('fresh', 10.0)
+        self.assertTrue(happy_with(settings, self.wcs, self.img))
+        # and a solve restores it
+        cached_solution = PhotoPolarAlign.cached_solution.im_func
+        self.assertTrue(cached_solution(settings, self.img, self.wcs))
+        with open(self.wcs) as fle:
+            self.assertEqual(fle.read(), 'cached')
+
+    def test_touched_image(self):
+        from PPA import PhotoPolarAlign
+        settings = self.remember('solved')
+        # the image is copied back, or touched: newer than its .wcs, but
+        # the same picture
+        when = os.stat(self.wcs).st_mtime + 60.0
+        os.utime(self.img, (when, when))
+        happy_with = PhotoPolarAlign.happy_with.im_func
+        self.assertTrue(happy_with(settings, self.wcs, self.img))
+
+    def test_replaced_image(self):
+        from PPA import PhotoPolarAlign
+        settings = self.remember('solved')
+        happy_with = PhotoPolarAlign.happy_with.im_func
+        self.assertTrue(happy_with(settings, self.wcs, self.img))
+        # another frame of the same size put in its place, the old time
+        # kept (as copying tools do), so the .wcs still looks newer
+        sta = os.stat(self.img)
+        with open(self.img, 'wb') as fle:
+            fle.write('not really a JPEG')
+        os.utime(self.img, (sta.st_atime, sta.st_mtime))
+        self.assertTrue(os.stat(self.wcs).st_mtime > os.stat(
+            self.img).st_mtime)
+        self.assertFalse(happy_with(settings, self.wcs, self.img))
+
+    def test_owner_evicted(self):
+        self.write_wcs('solved')
+        key = self.cache.key(self.img, {'solver': 'nova'})
+        self.cache.store(key, self.wcs, ppa_cache.hash_of(self.img))
+        owner = self.cache.owner_path(self.wcs)
+        self.assertTrue(os.path.exists(owner))
+        self.cache.maxbytes = 0
+        self.cache.evict()
+        self.assertFalse(os.path.exists(owner))
+        self.assertEqual(self.cache.owner(self.wcs), None)
+
+    def test_hashed_once(self):
+        for solver in ('nova', 'local'):
+            self.cache.key(self.img, {'solver': solver})
+        JobJournal(os.path.join(self.tmpdir, 'journal.json')).key(
+            self.img, 'http://nova.astrometry.net/api/')
+        self.assertEqual(self.hashed, [self.img])
+
+
+if __name__ == '__main__':
+    unittest.main()
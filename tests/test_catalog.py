@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reference star catalog
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_catalog
+
+# a VizieR asu-tsv answer for Tycho-2, cut short
+TSV = '''#
+#   VizieR Astronomical Server vizier.cds.unistra.fr
+#INFO	votable-version=1.99+ (14-Oct-2013)
+#RESOURCE=yCat_1259
+
+TYC1	TYC2	TYC3	RAmdeg	DEmdeg	pmRA	pmDE	BTmag	VTmag	RAdeg	DEdeg
+ 	 	 	deg	deg	mas/yr	mas/yr	mag	mag	deg	deg
+----	-----	-	------------	------------	-------	-------	------	------	------------	------------
+4628	237	1	 37.95456067	+89.26410897	  +44.2	  -11.7	 2.662	 2.063	 37.95908345	+89.26410347
+9518	1081	1	317.19516396	-88.95649861	  +25.9	   +5.0	 5.727	 5.466	317.19612456	-88.95649721
+4627	1173	1	            	            	       	       	 9.215	 8.910	 12.3450010	+87.11100000
+
+'''
+
+
+def pole_rows(step=0.25, mag=8.0):
+    '''
+    rows of a Hipparcos-like CSV: stars step degrees apart out to 10
+    degrees from each Pole (and one row too far, one too faint)
+    '''
+    import numpy
+    rows = []
+    for sign in (1, -1):
+        for dist in numpy.arange(step, 10.0, step):
+            num = int(360.0*numpy.sin(numpy.radians(dist))/step) + 1
+            for ra in numpy.arange(num)*360.0/num:
+                rows.append({'HIP': str(len(rows) + 1), 'RAICRS': str(ra),
+                             'DEICRS': str(sign*(90.0 - dist)),
+                             'pmRA': '12.5', 'pmDE': str(sign*-3.0),
+                             'Vmag': str(mag), 'B-V': '0.6'})
+    rows.append({'HIP': '0', 'RAICRS': '10', 'DEICRS': '70', 'Vmag': '5'})
+    rows.append({'HIP': '0', 'RAICRS': '10', 'DEICRS': '88', 'Vmag': '12'})
+    return rows
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def build(self, rows):
+        import csv
+        csvfn = os.path.join(self.tmpdir, 'hip.csv')
+        catfn = os.path.join(self.tmpdir, 'refstars.dat')
+        with open(csvfn, 'wb') as fle:
+            wrt = csv.DictWriter(fle, ['HIP', 'RAICRS', 'DEICRS', 'pmRA',
+                                       'pmDE', 'Vmag', 'B-V'])
+            wrt.writeheader()
+            wrt.writerows(rows)
+        num = ppa_catalog.build_catalog(csvfn, catfn, 80.0, 9.0)
+        return num, ppa_catalog.read_catalog(catfn)
+
+    def test_narrow_fields(self):
+        rows = pole_rows()
+        num, cat = self.build(rows)
+        self.assertEqual(num, len(rows) - 2)
+        self.assertEqual(len(cat), num)
+        # a 200mm lens on an APS-C camera sees about 6 x 4 degrees; a
+        # field 1 degree across, anywhere near either Pole, has stars
+        for dec in (89.7, 88.0, 85.0, 81.0, -81.0, -85.0, -88.0, -89.7):
+            for ra in (0.0, 97.0, 181.0, 300.0):
+                idx = cat.near(ra, dec, 0.5)
+                self.assertTrue(len(idx) > 0, (ra, dec))
+                dist = distances(cat, idx, ra, dec)
+                self.assertTrue(dist.max() <= 0.5)
+
+    def test_proper_motions(self):
+        import numpy
+        num, cat = self.build(pole_rows(step=1.0))
+        for sign in (1, -1):
+            idx = cat.near(0.0, sign*90.0, 10.0)
+            self.assertTrue(len(idx) > 0)
+            self.assertTrue(numpy.all(cat.pmra[idx] == 12.5))
+            self.assertTrue(numpy.all(cat.pmdec[idx] == sign*-3.0))
+            # ten years on, the stars have moved by 30 mas in Dec
+            ten = ppa_catalog.J2000_UNIX + 10*365.25*86400.0
+            moved = cat.radec(idx, ten)[:, 1] - cat.dec[idx]
+            self.assertTrue(numpy.allclose(moved, sign*-3.0e-2/3600.0))
+
+    def test_vizier_answer(self):
+        stars = ppa_catalog.select_stars(ppa_catalog.read_tsv(
+            StringIO(TSV)), 80.0, 9.0)
+        # brightest first; the star without a mean position uses its
+        # observed one
+        self.assertEqual([star[7] for star in stars],
+                         ['TYC4628-237-1', 'TYC9518-1081-1',
+                          'TYC4627-1173-1'])
+        self.assertEqual(stars[1][2:6], (317.19516396, -88.95649861, 25.9,
+                                         5.0))
+        self.assertEqual(stars[2][2:4], (12.345001, 87.111))
+
+    @unittest.skipUnless(len(ppa_catalog.default_catalog()) > 1000,
+                         'refstars.dat is the seed catalog, see README')
+    def test_bundled_narrow_fields(self):
+        cat = ppa_catalog.default_catalog()
+        for dec in (89.0, 86.0, -86.0, -89.0):
+            for ra in (0.0, 120.0, 240.0):
+                self.assertTrue(len(cat.near(ra, dec, 0.5)) > 0, (ra, dec))
+
+
+def distances(cat, idx, ra, dec):
+    '''
+    the distances (degrees) of the stars idx from ra, dec
+    '''
+    import numpy
+    cen = ppa_catalog.unit_vectors([ra], [dec])[0]
+    return numpy.degrees(numpy.arccos(numpy.clip(
+        numpy.dot(cat.vecs[idx], cen), -1.0, 1.0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the alignment engine
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_engine
+from ppa_engine import AlignError
+
+
+def header(rot, axis=(1350.0, 1100.0), width=3000, height=2000, scale=20.0):
+    '''
+    the plate solution of a width x height frame of scale arcsec/pixel,
+    turned by rot degrees about the RA axis at pixel axis, 1 degree from
+    the North Pole
+    '''
+    from astropy.io import fits
+    ang = math.radians(rot)
+    sdeg = scale/3600.0
+    head = fits.Header()
+    head['CTYPE1'] = 'RA---TAN'
+    head['CTYPE2'] = 'DEC--TAN'
+    head['CRVAL1'] = 40.0
+    head['CRVAL2'] = 89.0
+    head['CRPIX1'] = axis[0]
+    head['CRPIX2'] = axis[1]
+    head['CD1_1'] = -sdeg*math.cos(ang)
+    head['CD1_2'] = sdeg*math.sin(ang)
+    head['CD2_1'] = sdeg*math.sin(ang)
+    head['CD2_2'] = sdeg*math.cos(ang)
+    head['IMAGEW'] = width
+    head['IMAGEH'] = height
+    head['COMMENT'] = 'scale: %f' % scale
+    head['COMMENT'] = 'parity: 1'
+    return head
+
+
+class TestRotation(unittest.TestCase):
+    '''
+    the RA axis is only found from frames turned about it
+    '''
+    def test_pair(self):
+        res = ppa_engine.solve_pair(header(0.0), header(90.0))
+        self.assertAlmostEqual(res.axis[0], 1350.0, 3)
+        self.assertAlmostEqual(res.axis[1], 1100.0, 3)
+
+    def test_pair_not_rotated(self):
+        for rot in (0.0, 0.01):
+            self.assertRaises(AlignError, ppa_engine.solve_pair,
+                              header(0.0), header(rot))
+
+    def test_frames(self):
+        res = ppa_engine.solve_frames([header(rot)
+                                       for rot in (0.0, 30.0, 60.0)])
+        self.assertAlmostEqual(res.axis[0], 1350.0, 3)
+        self.assertAlmostEqual(res.axis[1], 1100.0, 3)
+
+    def test_frames_not_rotated(self):
+        for rot in (0.0, 0.01):
+            self.assertRaises(AlignError, ppa_engine.solve_frames,
+                              [header(0.0), header(rot), header(rot)])
+
+    def test_frames_leave_out_unrotated_pairs(self):
+        res = ppa_engine.solve_frames([header(0.0), header(0.01),
+                                       header(60.0)])
+        self.assertAlmostEqual(res.axis[0], 1350.0, 3)
+        self.assertAlmostEqual(res.axis[1], 1100.0, 3)
+        self.assertEqual([used for i, j, resid, used in res.pairs],
+                         [False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of where the solvers are told to look
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import PPA
+from ppa_engine import AlignError, hemisphere, celestial_pole
+
+
+class Var(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class Settings(object):
+    '''
+    what position_hint needs of PhotoPolarAlign, before any solve
+    '''
+    def __init__(self, hemi):
+        self.restrict_position = Var(1)
+        self.vwcs_fn = self.hwcs_fn = self.iwcs_fn = '/nonexistent/v.wcs'
+        self.hemi = None
+        self.last_hemi = hemi
+
+
+class TestHint(unittest.TestCase):
+    def test_first_frame(self):
+        # every image the engine can use is inside the first search
+        for hemi, sign in (('N', 1.0), ('S', -1.0)):
+            ra, dec, radius = PPA.position_hint(Settings(hemi), 'v')
+            pole = celestial_pole(hemi)[0]
+            self.assertEqual((ra, dec), (pole[0], pole[1]))
+            edge = sign*(90.0 - radius)
+            self.assertEqual(hemisphere(edge + sign*0.01,
+                                        edge + sign*0.01), hemi)
+            self.assertRaises(AlignError, hemisphere, edge - sign*0.01,
+                              edge - sign*0.01)
+
+    def test_off(self):
+        settings = Settings('N')
+        settings.restrict_position = Var(0)
+        self.assertEqual(PPA.position_hint(settings, 'v'), None)
+        self.assertEqual(PPA.position_hint(Settings(None), 'v'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Pole index sets: which healpix tiles reach the Poles
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_index
+from ppa_index import reaches_pole
+
+
+def tile(base, xxx, yyy, nside):
+    '''
+    astrometry.net's number of a healpix tile
+    '''
+    return base*nside*nside + xxx*nside + yyy
+
+
+class TestTiles(unittest.TestCase):
+    def test_base_tiles(self):
+        # the polar base tiles have a corner on their Pole
+        for base in range(12):
+            self.assertEqual(reaches_pole(base, 1), base < 4 or base >= 8,
+                             base)
+            self.assertEqual(reaches_pole(base, 1, 89.99),
+                             base < 4 or base >= 8, base)
+
+    def test_near_the_pole(self):
+        for nside in (1, 2, 4, 8):
+            top = nside - 1
+            for base in range(4):
+                # North: the tile x = y = nside - 1 has the Pole
+                self.assertTrue(reaches_pole(tile(base, top, top, nside),
+                                             nside, 89.99))
+                # South: the tile x = y = 0
+                self.assertTrue(reaches_pole(tile(base + 8, 0, 0, nside),
+                                             nside, 89.99))
+                if nside > 1:
+                    # and the far corners of the base tiles don't
+                    self.assertFalse(reaches_pole(tile(base, 0, 0, nside),
+                                                  nside))
+                    self.assertFalse(reaches_pole(
+                        tile(base + 8, top, top, nside), nside))
+
+    def test_boundary(self):
+        # with nside 2 the tiles next to the polar ones reach
+        # sin(Dec) = 1 - 1/12, Dec 66.44 degrees
+        edge = math.degrees(math.asin(1.0 - 1.0/12))
+        for base in range(4):
+            for xxx, yyy in ((0, 1), (1, 0)):
+                north = tile(base, xxx, yyy, 2)
+                south = tile(base + 8, 1 - xxx, 1 - yyy, 2)
+                for hpx in (north, south):
+                    self.assertTrue(reaches_pole(hpx, 2, edge - 0.01), hpx)
+                    self.assertFalse(reaches_pole(hpx, 2, edge + 0.01), hpx)
+
+    def test_equator(self):
+        for nside in (1, 2, 4):
+            for hpx in range(4*nside*nside, 8*nside*nside):
+                self.assertFalse(reaches_pole(hpx, nside))
+
+    def test_counts(self):
+        # the tiles around each Pole are the same, and fewer the further in
+        for nside in (2, 4, 8):
+            last = None
+            for min_dec in (50.0, 65.0, 80.0, 89.0):
+                north = [hpx for hpx in range(4*nside*nside)
+                         if reaches_pole(hpx, nside, min_dec)]
+                south = [hpx for hpx in range(8*nside*nside, 12*nside*nside)
+                         if reaches_pole(hpx, nside, min_dec)]
+                self.assertEqual(len(north), len(south))
+                self.assertTrue(len(north) >= 4)
+                if last is not None:
+                    self.assertTrue(len(north) <= last)
+                last = len(north)
+
+
+class TestSelect(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def touch(self, name):
+        fn = os.path.join(self.tmpdir, name)
+        open(fn, 'w').close()
+        return fn
+
+    def test_select(self):
+        # index files known only by name: 4203 in 48 tiles (nside 2), all
+        # sky 4210, and scales a 1"/pixel image doesn't need
+        tiles = [self.touch('index-4203-%02d.fits' % hpx)
+                 for hpx in range(48)]
+        allsky = self.touch('index-4210.fits')
+        self.touch('index-4219.fits')
+        self.touch('index-4202-00.fits')
+        fns = ppa_index.find_indexes([self.tmpdir])
+        kept = ppa_index.select(fns, 1.0, 5184, 3456)
+        want = [tiles[tile(base, xxx, yyy, 2)] for base in range(4)
+                for xxx, yyy in ((0, 1), (1, 0), (1, 1))]
+        want = want + [tiles[tile(base, xxx, yyy, 2)] for base in range(8, 12)
+                       for xxx, yyy in ((0, 0), (0, 1), (1, 0))]
+        self.assertEqual(sorted(kept), sorted(want + [allsky]))
+        # further in, only the tiles with the Poles on them
+        kept = ppa_index.select(fns, 1.0, 5184, 3456, 80.0)
+        want = [tiles[tile(base, 1, 1, 2)] for base in range(4)]
+        want = want + [tiles[tile(base, 0, 0, 2)] for base in range(8, 12)]
+        self.assertEqual(sorted(kept), sorted(want + [allsky]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the job journal: resuming nova solves after an interruption
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from ppa_journal import JobJournal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        self.fn = os.path.join(self.tmpdir, 'journal.json')
+        self.img = os.path.join(self.tmpdir, 'v.jpg')
+        with open(self.img, 'wb') as fle:
+            fle.write('not really a jpeg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def cut_short(self, drop):
+        '''
+        as if PPA died while writing the last drop bytes of the journal
+        '''
+        with open(self.fn, 'rb') as fle:
+            text = fle.read()
+        with open(self.fn, 'wb') as fle:
+            fle.write(text[:-drop])
+
+    def test_truncated(self):
+        jnl = JobJournal(self.fn)
+        jnl.put('a', subid=1, state='submitted')
+        jnl.put('b', subid=2, state='submitted')
+        jnl.put('a', jobid=11, state='solving')
+        jnl.drop('b')
+        jnl.put('c', subid=3, state='submitted')
+        self.cut_short(10)
+        again = JobJournal(self.fn)
+        # the last change is lost, the others replayed
+        self.assertEqual(sorted(again.entries), ['a'])
+        self.assertEqual(again.get('a')['jobid'], 11)
+        self.assertEqual(again.get('a')['state'], 'solving')
+        # and the journal goes on from there, the damage cleared away
+        again.put('d', subid=4, state='submitted')
+        self.assertEqual(sorted(JobJournal(self.fn).entries), ['a', 'd'])
+        with open(self.fn) as fle:
+            self.assertEqual(len(fle.readlines()), 2)
+
+    def test_old_journal(self):
+        import json
+        import time
+        with open(self.fn, 'w') as fle:
+            json.dump({'a': {'subid': 1, 'jobid': None, 'when': time.time(),
+                             'state': 'submitted'},
+                       'old': {'subid': 2, 'jobid': 7, 'when': 0.0,
+                               'state': 'solving'}}, fle)
+        jnl = JobJournal(self.fn)
+        self.assertEqual(sorted(jnl.entries), ['a'])
+
+    def test_resume_polls(self):
+        from ppa_fakenova import FakeNova, FakeNovaServer
+        from ppa_nova import NovaClient
+        nova = FakeNova(solutions={'v.jpg': 'SIMPLE  =  T'}, queue_delay=0.0,
+                        solve_time=0.0)
+        server = FakeNovaServer(nova, port=0)
+        server.start()
+        clnt = NovaClient(server.api_url())
+        wcsfn = os.path.join(self.tmpdir, 'v.wcs')
+        old = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            clnt.login('fake')
+            # PPA uploaded the image, then died writing the journal
+            subid = nova.upload({}, 'v.jpg')['subid']
+            jnl = JobJournal(self.fn)
+            key = jnl.key(self.img, clnt.apiurl)
+            jnl.put(key, subid=subid, state='submitted')
+            jnl.put('other', subid=99, state='submitted')
+            self.cut_short(5)
+            jnl = JobJournal(self.fn)
+            self.assertEqual(jnl.get(key)['subid'], subid)
+            clnt.solve(self.img, wcsfn, journal=jnl, first=0.01,
+                       longest=0.05, deadline=10.0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = old
+            clnt.transport.close()
+            server.shutdown()
+            server.server_close()
+        # polled the same submission, no second upload
+        self.assertEqual(nova.stats['uploads'], 1)
+        self.assertTrue(os.path.exists(wcsfn))
+        self.assertEqual(JobJournal(self.fn).get(key), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the nova.astrometry.net client, against the stand-in server
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_nova
+from ppa_fakenova import FakeNova, FakeNovaServer
+from ppa_nova import NovaClient, RequestError, TransportError
+from ppa_nova import Cancelled, PollTimeout, SolveFailed, poll
+from ppa_nova import MultipartFile
+
+
+class Clock(object):
+    '''
+    the time, as poll() sees it; sleeping moves it on
+    '''
+    def __init__(self):
+        self.now = 1000.0
+        self.waits = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.waits.append(secs)
+        self.now = self.now + secs
+
+
+class Answers(NovaClient):
+    '''
+    a client whose status requests get canned answers (or raise them)
+    '''
+    def __init__(self, answers):
+        NovaClient.__init__(self, 'http://127.0.0.1:1/api/')
+        self.answers = answers
+        self.asked = 0
+
+    def send_request(self, service, args=None, file_args=None,
+                     relogin=True, progress=None):
+        ans = self.answers[min(self.asked, len(self.answers) - 1)]
+        self.asked = self.asked + 1
+        if isinstance(ans, Exception):
+            raise ans
+        return ans
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.nova = FakeNova(solutions={'vert.JPG': 'SIMPLE  =  T'},
+                             queue_delay=0.0, solve_time=0.0, seed=3)
+        self.server = FakeNovaServer(self.nova, port=0)
+        self.server.start()
+        self.clnt = NovaClient(self.server.api_url())
+
+    def tearDown(self):
+        self.clnt.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_dropped_fresh_connection(self):
+        self.nova.drop_rate = 1.0
+        self.assertRaises(TransportError, self.clnt.login, 'fake')
+        self.assertEqual(self.clnt.transport.opened, 1)
+        self.assertEqual(self.clnt.transport.idle, [])
+
+    def test_dropped_idle_connection(self):
+        self.clnt.login('fake')
+        self.assertEqual(len(self.clnt.transport.idle), 1)
+        # the pooled connection, then a fresh one, are dropped
+        self.nova.drop_rate = 1.0
+        self.assertRaises(TransportError, self.clnt.myjobs)
+        self.assertEqual(self.clnt.transport.opened, 2)
+        self.assertEqual(self.nova.stats['dropped'], 2)
+        # and the next request gets through on a new connection
+        self.nova.drop_rate = 0.0
+        self.assertEqual(self.clnt.myjobs(), [])
+
+    def test_load_with_drops(self):
+        from ppa_fakenova import LOAD_IMAGE, load_test
+        image = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), LOAD_IMAGE)
+        self.nova.drop_rate = 0.05
+        self.nova.error_rate = 0.05
+        old = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            res = load_test(self.server.api_url(), image, submissions=10,
+                            concurrency=5, first=0.01, longest=0.05,
+                            deadline=10.0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = old
+        self.assertTrue(self.nova.stats['dropped'] > 0)
+        # whatever went wrong, the client says so with a RequestError
+        for name in res['failed']:
+            self.assertTrue(issubclass(getattr(ppa_nova, name),
+                                       RequestError), name)
+
+
+class TestMultipart(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        fdes, self.fne = tempfile.mkstemp(suffix='.jpg', prefix='ppa_test_')
+        os.close(fdes)
+        # bytes that look like the boundary and line ends, and an odd size
+        self.data = ''.join([chr(i % 256) for i in range(10007)])
+        self.data = self.data + '\r\n--===============\r\n'
+        with open(self.fne, 'wb') as fle:
+            fle.write(self.data)
+
+    def tearDown(self):
+        os.remove(self.fne)
+
+    def test_length_and_body(self):
+        from ppa_fakenova import _request_json
+        for size in (1, 7, 4096, 64*1024):
+            seen = []
+            body = MultipartFile('{"session": "x"}', self.fne,
+                                 lambda sent, total: seen.append(sent))
+            body.chunk_size = size
+            streamed = ''.join(body.chunks())
+            # Content-Length is what is sent
+            self.assertEqual(body.length, len(streamed))
+            # and it is the body we would have made in memory
+            self.assertEqual(streamed, body.head + self.data + body.tail)
+            self.assertEqual(seen[-1], len(self.data))
+            self.assertEqual(len(seen), (len(self.data) + size - 1)//size)
+            args, fname = _request_json(body.content_type, streamed)
+            self.assertEqual(args, {'session': 'x'})
+            self.assertEqual(fname, os.path.basename(self.fne))
+
+    def test_upload(self):
+        # the server gets it all, over a kept-alive connection
+        received = []
+        nova = FakeNova(solutions={}, seed=1)
+        server = FakeNovaServer(nova, port=0)
+        server.start()
+        clnt = NovaClient(server.api_url())
+        try:
+            def upload(args, fname):
+                received.append(fname)
+                return {'status': 'success', 'subid': 1}
+            nova.upload = upload
+            clnt.login('fake')
+            self.assertEqual(clnt.upload(self.fne)['subid'], 1)
+            self.assertEqual(clnt.myjobs(), [])
+        finally:
+            clnt.transport.close()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(received, [os.path.basename(self.fne)])
+        self.assertEqual(clnt.transport.opened, 1)
+
+
+class TestPoll(unittest.TestCase):
+    def test_backoff(self):
+        clock = Clock()
+        self.assertRaises(PollTimeout, poll, lambda: None, first=1.0,
+                          factor=2.0, longest=8.0, jitter=0.2,
+                          deadline=100.0, sleep=clock.sleep,
+                          clock=clock.time)
+        # 1, 2, 4, 8, 8, ... each give or take 20%
+        for i, wait in enumerate(clock.waits[:-1]):
+            want = min(2.0**i, 8.0)
+            self.assertTrue(0.8*want <= wait <= 1.2*want, (i, wait))
+        self.assertTrue(clock.waits[1] > clock.waits[0])
+        self.assertTrue(clock.waits[3] > clock.waits[2])
+        self.assertTrue(max(clock.waits) <= 8.0*1.2)
+
+    def test_deadline(self):
+        clock = Clock()
+        checks = []
+
+        def check():
+            checks.append(clock.now)
+        self.assertRaises(PollTimeout, poll, check, first=3.0, longest=3.0,
+                          jitter=0.0, deadline=10.0, sleep=clock.sleep,
+                          clock=clock.time)
+        # the last wait is cut short, we give up right at the deadline
+        self.assertEqual(clock.waits, [3.0, 3.0, 3.0, 1.0])
+        self.assertEqual(clock.now, 1010.0)
+        self.assertEqual(checks, [1000.0, 1003.0, 1006.0, 1009.0, 1010.0])
+
+    def test_answer(self):
+        clock = Clock()
+        answers = [None, None, 'solved']
+        self.assertEqual(poll(lambda: answers.pop(0), sleep=clock.sleep,
+                              clock=clock.time), 'solved')
+        self.assertEqual(len(clock.waits), 2)
+
+    def test_cancel(self):
+        clock = Clock()
+        checks = []
+        self.assertRaises(Cancelled, poll, lambda: checks.append(1),
+                          cancel=lambda: len(checks) == 3,
+                          sleep=clock.sleep, clock=clock.time)
+        self.assertEqual(len(checks), 3)
+        self.assertEqual(len(clock.waits), 3)
+
+
+class TestWait(unittest.TestCase):
+    def wait(self, clnt, how, ident):
+        clock = Clock()
+        return getattr(clnt, how)(ident, first=1.0, deadline=900.0,
+                                  sleep=clock.sleep, clock=clock.time)
+
+    def test_hiccups(self):
+        clnt = Answers([None, TransportError('dropped'), {'jobs': []},
+                        {'jobs': [None, 7]}])
+        self.assertEqual(self.wait(clnt, 'wait_for_job', 3), 7)
+        clnt = Answers([TransportError('dropped'), None,
+                        {'status': 'solving'}, {'status': 'success'}])
+        self.assertEqual(self.wait(clnt, 'wait_for_result', 7), 'success')
+        self.assertEqual(clnt.asked, 4)
+
+    def test_rejected(self):
+        for answer in ({'jobs': [], 'error_message': 'not an image'},
+                       {'jobs': [], 'processing_finished':
+                        '2014-12-06 22:01:02'}):
+            clnt = Answers([{'jobs': []}, answer])
+            self.assertRaises(SolveFailed, self.wait, clnt, 'wait_for_job',
+                              3)
+            self.assertEqual(clnt.asked, 2)
+        clnt = Answers([{'status': 'failure'}])
+        self.assertRaises(SolveFailed, self.wait, clnt, 'wait_for_result', 7)
+
+    def test_errors(self):
+        # send_request gives None for an HTTP error
+        clnt = Answers([None])
+        self.assertRaises(RequestError, clnt.myjobs)
+        self.assertEqual(clnt.job_status(7), None)
+        self.assertEqual(clnt.sub_status(3), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
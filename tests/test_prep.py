@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the image preparation: plate solutions of binned images
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_prep
+
+
+def binned_header(factor):
+    '''
+    a nova-like TAN-SIP solution of an image of 5184 x 3456 pixels,
+    binned by factor
+    '''
+    from astropy.io import fits
+    head = fits.Header()
+    head['CTYPE1'] = 'RA---TAN-SIP'
+    head['CTYPE2'] = 'DEC--TAN-SIP'
+    head['CRVAL1'] = 37.95
+    head['CRVAL2'] = 88.3
+    head['CRPIX1'] = 2592.0/factor + 17.3
+    head['CRPIX2'] = 1728.0/factor - 9.6
+    scale = factor*4.2/3600.0
+    head['CD1_1'] = -scale*0.8
+    head['CD1_2'] = scale*0.6
+    head['CD2_1'] = -scale*0.6
+    head['CD2_2'] = -scale*0.8
+    head['IMAGEW'] = 5184//factor
+    head['IMAGEH'] = 3456//factor
+    # a noticeable distortion at the corners, in binned pixels
+    head['A_ORDER'] = 3
+    head['B_ORDER'] = 3
+    head['AP_ORDER'] = 3
+    head['BP_ORDER'] = 3
+    sip = {(2, 0): 3e-6, (1, 1): -2e-6, (0, 2): 1e-6, (3, 0): 4e-10,
+           (2, 1): -1e-10, (0, 3): 2e-10}
+    for (ppp, qqq), val in sip.items():
+        head['A_%d_%d' % (ppp, qqq)] = val*factor**(ppp + qqq - 1)
+        head['B_%d_%d' % (qqq, ppp)] = -val*factor**(ppp + qqq - 1)
+        head['AP_%d_%d' % (ppp, qqq)] = -val*factor**(ppp + qqq - 1)
+        head['BP_%d_%d' % (qqq, ppp)] = val*factor**(ppp + qqq - 1)
+    head['COMMENT'] = 'scale: %g arcsec/pix' % (factor*4.2)
+    return head
+
+
+class TestRescale(unittest.TestCase):
+    def test_same_sky(self):
+        import numpy
+        from astropy.wcs import WCS
+        for factor in (2, 3, 4):
+            binned = binned_header(factor)
+            full = ppa_prep.rescale_header(binned.copy(), factor, 5184,
+                                           3456)
+            wcsb = WCS(binned)
+            wcsf = WCS(full)
+            # the centres of binned pixels, corners and middle included
+            pix = numpy.array([[1.0, 1.0], [5184.0/factor, 1.0],
+                               [1.0, 3456.0/factor],
+                               [5184.0/factor, 3456.0/factor],
+                               [1000.0/factor, 2000.0/factor],
+                               [binned['CRPIX1'], binned['CRPIX2']]])
+            fpix = factor*(pix - 0.5) + 0.5
+            skyb = wcsb.all_pix2world(pix, 1)
+            skyf = wcsf.all_pix2world(fpix, 1)
+            diff = (skyb - skyf)*3600.0
+            diff[:, 0] = diff[:, 0]*numpy.cos(numpy.radians(skyb[:, 1]))
+            # within a hundredth of an arc second
+            self.assertTrue(numpy.abs(diff).max() < 0.01, (factor, diff))
+            # the distortion is there, and is rescaled with the pixels
+            lin = wcsf.wcs_pix2world(fpix, 1)
+            self.assertTrue(numpy.abs(lin - skyf).max()*3600.0 > 1.0)
+
+    def test_back_to_pixels(self):
+        import numpy
+        from astropy.wcs import WCS
+        factor = 4
+        full = WCS(ppa_prep.rescale_header(binned_header(factor), factor,
+                                           5184, 3456))
+        pix = numpy.array([[1.0, 1.0], [5184.0, 3456.0], [2000.0, 700.0]])
+        back = full.all_world2pix(full.all_pix2world(pix, 1), 1)
+        self.assertTrue(numpy.abs(back - pix).max() < 1e-3)
+
+    def test_sizes_and_scale(self):
+        head = ppa_prep.rescale_header(binned_header(4), 4, 5184, 3456)
+        self.assertEqual((head['IMAGEW'], head['IMAGEH']), (5184, 3456))
+        self.assertEqual(head['COMMENT'][0], 'scale: 4.2 arcsec/pix')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of loading the region of an image around the Pole
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import PPA
+
+
+class TestRegion(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import numpy
+        from PIL import Image
+        cls.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        yys, xxs = numpy.mgrid[0:3000, 0:4000]
+        # smooth, so that a reduced decode is close to a binned one
+        arr = numpy.dstack([(xxs//16) % 256, (yys//16) % 256,
+                            ((xxs + yys)//32) % 256]).astype(numpy.uint8)
+        cls.full = arr
+        cls.jpeg = os.path.join(cls.tmpdir, 'v.jpg')
+        cls.png = os.path.join(cls.tmpdir, 'v.png')
+        Image.fromarray(arr).save(cls.jpeg, quality=95)
+        Image.fromarray(arr).save(cls.png)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def check(self, fn, box, want):
+        import numpy
+        region, reduce, origin = PPA.load_region(fn, box, 800)
+        self.assertEqual(reduce, want)
+        self.assertEqual(origin, (box[0], box[1]))
+        self.assertEqual(region.size, ((box[2] - box[0])//want,
+                                       (box[3] - box[1])//want))
+        # the same part of the image
+        crop = self.full[box[1]:box[3], box[0]:box[2]].astype(float)
+        crop = crop[:region.size[1]*want, :region.size[0]*want]
+        binned = crop.reshape(region.size[1], want, region.size[0], want,
+                              3).mean(axis=(1, 3))
+        diff = numpy.abs(numpy.asarray(region, float) - binned)
+        self.assertTrue(numpy.median(diff) < 3.0, (fn, box, diff.mean()))
+
+    def test_reduced(self):
+        # a box that, halved, still fills the window
+        self.check(self.jpeg, (1024, 512, 2624, 1712), 2)
+        self.check(self.jpeg, (0, 0, 4000, 3000), 4)
+
+    def test_full_scale(self):
+        # a box smaller than that is shown at full scale
+        self.check(self.jpeg, (1600, 1200, 2800, 1800), 1)
+        self.check(self.jpeg, (100, 200, 500, 520), 1)
+        # and other formats always are
+        self.check(self.png, (1024, 512, 2624, 1712), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
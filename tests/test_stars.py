@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the star extraction
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_stars
+
+# x, y (0-based array indices) of the sharp stars and of the out of
+# focus ones (rings, as a long lens gives)
+SHARP = [(60.0, 50.0), (300.0, 80.0), (180.0, 220.0)]
+RINGS = [(120.0, 150.0), (330.0, 230.0)]
+
+
+def frame(wid=400, hei=300, seed=1):
+    '''
+    a noisy sky with the stars of SHARP and RINGS, as load_gray gives
+    '''
+    import numpy
+    rng = numpy.random.RandomState(seed)
+    img = 100.0 + rng.normal(0.0, 3.0, (hei, wid))
+    yys, xxs = numpy.mgrid[0:hei, 0:wid]
+    for xxx, yyy in SHARP:
+        img += 120.0*numpy.exp(-((xxs - xxx)**2 + (yys - yyy)**2)/4.0)
+    for xxx, yyy in RINGS:
+        dist = numpy.hypot(xxs - xxx, yys - yyy)
+        # brighter in three places, so the ring has several peaks
+        side = 1.0 + 0.3*numpy.cos(3*numpy.arctan2(yys - yyy, xxs - xxx))
+        img += 25.0*side*numpy.exp(-(dist - 9.0)**2/8.0)
+    return img.astype(numpy.float32)
+
+
+class TestStars(unittest.TestCase):
+    def test_one_detection_per_star(self):
+        import numpy
+        stars = ppa_stars.find_stars(frame())
+        self.assertEqual(len(stars), len(SHARP) + len(RINGS))
+        for xxx, yyy in SHARP:
+            dist = numpy.hypot(stars[:, 0] - 1 - xxx, stars[:, 1] - 1 - yyy)
+            self.assertTrue(dist.min() < 0.5)
+        for xxx, yyy in RINGS:
+            dist = numpy.hypot(stars[:, 0] - 1 - xxx, stars[:, 1] - 1 - yyy)
+            self.assertEqual((dist < 20).sum(), 1)
+
+    def test_in_place(self):
+        import numpy
+        img = frame()
+        before = img.copy()
+        ppa_stars.find_stars(img)
+        # background subtracted and smoothed, not copied
+        self.assertEqual(img.dtype, numpy.float32)
+        self.assertTrue(abs(numpy.median(img)) < 1.0)
+        self.assertTrue(img.std() < before.std())
+
+    def test_smooth(self):
+        import numpy
+        img = frame(wid=50, hei=200)
+        want = img.copy()
+        want[1:-1, 1:-1] = sum([img[1 + dy:img.shape[0] - 1 + dy,
+                                    1 + dx:img.shape[1] - 1 + dx]
+                                for dy in (-1, 0, 1)
+                                for dx in (-1, 0, 1)])/9.0
+        ppa_stars.smooth(img, rows=16)
+        self.assertTrue(numpy.allclose(img[1:-1, 1:-1], want[1:-1, 1:-1],
+                                       atol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
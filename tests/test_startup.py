@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the startup: the heavy imports must not hold up the window
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import PPA
+from PPA import PhotoPolarAlign
+
+# how long (seconds) each of the heavy modules of the test takes to import
+SLOW = 0.5
+
+
+class Window(object):
+    '''
+    what warm_up needs of PhotoPolarAlign: its idle callbacks, which we
+    run ourselves
+    '''
+    def __init__(self):
+        self.idle = []
+
+    def after_idle(self, func, *args):
+        self.idle.append((func, args))
+
+    def warm_up(self, *args):
+        return PhotoPolarAlign.warm_up.im_func(self, *args)
+
+
+class TestWarmUp(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        for name in ('ppa_test_heavy1', 'ppa_test_heavy2'):
+            with open(os.path.join(self.tmpdir, name + '.py'), 'w') as fle:
+                fle.write('import time\ntime.sleep(%r)\n' % SLOW)
+        with open(os.path.join(self.tmpdir, 'ppa_test_light.py'),
+                  'w') as fle:
+            fle.write('\n')
+        sys.path.insert(0, self.tmpdir)
+        self.heavy = PPA.HEAVY_MODULES
+        PPA.HEAVY_MODULES = ['ppa_test_heavy1', 'ppa_test_heavy2']
+
+    def tearDown(self):
+        PPA.HEAVY_MODULES = self.heavy
+        sys.path.remove(self.tmpdir)
+        for name in ('ppa_test_heavy1', 'ppa_test_heavy2',
+                     'ppa_test_light'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_import_during_warm_up(self):
+        win = Window()
+        threads = threading.active_count()
+        win.warm_up()
+        # an import by the window, say a button's, doesn't wait for it
+        # (were the warm-up in a thread, by now it would be importing)
+        time.sleep(SLOW/5)
+        start = time.time()
+        __import__('ppa_test_light')
+        self.assertTrue(time.time() - start < SLOW/5)
+        # one module imported, the other waits for the window to be idle
+        self.assertTrue('ppa_test_heavy1' in sys.modules)
+        self.assertFalse('ppa_test_heavy2' in sys.modules)
+        self.assertEqual(len(win.idle), 1)
+        self.assertEqual(threading.active_count(), threads)
+        # the rest, as the window would
+        while win.idle:
+            func, args = win.idle.pop(0)
+            func(*args)
+        self.assertTrue('ppa_test_heavy2' in sys.modules)
+        self.assertEqual(PPA.STARTUP[-1][0], 'heavy imports')
+
+
+if __name__ == '__main__':
+    unittest.main()
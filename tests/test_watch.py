@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the capture folder watch
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from ppa_watch import FolderWatch
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        self.write('old.jpg', 'x'*100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, name, data, mode='wb', when=None):
+        fn = os.path.join(self.tmpdir, name)
+        with open(fn, mode) as fle:
+            fle.write(data)
+        if when is not None:
+            os.utime(fn, (when, when))
+        return fn
+
+    def test_growing(self):
+        watch = FolderWatch(self.tmpdir, settle=1.0)
+        self.assertEqual(watch.poll(100.0), [])
+        # the camera starts writing: an empty file, then more and more
+        new = self.write('new.jpg', '')
+        self.assertEqual(watch.poll(100.5), [])
+        for step in range(5):
+            self.write('new.jpg', 'y'*1000, 'ab')
+            self.assertEqual(watch.poll(101.0 + step), [], step)
+        # unchanged, but not for long enough yet
+        self.assertEqual(watch.poll(105.5), [])
+        self.assertEqual(watch.poll(106.0), [new])
+        # once only, and the images that were there are never new
+        self.assertEqual(watch.poll(110.0), [])
+        self.assertEqual(os.path.getsize(new), 5000)
+
+    def test_same_size(self):
+        # rewritten in place: the same size, a later mtime
+        watch = FolderWatch(self.tmpdir, settle=1.0)
+        new = self.write('new.jpg', 'a'*10, when=1000.0)
+        self.assertEqual(watch.poll(100.0), [])
+        self.write('new.jpg', 'b'*10, when=1001.0)
+        self.assertEqual(watch.poll(100.9), [])
+        self.assertEqual(watch.poll(101.5), [])
+        self.assertEqual(watch.poll(101.9), [new])
+
+    def test_oldest_first_and_gone(self):
+        watch = FolderWatch(self.tmpdir, settle=0.0)
+        second = self.write('b.JPG', 'b', when=2000.0)
+        first = self.write('c.jpeg', 'c', when=1000.0)
+        gone = self.write('a.jpg', 'a', when=1500.0)
+        self.write('notes.txt', 'not an image')
+        self.assertEqual(watch.poll(100.0), [])
+        os.remove(gone)
+        self.assertEqual(watch.poll(100.0), [first, second])
+        self.assertEqual(watch.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the plate solution records and their sidecar index
+
+@author: Themos Tsikas, Jack Richmond
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ppa_wcs
+from ppa_wcs import WcsIndex, parse_header
+
+
+def nova_header():
+    '''
+    a header as nova.astrometry.net's .wcs files have it
+    '''
+    from astropy.io import fits
+    head = fits.Header()
+    head['WCSAXES'] = 2
+    head['CTYPE1'] = 'RA---TAN-SIP'
+    head['CTYPE2'] = 'DEC--TAN-SIP'
+    head['EQUINOX'] = 2000.0
+    head['LONPOLE'] = 180.0
+    head['LATPOLE'] = 0.0
+    head['CRVAL1'] = 37.95
+    head['CRVAL2'] = 88.3
+    head['CRPIX1'] = 2610.5
+    head['CRPIX2'] = 1702.25
+    head['CUNIT1'] = 'deg'
+    head['CUNIT2'] = 'deg'
+    head['CD1_1'] = -9.3e-4
+    head['CD1_2'] = 7.0e-4
+    head['CD2_1'] = -7.0e-4
+    head['CD2_2'] = -9.3e-4
+    head['IMAGEW'] = 5184
+    head['IMAGEH'] = 3456
+    head['A_ORDER'] = 2
+    head['A_2_0'] = 3e-7
+    head['A_1_1'] = -1e-7
+    head['B_ORDER'] = 2
+    head['B_0_2'] = 2e-7
+    head['COMMENT'] = 'scale: 4.19 arcsec/pix'
+    head['COMMENT'] = 'parity: 0'
+    return head
+
+
+def astroart_header():
+    '''
+    a header as AstroArt writes it: CDELT and CROTA2, NAXIS sizes
+    '''
+    from astropy.io import fits
+    head = fits.Header()
+    head['NAXIS'] = 2
+    head['NAXIS1'] = 3000
+    head['NAXIS2'] = 2000
+    head['CTYPE1'] = 'RA---TAN'
+    head['CTYPE2'] = 'DEC--TAN'
+    head['CRVAL1'] = 316.0
+    head['CRVAL2'] = -88.9
+    head['CRPIX1'] = 1500.5
+    head['CRPIX2'] = 1000.5
+    head['CDELT1'] = -2.0e-3
+    head['CDELT2'] = 2.0e-3
+    head['CROTA2'] = 33.0
+    return head
+
+
+class TestRecord(unittest.TestCase):
+    def test_nova(self):
+        rec = parse_header(nova_header())
+        self.assertEqual(rec.scale, 4.19)
+        self.assertEqual(rec.parity, 0)
+        self.assertEqual(rec.dec, 88.3)
+        self.assertEqual(rec.size(), (5184, 3456))
+        self.assertEqual(rec.crpix, [2610.5, 1702.25])
+        self.assertEqual(rec.cd, [[-9.3e-4, 7.0e-4], [-7.0e-4, -9.3e-4]])
+        self.assertEqual(sorted(dict(rec.sip)), ['A_1_1', 'A_2_0', 'A_ORDER',
+                                                 'B_0_2', 'B_ORDER'])
+        self.assertEqual(dict(rec.extra)['LONPOLE'], 180.0)
+
+    def test_astroart(self):
+        rec = parse_header(astroart_header())
+        self.assertEqual(rec.size(), (3000, 2000))
+        self.assertAlmostEqual(rec.scale, 7.2)
+        self.assertEqual(rec.parity, 1)
+
+    def test_same_sky(self):
+        import numpy
+        from astropy.wcs import WCS
+        pix = numpy.array([[1.0, 1.0], [3000.0, 2000.0], [2100.0, 300.0],
+                           [5184.0, 3456.0]])
+        for head in (nova_header(), astroart_header()):
+            rec = parse_header(head)
+            want = WCS(head).all_pix2world(pix, 1)
+            got = rec.wcs().all_pix2world(pix, 1)
+            self.assertTrue(numpy.abs(want - got).max() < 1e-9)
+
+    def test_round_trip(self):
+        import json
+        rec = parse_header(nova_header())
+        again = ppa_wcs.WcsRecord.from_dict(json.loads(json.dumps(
+            rec.as_dict())))
+        self.assertEqual(again.as_dict(), json.loads(json.dumps(
+            rec.as_dict())))
+        self.assertEqual(str(again.wcs().wcs.ctype[0]), 'RA---TAN-SIP')
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ppa_test_')
+        self.wcs = os.path.join(self.tmpdir, 'v.wcs')
+        self.index = os.path.join(self.tmpdir, ppa_wcs.INDEX_FN)
+        self.write(nova_header())
+        self.parsed = []
+        self.parse_header = ppa_wcs.parse_header
+
+        def parse_header(head):
+            self.parsed.append(head['CRVAL2'])
+            return self.parse_header(head)
+        ppa_wcs.parse_header = parse_header
+        ppa_wcs._INDEXES.clear()
+
+    def tearDown(self):
+        ppa_wcs.parse_header = self.parse_header
+        ppa_wcs._INDEXES.clear()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, head, when=None):
+        from astropy.io import fits
+        fits.PrimaryHDU(header=head).writeto(self.wcs, overwrite=True)
+        if when is not None:
+            os.utime(self.wcs, (when, when))
+
+    def fresh_record(self):
+        '''
+        the record, as a new run of PPA gets it (from the sidecar)
+        '''
+        index = WcsIndex(self.tmpdir)
+        rec = index.record(self.wcs)
+        index.save()
+        return rec
+
+    def test_parsed_once(self):
+        import json
+        rec = ppa_wcs.read_record(self.wcs)
+        self.assertTrue(os.path.exists(self.index))
+        self.assertEqual(self.fresh_record().as_dict(),
+                         json.loads(json.dumps(rec.as_dict())))
+        self.assertEqual(self.fresh_record().scale, 4.19)
+        self.assertEqual(self.parsed, [88.3])
+
+    def test_stale(self):
+        self.fresh_record()
+        when = os.stat(self.wcs).st_mtime
+        # solved again: same size, other contents, later
+        head = nova_header()
+        head['CRVAL2'] = 88.4
+        self.write(head, when + 10.0)
+        self.assertEqual(self.fresh_record().dec, 88.4)
+        # changed, but the same mtime: the size tells
+        head['COMMENT'] = 'a longer header, another block of cards' + 'x'*40
+        for num in range(40):
+            head['HISTORY'] = 'padding %d' % num
+        head['CRVAL2'] = 88.5
+        self.write(head, when + 10.0)
+        self.assertEqual(self.fresh_record().dec, 88.5)
+        self.assertEqual(self.parsed, [88.3, 88.4, 88.5])
+
+    def test_corrupt(self):
+        import json
+        self.fresh_record()
+        good = open(self.index).read()
+        entries = json.loads(good)['entries']
+        ident = entries['v.wcs']['ident']
+        for text in ('{"version": 1, "entries": {"v.wcs"',
+                     '\0\0\0\0',
+                     '[1, 2, 3]',
+                     json.dumps({'version': 0, 'entries': entries}),
+                     json.dumps({'version': 1, 'entries': [1, 2]}),
+                     json.dumps({'version': 1, 'entries': {'v.wcs': 7}}),
+                     json.dumps({'version': 1, 'entries': {'v.wcs': {
+                         'ident': ident}}}),
+                     json.dumps({'version': 1, 'entries': {'v.wcs': {
+                         'ident': ident, 'record': {'scale': 1.0}}}})):
+            with open(self.index, 'w') as fle:
+                fle.write(text)
+            del self.parsed[:]
+            self.assertEqual(self.fresh_record().scale, 4.19)
+            self.assertEqual(self.parsed, [88.3], text)
+            # and the sidecar is put right
+            self.assertEqual(json.load(open(self.index))['entries'],
+                             entries)
+
+
+if __name__ == '__main__':
+    unittest.main()